@@ -0,0 +1,120 @@
+import asyncio
+import json
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Dict, Callable, Awaitable, Tuple, Optional, Any
+from urllib.parse import urlsplit, parse_qsl
+
+from akp.logger import LOGGER
+
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+
+@dataclass
+class HttpRequest:
+    method: str
+    path: str
+    query: Dict[str, str] = field(default_factory=dict)
+    headers: Dict[str, str] = field(default_factory=dict)
+    body: bytes = b""
+
+    def json(self) -> Any:
+        return json.loads(self.body or b"{}")
+
+
+class HttpError(Exception):
+
+    def __init__(self, status: int, message: str, error_type: str = "invalid_request_error"):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.error_type = error_type
+
+
+Handler = Callable[[HttpRequest, asyncio.StreamWriter], Awaitable[None]]
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[HttpRequest]:
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+
+    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_SIZE:
+        raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Слишком большое тело запроса")
+    body = await reader.readexactly(length) if length else b""
+
+    url = urlsplit(target)
+    return HttpRequest(method.upper(), url.path, dict(parse_qsl(url.query)), headers, body)
+
+
+def write_head(writer: asyncio.StreamWriter, status: int, content_type: str,
+               length: Optional[int] = None, headers: Optional[Dict[str, str]] = None):
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+             f"Content-Type: {content_type}",
+             "Connection: close"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+
+def write_body(writer: asyncio.StreamWriter, status: int, body: bytes,
+               content_type: str = "text/plain; charset=utf-8", headers: Optional[Dict[str, str]] = None):
+    write_head(writer, status, content_type, len(body), headers)
+    writer.write(body)
+
+
+def write_json(writer: asyncio.StreamWriter, status: int, data: Any, headers: Optional[Dict[str, str]] = None):
+    body = json.dumps(data, ensure_ascii=False).encode()
+    write_body(writer, status, body, "application/json; charset=utf-8", headers)
+
+
+def start_sse(writer: asyncio.StreamWriter):
+    write_head(writer, HTTPStatus.OK, "text/event-stream; charset=utf-8", headers={"Cache-Control": "no-cache"})
+
+
+async def write_sse(writer: asyncio.StreamWriter, data: Any):
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    writer.write(f"data: {payload}\n\n".encode())
+    await writer.drain()
+
+
+async def serve_http(routes: Dict[Tuple[str, str], Handler], host: str, port: int):
+    """Minimal HTTP/1.1 server: one request per connection, routed by (method, path)."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await read_request(reader)
+            if request is None:
+                return
+
+            handler = routes.get((request.method, request.path))
+            if handler is None:
+                raise HttpError(HTTPStatus.NOT_FOUND, f"Неизвестный адрес: {request.method} {request.path}")
+            await handler(request, writer)
+        except HttpError as e:
+            write_json(writer, e.status, {"error": {"message": e.message, "type": e.error_type}})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            LOGGER.error("ChatGPT: Ошибка обработки HTTP запроса", exc_info=True)
+            write_json(writer, HTTPStatus.INTERNAL_SERVER_ERROR,
+                       {"error": {"message": repr(e), "type": "server_error"}})
+        finally:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    LOGGER.info(f"ChatGPT: HTTP сервер слушает {host}:{port}")
+    async with server:
+        await server.serve_forever()
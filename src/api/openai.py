@@ -0,0 +1,264 @@
+import asyncio
+import itertools
+import time
+import uuid
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Optional, List, Dict, Any
+
+from akp.logger import LOGGER
+from api.http import HttpRequest, HttpError, write_body, write_json, start_sse, write_sse, serve_http
+from llm import chatgpt_metrics
+from llm.chatgpt_config import get_config, list_config_names
+from llm.chatgpt_person import get_person
+from llm.chatgpt_pool import ChatGPTPool
+from llm.chatgpt_scheduler import ChatGPTScheduler, ProviderUnavailable
+
+
+@dataclass
+class CompletionJob:
+    prompt: str
+    config_name: str
+    person_name: Optional[str]
+    future: asyncio.Future
+    deltas: Optional[asyncio.Queue] = None
+    priority: int = 0
+    created: float = field(default_factory=time.monotonic)
+    task: Optional[asyncio.Task] = None
+
+    def cancel(self):
+        """Drop the job from the queue or stop the prompt that is already running."""
+        if not self.future.done():
+            self.future.cancel()
+        if self.task:
+            self.task.cancel()
+
+
+class CompletionQueue:
+    """Bounded priority queue (lower first) feeding a fixed set of pool sessions; rejects work when full."""
+
+    def __init__(self, pool: ChatGPTPool, workers: int, max_size: int):
+        self._pool = pool
+        self.scheduler = ChatGPTScheduler(pool)
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=max_size)
+        self._seq = itertools.count()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(workers)]
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, prompt: str, config_name: str, person_name: Optional[str], stream: bool,
+               priority: int = 0) -> CompletionJob:
+        job = CompletionJob(prompt, config_name, person_name, asyncio.get_running_loop().create_future(),
+                            asyncio.Queue() if stream else None, priority)
+        try:
+            self._queue.put_nowait((priority, next(self._seq), job))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise HttpError(HTTPStatus.TOO_MANY_REQUESTS, "Очередь запросов переполнена, повторите позже",
+                            "rate_limit_error")
+        return job
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "max_queued": self._queue.maxsize,
+            "workers": len(self._workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def _worker(self):
+        while True:
+            *_, job = await self._queue.get()
+            if job.future.done():
+                # клиент уже получил таймаут
+                continue
+
+            job.task = asyncio.create_task(self._run(job))
+            try:
+                # отмена задачи клиентом не должна останавливать обработчик очереди
+                await asyncio.wait({job.task})
+            finally:
+                job.task.cancel()
+
+    async def _run(self, job: CompletionJob):
+        try:
+            if job.deltas:
+                result = None
+                async for result in self.scheduler.stream(job.prompt, [job.config_name],
+                                                          person_name=job.person_name,
+                                                          priority=job.priority):
+                    if "delta" in result:
+                        job.deltas.put_nowait(result["delta"])
+            else:
+                result = await self.scheduler.submit(job.prompt, [job.config_name],
+                                                     person_name=job.person_name,
+                                                     priority=job.priority)
+            self.completed += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            LOGGER.error("ChatGPT: Ошибка выполнения запроса API", exc_info=True)
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            if job.deltas:
+                job.deltas.put_nowait(None)
+
+
+def messages_to_prompt(messages: List[Dict[str, Any]]) -> str:
+    def content(message) -> str:
+        value = message.get("content") or ""
+        if isinstance(value, list):
+            value = "".join(part.get("text", "") for part in value if part.get("type") == "text")
+        return value
+
+    if not messages:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Поле messages не может быть пустым")
+    if len(messages) == 1:
+        return content(messages[0])
+
+    # сессия RPA не хранит историю клиента - передаём диалог целиком одним сообщением:
+    # перевод строки в поле ввода отправил бы его по частям
+    return " ".join(f"{m.get('role', 'user')}: {content(m)}" for m in messages)
+
+
+class OpenAICompatibleAPI:
+
+    def __init__(self, pool: ChatGPTPool, max_queue: int = 16, timeout: float = 120):
+        self._pool = pool
+        self._timeout = timeout
+        self._max_queue = max_queue
+        self._queue: Optional[CompletionQueue] = None
+
+    async def serve(self, host: str, port: int):
+        await self._pool.start()
+        self._queue = CompletionQueue(self._pool, self._pool.max_browsers, self._max_queue)
+        try:
+            await serve_http({
+                ("GET", "/health"): self.health,
+                ("GET", "/v1/models"): self.models,
+                ("GET", "/metrics"): self.metrics,
+                ("POST", "/v1/chat/completions"): self.chat_completions,
+            }, host, port)
+        finally:
+            await self._queue.close()
+            await self._pool.close()
+
+    async def health(self, request: HttpRequest, writer: asyncio.StreamWriter):
+        write_json(writer, HTTPStatus.OK, {"status": "ok", "pool": self._pool.stats(), "queue": self._queue.stats(),
+                                           "providers": self._queue.scheduler.stats()})
+
+    async def metrics(self, request: HttpRequest, writer: asyncio.StreamWriter):
+        """Stage histograms and counters in the Prometheus text format (`?format=json` for JSON)."""
+        metrics = chatgpt_metrics.get_metrics()
+        if request.query.get("format") == "json":
+            write_json(writer, HTTPStatus.OK, metrics.snapshot())
+            return
+        write_body(writer, HTTPStatus.OK, metrics.prometheus().encode(), "text/plain; version=0.0.4; charset=utf-8")
+
+    async def models(self, request: HttpRequest, writer: asyncio.StreamWriter):
+        write_json(writer, HTTPStatus.OK, {
+            "object": "list",
+            "data": [{"id": name, "object": "model", "owned_by": "rpa"} for name in list_config_names()],
+        })
+
+    async def chat_completions(self, request: HttpRequest, writer: asyncio.StreamWriter):
+        try:
+            body = request.json()
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Тело запроса должно быть JSON")
+
+        config_name = body.get("model") or self._pool.config_name
+        if not get_config(config_name):
+            raise HttpError(HTTPStatus.NOT_FOUND, f"Неизвестная модель: {config_name}", "model_not_found")
+
+        person_name = body.get("person")
+        if person_name and not get_person(person_name):
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"Неизвестная персона: {person_name}")
+
+        prompt = messages_to_prompt(body.get("messages") or [])
+        try:
+            timeout = min(float(body.get("timeout", self._timeout)), self._timeout)
+            priority = int(body.get("priority", 0))
+        except (TypeError, ValueError):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Поля timeout и priority должны быть числами")
+        if not timeout > 0:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Поле timeout должно быть больше нуля")
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        job = self._queue.submit(prompt, config_name, person_name, bool(body.get("stream")), priority)
+        try:
+            if job.deltas:
+                await self._stream(writer, job, completion_id, config_name, timeout)
+                return
+
+            try:
+                result = await asyncio.wait_for(asyncio.shield(job.future), timeout)
+            except asyncio.TimeoutError:
+                raise HttpError(HTTPStatus.GATEWAY_TIMEOUT, "Превышено время ожидания ответа", "timeout")
+            except ProviderUnavailable as e:
+                raise HttpError(HTTPStatus.BAD_GATEWAY, str(e), "provider_error")
+        finally:
+            # таймаут или отключение клиента: браузер не должен дописывать ответ, который никто не прочитает
+            job.cancel()
+
+        write_json(writer, HTTPStatus.OK, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": config_name,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": result["response"]},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    async def _stream(self, writer: asyncio.StreamWriter, job: CompletionJob,
+                      completion_id: str, model: str, timeout: float):
+        def chunk(delta: dict, finish_reason: Optional[str] = None) -> dict:
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+
+        start_sse(writer)
+        await write_sse(writer, chunk({"role": "assistant"}))
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        error = None
+        while True:
+            try:
+                delta = await asyncio.wait_for(job.deltas.get(), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                # ответ оборван: клиент получил только его начало
+                job.cancel()
+                error = {"message": "Превышено время ожидания ответа", "type": "timeout"}
+                break
+            if delta is None:
+                break
+            await write_sse(writer, chunk({"content": delta}))
+
+        if job.future.done() and not job.future.cancelled() and job.future.exception():
+            e = job.future.exception()
+            error = {"message": str(e) if isinstance(e, ProviderUnavailable) else repr(e),
+                     "type": "provider_error" if isinstance(e, ProviderUnavailable) else "server_error"}
+        if error:
+            await write_sse(writer, {"error": error})
+
+        await write_sse(writer, chunk({}, "stop"))
+        await write_sse(writer, "[DONE]")
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import os
+import signal
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
+
+from akp.logger import LOGGER
+from config.config import settings
+from profiles import pid_alive
+from utils import get_browser_path
+
+
+def get_state_path() -> Path:
+    return get_browser_path() / settings.get("chatgpt.browser.state", "attach.json")
+
+
+def get_stop_path() -> Path:
+    """File `browser down` creates to stop the host where SIGTERM can't be handled (Windows)."""
+    return get_state_path().with_suffix(".stop")
+
+
+def read_state() -> Optional[dict]:
+    """State written by `browser up`, or None if no browser is running."""
+    path = get_state_path()
+    try:
+        state = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if not pid_alive(state.get("pid", 0)):
+        # процесс браузера убит без `browser down`
+        path.unlink(missing_ok=True)
+        return None
+    return state
+
+
+def debugger_address(address: str) -> str:
+    """host:port of the DevTools endpoint from `ws://host:port/devtools/browser/...` or `host:port`."""
+    if "://" in address:
+        return urlparse(address).netloc
+    return address
+
+
+class TabLocks:
+    """Hands out tabs of a shared browser to attached processes, one tab per attacher.
+
+    A tab is owned while its lock file (named by the CDP target id) exists. Released tabs
+    stay open on the main page for the next attacher, up to `max_free`; locks of dead
+    processes and closed tabs are removed on acquire.
+    """
+
+    def __init__(self, locks_dir: Path, max_free: int = 2):
+        self._dir = locks_dir
+        self._max_free = max_free
+        locks_dir.mkdir(parents=True, exist_ok=True)
+
+    async def acquire(self, driver, main_page: str) -> str:
+        pages = await self._pages(driver)
+        self._gc(pages)
+
+        # вкладка, оставленная на главной странице, не требует новой загрузки
+        for target_id, url in pages.items():
+            if main_page in url and self._claim(target_id):
+                LOGGER.debug(f"ChatGPT: Подключаюсь к свободной вкладке {target_id}")
+                await driver.switch_to.target(target_id)
+                return target_id
+
+        while True:
+            created = await driver.execute_cdp_cmd("Target.createTarget", {"url": "about:blank"})
+            target_id = created["targetId"]
+            if self._claim(target_id):
+                LOGGER.debug(f"ChatGPT: Открыл новую вкладку {target_id}")
+                await driver.switch_to.target(target_id)
+                return target_id
+
+    async def release(self, driver, target_id: str, main_page: str):
+        free = [t for t, url in (await self._pages(driver)).items()
+                if t != target_id and main_page in url and not self._lock(t).exists()]
+        if len(free) >= self._max_free:
+            try:
+                await driver.execute_cdp_cmd("Target.closeTarget", {"targetId": target_id})
+            except Exception:
+                LOGGER.debug(f"ChatGPT: Не удалось закрыть вкладку {target_id}", exc_info=True)
+        self._lock(target_id).unlink(missing_ok=True)
+
+    @staticmethod
+    async def _pages(driver) -> dict:
+        targets = (await driver.execute_cdp_cmd("Target.getTargets", {}))["targetInfos"]
+        return {t["targetId"]: t["url"] for t in targets if t["type"] == "page"}
+
+    def _gc(self, pages: dict):
+        for lock in self._dir.glob("*.lock"):
+            try:
+                pid = int(lock.read_text())
+            except (OSError, ValueError):
+                continue
+            if lock.stem not in pages or not pid_alive(pid):
+                lock.unlink(missing_ok=True)
+
+    def _lock(self, target_id: str) -> Path:
+        return self._dir / f"{target_id}.lock"
+
+    def _claim(self, target_id: str) -> bool:
+        try:
+            fd = os.open(self._lock(target_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        return True
+
+
+_TAB_LOCKS: Optional[TabLocks] = None
+
+
+def get_tab_locks() -> TabLocks:
+    global _TAB_LOCKS
+
+    if _TAB_LOCKS is None:
+        _TAB_LOCKS = TabLocks(get_browser_path() / settings.get("chatgpt.browser.tabs_dir", "attach_tabs"),
+                              max_free=settings.get("chatgpt.browser.max_free_tabs", 2))
+    return _TAB_LOCKS
+
+
+@asynccontextmanager
+async def attached_tab(address: str, main_page: str):
+    """Driver connected to an already running browser, switched to a tab owned by this process."""
+    from selenium_driverless import webdriver
+
+    from akp.selenium_driverless_ex import webdriver_ex
+    from llm import chatgpt_metrics
+
+    options = webdriver.ChromeOptions()
+    options.debugger_address = debugger_address(address)
+
+    tabs = get_tab_locks()
+    with chatgpt_metrics.stage("attach_driver"):
+        driver = await webdriver_ex.ChromeEx(options=options)
+        target_id = None
+        try:
+            target_id = await tabs.acquire(driver, main_page)
+        finally:
+            if target_id is None:
+                await driver.quit(clean_dirs=False)
+    try:
+        yield driver
+    finally:
+        try:
+            await tabs.release(driver, target_id, main_page)
+        finally:
+            # подключённый драйвер закрывает только своё соединение, браузер остаётся работать
+            await driver.quit(clean_dirs=False)
+
+
+def _read_devtools_port(profile: Path) -> Optional[dict]:
+    # Chrome записывает порт и путь отладчика в профиль при запуске
+    try:
+        port, path = (profile / "DevToolsActivePort").read_text().split("\n")[:2]
+    except (OSError, ValueError):
+        return None
+    return {"address": f"127.0.0.1:{port}", "ws": f"ws://127.0.0.1:{port}{path}"}
+
+
+async def run_browser_host(main_page: Optional[str] = None, check_interval=5.0):
+    """Keep a browser with the extension and a profile clone running until SIGTERM, `browser down`
+    or the browser's own exit; attach data for `ask --attach` is kept in the state file."""
+    from profiles import get_profile_manager
+    from utils import start_driver
+
+    profiles = get_profile_manager()
+    profile = profiles.acquire()
+    state_path = get_state_path()
+    driver = None
+    stop_path = get_stop_path()
+    stop_path.unlink(missing_ok=True)
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopped.set)
+        except NotImplementedError:
+            # Windows: Ctrl-C прерывает asyncio.run, а os.kill - это TerminateProcess без очистки,
+            # поэтому browser down просит остановиться файлом get_stop_path()
+            pass
+
+    try:
+        driver = await start_driver(profile)
+        if main_page:
+            # первый подключившийся получит уже загруженную главную страницу
+            await driver.get(main_page)
+
+        state = _read_devtools_port(profile)
+        deadline = loop.time() + 30
+        while state is None:
+            if loop.time() > deadline:
+                raise RuntimeError(f"Браузер не сообщил порт отладчика (нет {profile / 'DevToolsActivePort'})")
+            await asyncio.sleep(0.1)
+            state = _read_devtools_port(profile)
+        state = {**state, "pid": os.getpid(), "profile": str(profile)}
+        tmp_path = state_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(state, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, state_path)
+        LOGGER.info(f"ChatGPT: Браузер запущен, подключение: {state['ws']}")
+
+        while not stopped.is_set():
+            try:
+                await asyncio.wait_for(stopped.wait(), timeout=check_interval)
+            except asyncio.TimeoutError:
+                if stop_path.exists():
+                    LOGGER.info("ChatGPT: Получен запрос browser down, завершаю работу")
+                    break
+                try:
+                    await driver.execute_cdp_cmd("Browser.getVersion", {})
+                except Exception:
+                    LOGGER.error("ChatGPT: Браузер перестал отвечать, завершаю работу", exc_info=True)
+                    break
+    finally:
+        state = None
+        try:
+            state = json.loads(state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            pass
+        if state and state.get("pid") == os.getpid():
+            state_path.unlink(missing_ok=True)
+        stop_path.unlink(missing_ok=True)
+        if driver:
+            await driver.quit(clean_dirs=False)
+        profiles.release(profile)
@@ -0,0 +1,77 @@
+"""Бенчмарк запуска CLI: `python bench/import_time.py [--budget-ms 150]` из каталога src.
+
+Запускает `python -X importtime main.py <args>` несколько раз, печатает лучшее время
+и самые тяжёлые модули, и завершается с ошибкой при превышении бюджета или если
+`--help` импортировал браузерные модули.
+"""
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import click
+
+SRC_DIR = Path(__file__).resolve().parent.parent
+
+# эти модули не должны загружаться, пока команда не запущена
+FORBIDDEN_MODULES = ("selenium_driverless", "dynaconf", "akp")
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)$")
+
+
+def run_once(args: List[str]) -> Tuple[float, Dict[str, int]]:
+    """One CLI run: wall time in ms and cumulative import time (us) of every imported module."""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "main.py", *args],
+                            cwd=SRC_DIR, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise click.ClickException(f"main.py {' '.join(args)} завершился с кодом {result.returncode}:\n"
+                                   f"{result.stderr[-2000:]}")
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            _, cumulative, name = match.groups()
+            modules[name] = max(modules.get(name, 0), int(cumulative))
+    return wall_ms, modules
+
+
+@click.command()
+@click.option("--runs", type=int, default=5, show_default=True, help="Количество запусков")
+@click.option("--budget-ms", type=float, default=150, show_default=True,
+              help="Допустимое время запуска (лучший из запусков), мс")
+@click.option("--top", type=int, default=10, show_default=True, help="Сколько самых тяжёлых модулей показать")
+@click.argument("cli_args", nargs=-1)
+def main(runs, budget_ms, top, cli_args):
+    """Замерить время запуска `main.py` (по умолчанию `main.py --help`)."""
+    cli_args = list(cli_args) or ["--help"]
+
+    timings, modules = [], {}
+    for _ in range(runs):
+        wall_ms, modules = run_once(cli_args)
+        timings.append(wall_ms)
+
+    best = min(timings)
+    click.echo(f"main.py {' '.join(cli_args)}: лучшее {best:.1f} мс, "
+               f"медиана {sorted(timings)[len(timings) // 2]:.1f} мс ({runs} запусков)")
+    for name, cumulative in sorted(modules.items(), key=lambda m: m[1], reverse=True)[:top]:
+        click.echo(f"  {cumulative / 1000:8.1f} мс  {name}")
+
+    errors = []
+    if cli_args == ["--help"]:
+        loaded = sorted({name for name in modules if name.split(".")[0] in FORBIDDEN_MODULES})
+        if loaded:
+            errors.append(f"--help импортирует тяжёлые модули: {', '.join(loaded)}")
+    if best > budget_ms:
+        errors.append(f"время запуска {best:.1f} мс превышает бюджет {budget_ms:.0f} мс")
+
+    if errors:
+        raise click.ClickException("; ".join(errors))
+
+
+if __name__ == "__main__":
+    main()
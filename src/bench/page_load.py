@@ -0,0 +1,93 @@
+"""Загрузка главной страницы с блокировкой запросов и без неё.
+
+    python -m bench.page_load --config CHATAPP --config OPENAI --runs 3
+
+Для каждой конфигурации открывает главную страницу в новом браузере без правил
+блокировки и с правилами конфигурации (BlockRules) и печатает медианы: время до
+события load, время до появления поля ввода, число и объём загруженных ресурсов,
+JS heap и число узлов DOM вкладки (CDP Performance.getMetrics).
+"""
+import asyncio
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import click
+
+from commands.options import LazyChoice
+from llm.chatgpt_config import list_config_names
+
+_RESOURCES_JS = """
+const entries = performance.getEntriesByType("resource");
+return {count: entries.length, bytes: entries.reduce((sum, e) => sum + (e.transferSize || 0), 0)};
+"""
+
+
+async def measure(config_name: str, blocking: bool) -> Dict[str, float]:
+    from selenium_driverless.types.by import By
+
+    from llm.chatgpt_blocking import apply_block_rules
+    from llm.chatgpt_config import get_config
+    from utils import driver_session
+
+    cfg = get_config(config_name)
+    async with driver_session() as driver:
+        blocker = await apply_block_rules(driver, cfg.block_rules) if blocking else None
+
+        started = time.perf_counter()
+        await driver.get(cfg.main_page)
+        loaded = time.perf_counter()
+        await driver.find_element(By.XPATH, cfg.selectors["text_area_sel"], timeout=30)
+        ready = time.perf_counter()
+
+        resources = await driver.execute_script(_RESOURCES_JS)
+        await driver.execute_cdp_cmd("Performance.enable", {})
+        metrics = {m["name"]: m["value"] for m in
+                   (await driver.execute_cdp_cmd("Performance.getMetrics", {}))["metrics"]}
+
+    return {
+        "load": loaded - started,
+        "ready": ready - started,
+        "resources": resources["count"],
+        "transfer_mb": resources["bytes"] / 2 ** 20,
+        "js_heap_mb": metrics.get("JSHeapUsedSize", 0) / 2 ** 20,
+        "dom_nodes": metrics.get("Nodes", 0),
+        "blocked": blocker.blocked if blocker else 0,
+    }
+
+
+async def run_page_load(config_names: List[str], runs: int) -> Dict[str, Dict[str, Dict[str, float]]]:
+    results = {}
+    for config_name in config_names:
+        results[config_name] = {}
+        for mode, blocking in (("off", False), ("on", True)):
+            samples = [await measure(config_name, blocking) for _ in range(runs)]
+            results[config_name][mode] = {key: round(statistics.median(s[key] for s in samples), 3)
+                                          for key in samples[0]}
+    return results
+
+
+@click.command()
+@click.option("--config", "configs", multiple=True, required=True, type=LazyChoice(list_config_names),
+              help="Конфигурация (можно несколько)")
+@click.option("--runs", type=int, default=3, show_default=True, help="Запусков на режим, берётся медиана")
+@click.option("--output", type=click.Path(dir_okay=False, path_type=Path), help="Сохранить результаты в JSON")
+def main(configs, runs, output):
+    """Сравнить загрузку главной страницы с блокировкой запросов и без неё."""
+    results = asyncio.run(run_page_load(list(configs), runs))
+
+    for config_name, modes in results.items():
+        click.echo(config_name)
+        for key in modes["off"]:
+            before, after = modes["off"][key], modes["on"][key]
+            change = f"{(after - before) / before * 100:+.0f}%" if before else ""
+            click.echo(f"  {key:<12} без блокировки {before:>10}  с блокировкой {after:>10}  {change}")
+
+    if output:
+        output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
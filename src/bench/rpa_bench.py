@@ -0,0 +1,195 @@
+"""Сквозной бенчмарк ChatGPTRPA на локальной заглушке сайтов, без сети.
+
+    python -m bench.rpa_bench --prompts 20 --sessions 2 --ttft 0.3 --output bench.json
+
+Для каждой конфигурации STUB_<NAME> печатает p50/p95/p99 по этапам
+(открытие страницы, ввод промта, первый токен, полный ответ, сброс диалога)
+и пропускную способность; с `--output` сохраняет результаты в JSON для CI.
+С `--workers K` промты раздаёт WorkerCoordinator (как `ask-batch --workers`) K процессам
+по `--sessions` браузеров в каждом - так проверяется, как пропускная способность растёт
+с числом ядер. Этапы в этом режиме - из `timings` результата (acquire, send_prompt, ...).
+"""
+import asyncio
+import functools
+import json
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import click
+
+from bench.stub_site import StubOptions, StubSite, stub_options
+from llm.chatgpt_config import ChatGPTFlags, STUB_SITES, register_stub_configs
+
+STAGES = ("open", "send", "first_token", "response", "total", "reset")
+
+
+class StageTimings:
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        self.prompts = 0
+        self.errors = 0
+        self.failures = 0
+        self.chars = 0
+
+    def add(self, stage: str, seconds: float):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def add_result(self, result: dict):
+        """Account a WorkerCoordinator result: its stage timings, reply and errors."""
+        for stage, seconds in result.get("timings", {}).items():
+            self.add(stage, seconds)
+        if "error" in result:
+            self.failures += 1
+            return
+        self.prompts += 1
+        self.chars += len(result.get("response") or "")
+        if result.get("provider_error") or not result.get("response"):
+            self.errors += 1
+
+    def summary(self, wall: float) -> dict:
+        from llm.chatgpt_stats import percentile
+
+        return {
+            "prompts": self.prompts,
+            "errors": self.errors,
+            "failures": self.failures,
+            "wall": round(wall, 3),
+            "prompts_per_sec": round(self.prompts / wall, 3) if wall else None,
+            "chars_per_sec": round(self.chars / wall, 1) if wall else None,
+            "stages": {
+                stage: {f"p{int(q * 100)}": round(percentile(samples, q), 4) for q in (0.5, 0.95, 0.99)}
+                for stage, samples in self.samples.items() if samples
+            },
+        }
+
+
+async def run_session(config_name: str, prompts: asyncio.Queue, timings: StageTimings):
+    from akp.logger import LOGGER
+    from llm.chatgpt import ChatGPT
+    from utils import driver_session
+
+    async with driver_session() as driver:
+        chat_gpt = ChatGPT(driver, False, config_name)
+        rpa = chat_gpt.rpa
+
+        started = time.perf_counter()
+        await rpa.open_main_page()
+        timings.add("open", time.perf_counter() - started)
+
+        while not prompts.empty():
+            prompt = prompts.get_nowait()
+            try:
+                started = time.perf_counter()
+                await rpa.send_prompt(prompt)
+                sent = time.perf_counter()
+                timings.add("send", sent - started)
+
+                text = ""
+                async for delta in rpa.stream_response():
+                    if not text:
+                        timings.add("first_token", time.perf_counter() - sent)
+                    text += delta
+                done = time.perf_counter()
+                timings.add("response", done - sent)
+                timings.add("total", done - started)
+
+                timings.prompts += 1
+                timings.chars += len(text)
+                if rpa.last_response_error or not text:
+                    timings.errors += 1
+            except Exception:
+                LOGGER.warning(f"ChatGPT: Промт бенчмарка {config_name} завершился с ошибкой", exc_info=True)
+                timings.failures += 1
+
+            if chat_gpt.get_config().flags & ChatGPTFlags.START_NEW_CHAT:
+                started = time.perf_counter()
+                await rpa.new_chat()
+                timings.add("reset", time.perf_counter() - started)
+
+
+async def run_sessions(config_name: str, prompts: List[str], sessions: int) -> StageTimings:
+    queue: asyncio.Queue = asyncio.Queue()
+    for prompt in prompts:
+        queue.put_nowait(prompt)
+
+    timings = StageTimings()
+    await asyncio.gather(*(run_session(config_name, queue, timings) for _ in range(sessions)))
+    return timings
+
+
+def run_workers(config_name: str, base_url: str, prompts: List[str], sessions: int, workers: int) -> StageTimings:
+    from llm.chatgpt_workers import WorkerCoordinator, WorkerOptions
+
+    # без кэша: иначе повторный запуск замерит только попадания
+    options = WorkerOptions(sessions=sessions, config_name=config_name, use_cache=False,
+                            setup=functools.partial(register_stub_configs, base_url))
+    items = [{"id": i, "prompt": prompt, "config": config_name, "timings": True} for i, prompt in enumerate(prompts)]
+    timings = StageTimings()
+    WorkerCoordinator(workers, options).run(items, lambda item, result: timings.add_result(result))
+    return timings
+
+
+async def run_bench(config_names: List[str], prompts: int, sessions: int,
+                    options: StubOptions, host: str, port: int, workers: int = 1) -> Dict[str, dict]:
+    site = asyncio.create_task(StubSite(options).serve(host, port))
+    results = {}
+    try:
+        # дать серверу занять порт до первого открытия страницы
+        await asyncio.sleep(0.1)
+        for config_name in config_names:
+            texts = [f"Промт бенчмарка {i + 1}" for i in range(prompts)]
+            started = time.perf_counter()
+            if workers > 1:
+                # координатор блокирует поток, а заглушка отвечает из этого event loop
+                timings = await asyncio.get_running_loop().run_in_executor(
+                    None, run_workers, config_name, f"http://{host}:{port}", texts, sessions, workers)
+            else:
+                timings = await run_sessions(config_name, texts, sessions)
+            results[config_name] = timings.summary(time.perf_counter() - started)
+    finally:
+        site.cancel()
+    return results
+
+
+def print_results(results: Dict[str, dict]):
+    for config_name, result in results.items():
+        click.echo(f"{config_name}: {result['prompts']} промтов за {result['wall']:.2f} с, "
+                   f"{result['prompts_per_sec']} промт/с, {result['chars_per_sec']} симв/с, "
+                   f"ошибок {result['errors']}, сбоев {result['failures']}")
+        for stage, p in result["stages"].items():
+            click.echo(f"  {stage:<12} p50 {p['p50'] * 1000:8.1f} мс  p95 {p['p95'] * 1000:8.1f} мс  "
+                       f"p99 {p['p99'] * 1000:8.1f} мс")
+
+
+@click.command()
+@click.option("--config", "configs", multiple=True, type=click.Choice(STUB_SITES),
+              help="Сайт заглушки (по умолчанию все)")
+@click.option("--prompts", type=int, default=10, show_default=True, help="Промтов на конфигурацию")
+@click.option("--sessions", type=int, default=1, show_default=True, help="Параллельных браузеров (на процесс)")
+@click.option("--workers", type=int, default=1, show_default=True, help="Процессов с браузерами")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8712, show_default=True, help="Порт заглушки")
+@click.option("--output", type=click.Path(dir_okay=False, path_type=Path), help="Сохранить результаты в JSON")
+@stub_options
+def main(configs, prompts, sessions, workers, host, port, output, **options):
+    """Замерить ChatGPTRPA по этапам на локальной заглушке сайтов."""
+    from akp.logger import LOGGER
+    from config.config import settings
+
+    LOGGER.enable(settings.chatgpt.logging.enabled == 1)
+    register_stub_configs(f"http://{host}:{port}")
+
+    config_names = [f"STUB_{site}" for site in configs or STUB_SITES]
+    results = asyncio.run(run_bench(config_names, prompts, sessions, StubOptions(**options), host, port,
+                                    max(1, workers)))
+
+    print_results(results)
+    if output:
+        report = {"options": options, "workers": workers, "sessions": sessions, "results": results}
+        output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
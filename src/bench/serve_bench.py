@@ -0,0 +1,184 @@
+"""Бенчмарк OpenAI-совместимого API (`serve`) под насыщающей нагрузкой, без сети.
+
+    python -m bench.serve_bench --requests 50 --clients 8 --sessions 2 --stream --output serve.json
+
+Поднимает заглушку сайтов и `serve` на конфигурации STUB_<NAME>, после чего `--clients`
+клиентов (больше, чем `--sessions`, - очередь всегда заполнена) шлют запросы
+`POST /v1/chat/completions`, пока не будет получено `--requests` ответов. Печатает
+пропускную способность, p50/p95/p99 задержки (и первого фрагмента при `--stream`),
+число отказов 429 и ошибок; с `--output` сохраняет результаты в JSON для CI.
+"""
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import click
+
+from bench.stub_site import StubOptions, StubSite, stub_options
+from llm.chatgpt_config import STUB_SITES, register_stub_configs
+
+
+class ServeTimings:
+
+    def __init__(self):
+        self.latency: List[float] = []
+        self.first_chunk: List[float] = []
+        self.completed = 0
+        self.rejected = 0
+        self.errors = 0
+
+    def summary(self, wall: float) -> dict:
+        from llm.chatgpt_stats import percentile
+
+        def percentiles(samples: List[float]) -> Optional[dict]:
+            if not samples:
+                return None
+            return {f"p{int(q * 100)}": round(percentile(samples, q), 4) for q in (0.5, 0.95, 0.99)}
+
+        return {
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "wall": round(wall, 3),
+            "requests_per_sec": round(self.completed / wall, 3) if wall else None,
+            "latency": percentiles(self.latency),
+            "first_chunk": percentiles(self.first_chunk),
+        }
+
+
+async def post_completion(host: str, port: int, body: dict) -> Tuple[int, List[bytes], Optional[float]]:
+    """Status, body lines and seconds to the first streamed content chunk of one request."""
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        payload = json.dumps(body, ensure_ascii=False).encode()
+        writer.write(f"POST /v1/chat/completions HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        lines, first_chunk = [], None
+        while line := await reader.readline():
+            if first_chunk is None and line.startswith(b"data:") and b'"content"' in line:
+                first_chunk = time.perf_counter() - started
+            lines.append(line)
+        return status, lines, first_chunk
+    finally:
+        writer.close()
+
+
+async def run_client(host: str, port: int, config_name: str, stream: bool, remaining: List[int],
+                     timings: ServeTimings):
+    while remaining[0] > 0:
+        remaining[0] -= 1
+        started = time.perf_counter()
+        body = {"model": config_name, "stream": stream,
+                "messages": [{"role": "user", "content": f"Промт бенчмарка {remaining[0]}"}]}
+        status, lines, first_chunk = await post_completion(host, port, body)
+        if status == 429:
+            # очередь сервера полна - это и есть насыщение, запрос повторяется
+            timings.rejected += 1
+            remaining[0] += 1
+            await asyncio.sleep(0.05)
+            continue
+
+        timings.latency.append(time.perf_counter() - started)
+        if first_chunk is not None:
+            timings.first_chunk.append(first_chunk)
+        if status != 200 or any(b'"error"' in line for line in lines):
+            timings.errors += 1
+        else:
+            timings.completed += 1
+
+
+async def run_bench(config_names: List[str], requests: int, clients: int, sessions: int, max_queue: int,
+                    stream: bool, options: StubOptions, host: str, port: int, api_port: int) -> Dict[str, dict]:
+    from api.openai import OpenAICompatibleAPI
+    from llm.chatgpt_pool import ChatGPTPool
+
+    site = asyncio.create_task(StubSite(options).serve(host, port))
+    results = {}
+    try:
+        await asyncio.sleep(0.1)
+        for config_name in config_names:
+            # без кэша: иначе повторные промты замерят только попадания
+            pool = ChatGPTPool(size=sessions, max_browsers=sessions, idle_timeout=0, config_name=config_name)
+            api = OpenAICompatibleAPI(pool, max_queue=max_queue)
+            server = asyncio.create_task(api.serve(host, api_port))
+            try:
+                # serve принимает запросы после прогрева пула
+                while True:
+                    try:
+                        _, probe = await asyncio.wait_for(asyncio.open_connection(host, api_port), 1)
+                        probe.close()
+                        break
+                    except OSError:
+                        if server.done():
+                            server.result()
+                        await asyncio.sleep(0.2)
+
+                timings = ServeTimings()
+                remaining = [requests]
+                started = time.perf_counter()
+                await asyncio.gather(*(run_client(host, api_port, config_name, stream, remaining, timings)
+                                       for _ in range(clients)))
+                results[config_name] = timings.summary(time.perf_counter() - started)
+            finally:
+                server.cancel()
+                await asyncio.gather(server, return_exceptions=True)
+    finally:
+        site.cancel()
+    return results
+
+
+def print_results(results: Dict[str, dict]):
+    for config_name, result in results.items():
+        click.echo(f"{config_name}: {result['completed']} ответов за {result['wall']:.2f} с, "
+                   f"{result['requests_per_sec']} запр/с, отказов 429: {result['rejected']}, "
+                   f"ошибок {result['errors']}")
+        for name in ("latency", "first_chunk"):
+            p = result[name]
+            if p:
+                click.echo(f"  {name:<12} p50 {p['p50'] * 1000:8.1f} мс  p95 {p['p95'] * 1000:8.1f} мс  "
+                           f"p99 {p['p99'] * 1000:8.1f} мс")
+
+
+@click.command()
+@click.option("--config", "configs", multiple=True, type=click.Choice(STUB_SITES),
+              help="Сайт заглушки (по умолчанию все)")
+@click.option("--requests", type=int, default=20, show_default=True, help="Ответов на конфигурацию")
+@click.option("--clients", type=int, default=8, show_default=True, help="Одновременных клиентов")
+@click.option("--sessions", type=int, default=2, show_default=True, help="Браузеров serve")
+@click.option("--max-queue", type=int, default=16, show_default=True, help="Очередь serve (при переполнении - 429)")
+@click.option("--stream", is_flag=True, help="Запросы с \"stream\": true")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8712, show_default=True, help="Порт заглушки")
+@click.option("--api-port", type=int, default=8713, show_default=True, help="Порт serve")
+@click.option("--output", type=click.Path(dir_okay=False, path_type=Path), help="Сохранить результаты в JSON")
+@stub_options
+def main(configs, requests, clients, sessions, max_queue, stream, host, port, api_port, output, **options):
+    """Замерить пропускную способность serve на локальной заглушке сайтов."""
+    from akp.logger import LOGGER
+    from config.config import settings
+
+    LOGGER.enable(settings.chatgpt.logging.enabled == 1)
+    register_stub_configs(f"http://{host}:{port}")
+
+    config_names = [f"STUB_{site}" for site in configs or STUB_SITES]
+    results = asyncio.run(run_bench(config_names, requests, max(1, clients), max(1, sessions), max_queue, stream,
+                                    StubOptions(**options), host, port, api_port))
+
+    print_results(results)
+    if output:
+        report = {"options": options, "clients": clients, "sessions": sessions, "stream": stream,
+                  "results": results}
+        output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
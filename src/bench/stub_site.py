@@ -0,0 +1,234 @@
+"""Локальная заглушка сайтов GPT для замеров без сети.
+
+Страницы `/chatapp`, `/blackbox` и `/openai` повторяют разметку, которую ищут
+селекторы одноимённых конфигураций, и отвечают с заданной задержкой первого
+токена, скоростью, долей ошибок и всплывающими диалогами. Конфигурации
+STUB_<NAME> открывают эти страницы; они регистрируются только в бенчмарках
+(chatgpt_config.register_stub_configs), в ask и /v1/models их нет.
+
+    python -m bench.stub_site --port 8712 --ttft 0.5 --tokens-per-sec 40
+    python -m bench.rpa_bench --prompts=20 --sessions=2
+"""
+import asyncio
+import json
+from dataclasses import dataclass, asdict
+from http import HTTPStatus
+
+import click
+
+from api.http import HttpRequest, write_body, serve_http
+from llm.chatgpt_config import STUB_SITES
+
+# разметка поля ввода, кнопок и ответа под селекторы настоящих сайтов;
+# data-stub-text отмечает узел, в который печатается ответ
+_SITE_MARKUP = {
+    "CHATAPP": {
+        "input": '<textarea id="chat-input"></textarea>',
+        "send": '<button class="btn-send-message">Отправить</button>',
+        "stop": '<button class="btn-stop-response" hidden>Стоп</button>',
+        "reply": '<div class="chat-box ai-completed"><div class="message-completed" data-stub-text></div></div>',
+    },
+    "BLACKBOX": {
+        "input": '<textarea id="chat-input-box"></textarea>',
+        "send": '<button type="submit" style="margin-right: 4px"><span class="md:flex">Отправить</span></button>',
+        "stop": '<button type="button" style="margin-right: 4px" hidden><span class="md:flex">Стоп</span></button>',
+        "reply": '<div class="prose break-words" data-stub-text></div>',
+    },
+    "OPENAI": {
+        "input": '<div id="prompt-textarea" contenteditable="true"></div>',
+        "send": '<button data-testid="send-button">Отправить</button>',
+        "stop": '<button data-testid="stop-button" hidden>Стоп</button>',
+        "reply": '<div data-message-author-role="assistant" data-stub-text></div>',
+    },
+}
+
+_PAGE_HTML = r"""<!DOCTYPE html>
+<html lang="ru">
+<head><meta charset="utf-8"><title>Stub __SITE__</title></head>
+<body>
+<button class="btn-new-chat">Новый чат</button>
+<div id="messages"></div>
+<form id="composer" onsubmit="return false">__INPUT__ __SEND__ __STOP__</form>
+<script>
+const OPTIONS = __OPTIONS__;
+const REPLY_HTML = __REPLY__;
+const WORDS = ["заглушка", "отвечает", "на", "запрос", "с", "заданной", "скоростью", "и", "задержкой"];
+
+const messages = document.getElementById("messages");
+const composer = document.getElementById("composer");
+const input = composer.firstElementChild;
+const [send, stop] = composer.querySelectorAll("button");
+let generation = null;
+let replies = 0;
+
+function readInput() {
+    const value = input.value !== undefined ? input.value : input.innerText;
+    if (input.value !== undefined) input.value = ""; else input.innerText = "";
+    return value.trim();
+}
+
+function addMessage(html) {
+    const box = document.createElement("div");
+    box.innerHTML = html;
+    messages.append(box);
+    return box.querySelector("[data-stub-text]") || box.firstElementChild;
+}
+
+function addUserMessage(text) {
+    const msg = addMessage('<div class="user-message"></div>');
+    msg.textContent = text;
+}
+
+function addFiller(count) {
+    // рост DOM: разметка, которую сайты добавляют вокруг ответов (markdown, кнопки, аватары)
+    for (let i = 0; i < count; i++) {
+        const filler = document.createElement("div");
+        filler.className = "stub-filler";
+        messages.append(filler);
+    }
+}
+
+function showDialog() {
+    const dialog = document.createElement("div");
+    dialog.setAttribute("role", "dialog");
+    dialog.innerHTML = '<p>Войдите, чтобы сохранить историю</p><a href="#">Не входить</a>';
+    dialog.querySelector("a").addEventListener("click", (e) => {
+        e.preventDefault();
+        dialog.remove();
+    });
+    document.body.append(dialog);
+}
+
+function finish() {
+    if (!generation) return;
+    clearTimeout(generation.timer);
+    generation = null;
+    stop.hidden = true;
+    addFiller(OPTIONS.growth);
+    if (Math.random() < OPTIONS.dialog_rate) showDialog();
+}
+
+function submit() {
+    if (generation || document.querySelector("[role=dialog]")) return;
+    const prompt = readInput();
+    if (!prompt) return;
+
+    addUserMessage(prompt);
+    stop.hidden = false;
+    const n = ++replies;
+    generation = {timer: setTimeout(() => {
+        if (Math.random() < OPTIONS.error_rate) {
+            addMessage('<div class="chat-box ai-completed"><div class="message-error" data-stub-error>' +
+                'Произошла ошибка, попробуйте ещё раз</div></div>');
+            finish();
+            return;
+        }
+
+        const target = addMessage(REPLY_HTML);
+        const tokens = ["Ответ #" + n + ":"];
+        for (let i = 0; i < OPTIONS.tokens; i++) tokens.push(WORDS[(n + i) % WORDS.length]);
+        const interval = OPTIONS.tokens_per_sec > 0 ? 1000 / OPTIONS.tokens_per_sec : 0;
+        const tick = () => {
+            if (!generation) return;
+            target.append(document.createTextNode((target.textContent ? " " : "") + tokens.shift()));
+            if (tokens.length) generation.timer = setTimeout(tick, interval); else finish();
+        };
+        tick();
+    }, OPTIONS.ttft * 1000)};
+}
+
+send.addEventListener("click", submit);
+input.addEventListener("keydown", (e) => {
+    if (e.key === "Enter" && !e.shiftKey) submit();
+});
+stop.addEventListener("click", finish);
+document.querySelector(".btn-new-chat").addEventListener("click", () => {
+    finish();
+    messages.replaceChildren();
+    document.querySelectorAll("[role=dialog]").forEach(d => d.remove());
+});
+
+for (let i = 0; i < OPTIONS.history; i++) {
+    addUserMessage("Старый вопрос " + (i + 1));
+    addMessage(REPLY_HTML).textContent = "Старый ответ " + (i + 1);
+    addFiller(OPTIONS.growth);
+}
+</script>
+</body>
+</html>
+"""
+
+
+@dataclass
+class StubOptions:
+    ttft: float = 0.5  # задержка первого токена, с
+    tokens_per_sec: float = 40  # 0 - ответ целиком
+    tokens: int = 50  # длина ответа в словах
+    error_rate: float = 0.0
+    dialog_rate: float = 0.0  # доля ответов, после которых всплывает диалог
+    history: int = 0  # сообщений в диалоге при открытии страницы
+    growth: int = 0  # лишних узлов DOM на каждый ответ
+
+
+class StubSite:
+    """Serves the stub pages; `options` are read on every page load, so they can change between runs."""
+
+    def __init__(self, options: StubOptions):
+        self.options = options
+
+    def render(self, site: str) -> str:
+        markup = _SITE_MARKUP[site]
+        return (_PAGE_HTML
+                .replace("__SITE__", site)
+                .replace("__INPUT__", markup["input"])
+                .replace("__SEND__", markup["send"])
+                .replace("__STOP__", markup["stop"])
+                .replace("__REPLY__", json.dumps(markup["reply"]))
+                .replace("__OPTIONS__", json.dumps(asdict(self.options))))
+
+    def routes(self):
+        def page(site: str):
+            async def handler(request: HttpRequest, writer: asyncio.StreamWriter):
+                write_body(writer, HTTPStatus.OK, self.render(site).encode(), "text/html; charset=utf-8")
+            return handler
+
+        return {("GET", f"/{site.lower()}"): page(site) for site in STUB_SITES}
+
+    async def serve(self, host: str, port: int):
+        await serve_http(self.routes(), host, port)
+
+
+def stub_options(func):
+    """Shared click options describing the stub site behaviour."""
+    defaults = StubOptions()
+    options = [
+        click.option("--ttft", type=float, default=defaults.ttft, show_default=True,
+                     help="Задержка первого токена, с"),
+        click.option("--tokens-per-sec", type=float, default=defaults.tokens_per_sec, show_default=True,
+                     help="Скорость ответа (0 - ответ целиком)"),
+        click.option("--tokens", type=int, default=defaults.tokens, show_default=True, help="Длина ответа в словах"),
+        click.option("--error-rate", type=float, default=defaults.error_rate, show_default=True,
+                     help="Доля ответов с ошибкой"),
+        click.option("--dialog-rate", type=float, default=defaults.dialog_rate, show_default=True,
+                     help="Доля ответов, после которых всплывает диалог"),
+        click.option("--history", type=int, default=defaults.history, show_default=True,
+                     help="Сообщений в диалоге при открытии страницы"),
+        click.option("--growth", type=int, default=defaults.growth, show_default=True,
+                     help="Лишних узлов DOM на каждый ответ"),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8712, show_default=True)
+@stub_options
+def main(host, port, **options):
+    """Запустить заглушку сайтов GPT (страницы /chatapp, /blackbox, /openai)."""
+    asyncio.run(StubSite(StubOptions(**options)).serve(host, port))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,315 @@
 import asyncio
 import json
+from pathlib import Path
+from typing import Optional, TYPE_CHECKING
 
 import click
 
-from akp.logger import LOGGER
+from commands.options import LazyChoice
 from config.config import apply_cli_settings, settings
-from llm.chatgpt import ChatGPT
 from llm.chatgpt_config import list_config_names
 from llm.chatgpt_person import list_person_names
-from utils import start_driver
+
+# браузерные модули импортируются внутри функций, чтобы не замедлять запуск CLI (см. main.py)
+if TYPE_CHECKING:
+    from llm.chatgpt_cache import ResponseCache
 
 
 @click.command()
 @click.option("--chatgpt-log", type=int, help="Включить лог (0/1)")
-@click.option("--chatgpt-config-name", type=click.Choice(list_config_names()), help="Имя конфигурации")
-@click.option("--chatgpt-person-name", type=click.Choice(list_person_names()), help="Имя персонализации")
-@click.option("--prompt", required=True, help="Промт, на который GPT должен ответить")
-def ask(chatgpt_log, chatgpt_config_name, chatgpt_person_name, prompt):
+@click.option("--chatgpt-config-name", type=LazyChoice(list_config_names), help="Имя конфигурации")
+@click.option("--chatgpt-person-name", type=LazyChoice(list_person_names), help="Имя персонализации")
+@click.option("--pool", "use_pool", is_flag=True, help="Взять прогретую сессию у демона пула (команда pool)")
+@click.option("--stream", is_flag=True, help="Выводить ответ по частям в формате NDJSON")
+@click.option("--no-cache", is_flag=True, help="Не использовать кэш ответов")
+@click.option("--refresh", is_flag=True, help="Не брать ответ из кэша, но обновить его")
+@click.option("--race", callback=lambda ctx, param, value: _parse_config_list(value),
+              help="Спросить несколько конфигураций сразу и взять первый ответ без ошибки (CHATAPP,BLACKBOX)")
+@click.option("--hedge", is_flag=True, help="В режиме --race запускать запасные конфигурации по задержке p95")
+@click.option("--timings", is_flag=True, help="Добавить в JSON длительность этапов (запуск, загрузка, ввод, ответ)")
+@click.option("--attach", is_flag=False, flag_value="auto",
+              help="Открыть вкладку в уже запущенном браузере (ws://... или host:port; без значения - browser up)")
+@click.option("--attach-port", type=int, help="Открыть вкладку в браузере с отладчиком на 127.0.0.1:PORT")
+@click.option("--map-reduce", is_flag=True,
+              help="Разбить длинный текст на части по абзацам и предложениям и отправить их в несколько сессий")
+@click.option("--map-prompt", help="В режиме --map-reduce: задание, с которым отправляется каждая часть")
+@click.option("--reduce-prompt", help="В режиме --map-reduce: задание для итогового промта из ответов на части")
+@click.option("--checkpoint", type=click.Path(dir_okay=False, path_type=Path),
+              help="В режиме --map-reduce: файл готовых частей для продолжения прерванного задания "
+                   "(по умолчанию <prompt-file>.chunks.jsonl)")
+@click.option("--chunk-chars", type=int,
+              help="В режиме --map-reduce: размер части (по умолчанию - по конфигурации и длине ответа персоны)")
+@click.option("--rewrite", is_flag=True,
+              help="В режиме --map-reduce: ответ переписывает часть целиком (HTML_FORMATTER) - "
+                   "часть не длиннее ответа персоны")
+@click.option("--concurrency", type=int, default=2, show_default=True,
+              help="В режиме --map-reduce: количество параллельных браузеров")
+@click.option("--prompt-file", type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help="Прочитать промт из файла")
+@click.option("--prompt", help="Промт, на который GPT должен ответить")
+def ask(chatgpt_log, chatgpt_config_name, chatgpt_person_name, use_pool, stream, no_cache, refresh, race, hedge,
+        timings, attach, attach_port, map_reduce, map_prompt, reduce_prompt, checkpoint, chunk_chars, rewrite,
+        concurrency,
+        prompt_file, prompt):
     """Получить ответ от GPT и вывести JSON"""
+    from akp.logger import LOGGER
+    from llm.chatgpt_cache import get_response_cache
+
     apply_cli_settings(chatgpt_log, chatgpt_config_name, chatgpt_person_name)
     LOGGER.enable(settings.chatgpt.logging.enabled == 1)
-    result = asyncio.run(run_prompt(prompt))
+    if (attach or attach_port) and (use_pool or race or map_reduce):
+        # пул, гонка и map-reduce запускают собственные браузеры
+        raise click.UsageError("--attach и --attach-port нельзя сочетать с --pool, --race и --map-reduce")
+    attach = _attach_address(attach, attach_port)
+
+    if prompt_file:
+        prompt = prompt_file.read_text(encoding="utf-8")
+    if not prompt:
+        raise click.UsageError("Укажите --prompt или --prompt-file")
+
+    if map_reduce:
+        if not checkpoint and prompt_file:
+            checkpoint = prompt_file.with_suffix(".chunks.jsonl")
+        result = asyncio.run(run_map_reduce(prompt, map_prompt, reduce_prompt, checkpoint, chunk_chars,
+                                            max(1, concurrency), None if no_cache else get_response_cache(),
+                                            rewrite))
+        click.echo(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+
+    if race:
+        asyncio.run(run_race(prompt, race, hedge, None if no_cache else get_response_cache()))
+        return
+
+    cache = None if no_cache else get_response_cache()
+    if stream:
+        asyncio.run(echo_stream(run_cached_stream(prompt, cache, refresh, use_pool, attach)))
+        return
+
+    result = asyncio.run(run_cached_prompt(prompt, cache, refresh, use_pool, timings, attach))
     click.echo(json.dumps(result, ensure_ascii=False, indent=2))
 
 
-async def run_prompt(prompt: str) -> dict:
-    driver = await start_driver()
-    chat_gpt = ChatGPT(driver, True,
-                       config_name=settings.chatgpt.config.name,
-                       person_name=settings.chatgpt.person.name)
+async def run_cached_prompt(prompt: str, cache: Optional['ResponseCache'], refresh: bool, use_pool: bool,
+                            timings=False, attach: Optional[str] = None) -> dict:
+    from llm import chatgpt_metrics
 
-    response = None
+    with chatgpt_metrics.trace(settings.chatgpt.config.name) as trace:
+        result = await _run_cached_prompt(prompt, cache, refresh, use_pool, timings, attach)
+    if timings:
+        # этапы из демона пула точнее: там же запускался браузер
+        result.setdefault("timings", trace.timings())
+    return result
+
+
+async def _run_cached_prompt(prompt: str, cache: Optional['ResponseCache'], refresh: bool, use_pool: bool,
+                             timings: bool, attach: Optional[str] = None) -> dict:
+    # попадание в кэш не требует запуска браузера
+    if cache and not refresh:
+        result = _cache_hit(prompt, cache)
+        if result:
+            return result
+
+    if use_pool:
+        return await run_pool_prompt(prompt, use_cache=cache is not None, timings=timings)
+    return await run_prompt(prompt, cache, attach)
+
+
+async def run_cached_stream(prompt: str, cache: Optional['ResponseCache'], refresh: bool, use_pool: bool,
+                            attach: Optional[str] = None):
+    """Stream the reply; a cache hit comes as one chunk, a complete streamed reply is cached."""
+    if cache and not refresh:
+        result = _cache_hit(prompt, cache)
+        if result:
+            yield {"delta": result["response"]}
+            yield result
+            return
+
+    async for chunk in run_pool_stream(prompt) if use_pool else run_stream(prompt, attach):
+        if "delta" not in chunk:
+            # сообщения об ошибке провайдера и оборванные по таймауту ответы не кэшируются
+            if cache and chunk.get("response") and not chunk.get("provider_error") and not chunk.get("timeout"):
+                cache.put(_cache_key(prompt), chunk["response"])
+            chunk.setdefault("cached", False)
+        yield chunk
+
+
+def _cache_key(prompt: str) -> str:
+    from llm.chatgpt_cache import ResponseCache
+    from llm.chatgpt_person import get_person
+
+    return ResponseCache.make_key(settings.chatgpt.config.name, get_person(settings.chatgpt.person.name), prompt)
+
+
+def _cache_hit(prompt: str, cache: 'ResponseCache') -> Optional[dict]:
+    from llm import chatgpt_metrics
+
+    with chatgpt_metrics.stage("cache"):
+        response = cache.get(_cache_key(prompt))
+    if response is None:
+        return None
+    chatgpt_metrics.count("cache_hits")
+    return {
+        "config": settings.chatgpt.config.name,
+        "person": settings.chatgpt.person.name,
+        "prompt": prompt,
+        "response": response,
+        "cached": True
+    }
+
+
+def _attach_address(attach: Optional[str], attach_port: Optional[int]) -> Optional[str]:
+    if attach_port:
+        return f"127.0.0.1:{attach_port}"
+    if attach != "auto":
+        return attach
+
+    from attach import read_state
+
+    state = read_state()
+    if not state:
+        raise click.UsageError("Браузер не запущен: выполните browser up или укажите адрес в --attach")
+    return state["ws"]
+
+
+def _parse_config_list(value: Optional[str]):
+    if not value:
+        return None
+
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in list_config_names()]
+    if unknown:
+        raise click.BadParameter(f"Неизвестные конфигурации: {', '.join(unknown)}")
+    return names
+
+
+async def run_race(prompt: str, config_names, hedge: bool, cache: Optional['ResponseCache']):
+    from llm.chatgpt_pool import ChatGPTPool
+    from llm.chatgpt_race import race_prompt, wait_race_cleanup
+
+    pool = ChatGPTPool(size=0, max_browsers=len(config_names), idle_timeout=0,
+                       person_name=settings.chatgpt.person.name,
+                       cache=cache)
     try:
-        if await chat_gpt.rpa.open_main_page():
-            await chat_gpt.rpa.send_prompt(prompt)
-            response = await chat_gpt.rpa.get_last_response(start_delay=1)
+        result = await race_prompt(pool, prompt, config_names, hedge=hedge)
+        result["person"] = settings.chatgpt.person.name
+        # результат выводится сразу, проигравшие сессии закрываются после
+        click.echo(json.dumps(result, ensure_ascii=False, indent=2))
+        await wait_race_cleanup()
     finally:
-        await driver.quit(clean_dirs=False)
+        await pool.close()
+
+
+async def run_map_reduce(text: str, map_prompt: Optional[str], reduce_prompt: Optional[str],
+                         checkpoint: Optional[Path], chunk_chars: Optional[int], concurrency: int,
+                         cache: Optional['ResponseCache'], rewrite=False) -> dict:
+    from llm.chatgpt_mapreduce import map_reduce
+    from llm.chatgpt_pool import ChatGPTPool
+    from llm.chatgpt_scheduler import ChatGPTScheduler
+
+    # браузеры запускаются по мере надобности: частей может оказаться меньше, чем --concurrency
+    pool = ChatGPTPool(size=0, max_browsers=concurrency, idle_timeout=0,
+                       config_name=settings.chatgpt.config.name,
+                       person_name=settings.chatgpt.person.name,
+                       cache=cache)
+    try:
+        return await map_reduce(ChatGPTScheduler(pool), text, map_prompt, reduce_prompt,
+                                checkpoint_path=checkpoint, budget=chunk_chars, rewrite=rewrite)
+    finally:
+        await pool.close()
+
+
+async def echo_stream(chunks):
+    async for chunk in chunks:
+        click.echo(json.dumps(chunk, ensure_ascii=False))
+
+
+def _pool_request_for(prompt: str) -> dict:
+    return {
+        "config": settings.chatgpt.config.name,
+        "person": settings.chatgpt.person.name,
+        "prompt": prompt,
+    }
+
+
+async def run_pool_prompt(prompt: str, use_cache=True, timings=False) -> dict:
+    from akp.logger import LOGGER
+    from llm.chatgpt_cache import get_response_cache
+    from llm.chatgpt_pool import pool_request
+
+    # промах по кэшу уже проверен, демон только обновит запись
+    request = {**_pool_request_for(prompt), "refresh": True, "timings": timings}
+    try:
+        return await pool_request(request,
+                                  settings.get("chatgpt.pool.host", "127.0.0.1"),
+                                  settings.get("chatgpt.pool.port", 8710))
+    except OSError:
+        LOGGER.warning("ChatGPT: Демон пула недоступен, запускаю собственный браузер...")
+        return await run_prompt(prompt, get_response_cache() if use_cache else None)
+
+
+async def run_pool_stream(prompt: str):
+    from akp.logger import LOGGER
+    from llm.chatgpt_pool import pool_stream
+
+    started = False
+    try:
+        async for chunk in pool_stream(_pool_request_for(prompt),
+                                       settings.get("chatgpt.pool.host", "127.0.0.1"),
+                                       settings.get("chatgpt.pool.port", 8710)):
+            started = True
+            yield chunk
+        return
+    except OSError:
+        if started:
+            raise
+        LOGGER.warning("ChatGPT: Демон пула недоступен, запускаю собственный браузер...")
+
+    async for chunk in run_stream(prompt):
+        yield chunk
+
+
+async def run_prompt(prompt: str, cache: Optional['ResponseCache'] = None, attach: Optional[str] = None) -> dict:
+    from llm.chatgpt import ChatGPT
+    from utils import driver_session
+
+    response = None
+    async with driver_session(attach) as driver:
+        chat_gpt = ChatGPT(driver, True,
+                           config_name=settings.chatgpt.config.name,
+                           person_name=settings.chatgpt.person.name,
+                           cache=cache)
+        if await chat_gpt.rpa.open_main_page(reuse=attach is not None):
+            response = await chat_gpt.rpa.ask(prompt, refresh=True)
 
     return {
         "config": settings.chatgpt.config.name,
         "person": settings.chatgpt.person.name,
         "prompt": prompt,
-        "response": response
+        "response": response,
+        "cached": False
+    }
+
+
+async def run_stream(prompt: str, attach: Optional[str] = None):
+    from llm.chatgpt import ChatGPT
+    from utils import driver_session
+
+    response, error, timeout = "", False, False
+    async with driver_session(attach) as driver:
+        chat_gpt = ChatGPT(driver, True,
+                           config_name=settings.chatgpt.config.name,
+                           person_name=settings.chatgpt.person.name)
+        if await chat_gpt.rpa.open_main_page(reuse=attach is not None):
+            async for delta in chat_gpt.rpa.ask_stream(prompt):
+                response += delta
+                yield {"delta": delta}
+            error, timeout = chat_gpt.rpa.last_response_error, chat_gpt.rpa.last_response_timeout
+
+    yield {
+        "config": settings.chatgpt.config.name,
+        "person": settings.chatgpt.person.name,
+        "prompt": prompt,
+        "response": response or None,
+        "provider_error": error,
+        "timeout": timeout
     }
@@ -0,0 +1,139 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, Set, List
+
+import click
+
+from commands.options import LazyChoice
+from config.config import apply_cli_settings, settings
+from llm.chatgpt_config import list_config_names
+from llm.chatgpt_person import list_person_names
+
+if TYPE_CHECKING:
+    from llm.chatgpt_workers import WorkerOptions
+
+
+@click.command(name="ask-batch")
+@click.option("--chatgpt-log", type=int, help="Включить лог (0/1)")
+@click.option("--chatgpt-config-name", type=LazyChoice(list_config_names), help="Имя конфигурации")
+@click.option("--chatgpt-person-name", type=LazyChoice(list_person_names), help="Имя персонализации")
+@click.option("--input", "input_path", required=True, type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help="JSONL файл с промтами: {\"id\", \"prompt\", \"config\" или \"configs\", \"person\", "
+                   "\"priority\"}")
+@click.option("--output", "output_path", type=click.Path(dir_okay=False, path_type=Path),
+              help="NDJSON файл с ответами (по умолчанию <input>.out.jsonl)")
+@click.option("--concurrency", type=int, default=2, show_default=True,
+              help="Количество параллельных браузеров (на процесс при --workers)")
+@click.option("--workers", type=int, default=1, show_default=True,
+              help="Количество процессов со своими браузерами и event loop")
+@click.option("--no-cache", is_flag=True, help="Не использовать кэш ответов")
+def ask_batch(chatgpt_log, chatgpt_config_name, chatgpt_person_name, input_path, output_path, concurrency, workers,
+              no_cache):
+    """Получить ответы на промты из JSONL файла и записать их в NDJSON по мере готовности"""
+    from akp.logger import LOGGER
+
+    apply_cli_settings(chatgpt_log, chatgpt_config_name, chatgpt_person_name)
+    LOGGER.enable(settings.chatgpt.logging.enabled == 1)
+
+    output_path = output_path or input_path.with_suffix(".out.jsonl")
+    if workers > 1:
+        from llm.chatgpt_workers import WorkerOptions
+
+        options = WorkerOptions(sessions=max(1, concurrency), config_name=chatgpt_config_name,
+                                person_name=chatgpt_person_name, log=chatgpt_log, use_cache=not no_cache)
+        run_sharded_batch(input_path, output_path, workers, options)
+    else:
+        asyncio.run(run_batch(input_path, output_path, max(1, concurrency), use_cache=not no_cache))
+
+
+def read_batch(input_path: Path) -> List[dict]:
+    items = []
+    with input_path.open(encoding="utf-8") as f:
+        for line_no, line in enumerate(f):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item.setdefault("id", line_no)
+            items.append(item)
+    return items
+
+
+def read_done_ids(output_path: Path) -> Set:
+    """Ids that already have a successful result in the output file."""
+    done = set()
+    if not output_path.exists():
+        return done
+
+    with output_path.open(encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # строка, оборванная при падении процесса
+                continue
+            if "error" not in result:
+                done.add(result["id"])
+    return done
+
+
+def read_pending(input_path: Path, output_path: Path) -> List[dict]:
+    """Items without a successful result yet, lower "priority" first, file order within one priority."""
+    from akp.logger import LOGGER
+
+    done = read_done_ids(output_path)
+    items = [item for item in read_batch(input_path) if item["id"] not in done]
+    items.sort(key=lambda i: i.get("priority", 0))
+    LOGGER.info(f"ChatGPT: Пакет: {len(items)} промтов, уже готово {len(done)}")
+    return items
+
+
+def run_sharded_batch(input_path: Path, output_path: Path, workers: int, options: 'WorkerOptions'):
+    from llm.chatgpt_workers import WorkerCoordinator
+
+    items = read_pending(input_path, output_path)
+    if not items:
+        return
+
+    with output_path.open("a", encoding="utf-8") as out:
+
+        def write(item: dict, result: dict):
+            out.write(json.dumps({"id": item["id"], **result}, ensure_ascii=False) + "\n")
+            out.flush()
+
+        WorkerCoordinator(min(workers, len(items)), options).run(items, write)
+
+
+async def run_batch(input_path: Path, output_path: Path, concurrency: int, use_cache=True):
+    from llm.chatgpt_cache import get_response_cache
+    from llm.chatgpt_pool import ChatGPTPool
+    from llm.chatgpt_scheduler import ChatGPTScheduler
+    from llm.chatgpt_workers import answer_item
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in read_pending(input_path, output_path):
+        queue.put_nowait(item)
+    if queue.empty():
+        return
+
+    pool = ChatGPTPool(size=min(concurrency, queue.qsize()), max_browsers=concurrency, idle_timeout=0,
+                       config_name=settings.chatgpt.config.name,
+                       person_name=settings.chatgpt.person.name,
+                       cache=get_response_cache() if use_cache else None)
+    scheduler = ChatGPTScheduler(pool)
+
+    with output_path.open("a", encoding="utf-8") as out:
+
+        async def worker():
+            while not queue.empty():
+                item = queue.get_nowait()
+                result = await answer_item(scheduler, item)
+
+                out.write(json.dumps({"id": item["id"], **result}, ensure_ascii=False) + "\n")
+                out.flush()
+
+        await pool.start()
+        try:
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+        finally:
+            await pool.close()
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import click
+
+from commands.options import LazyChoice
+from config.config import apply_cli_settings, settings
+from llm.chatgpt_config import list_config_names
+
+
+@click.group()
+def browser():
+    """Держать браузер запущенным для ask --attach"""
+    pass
+
+
+@browser.command()
+@click.option("--chatgpt-log", type=int, help="Включить лог (0/1)")
+@click.option("--chatgpt-config-name", type=LazyChoice(list_config_names),
+              help="Конфигурация, главная страница которой открывается заранее")
+@click.option("--foreground", is_flag=True, help="Не уходить в фон (браузер работает, пока работает команда)")
+@click.option("--timeout", type=float, default=60, show_default=True, help="Сколько секунд ждать запуска браузера")
+def up(chatgpt_log, chatgpt_config_name, foreground, timeout):
+    """Запустить браузер с расширениями и профилем и вывести адрес для подключения"""
+    from akp.logger import LOGGER
+    from attach import read_state, get_state_path, run_browser_host
+    from llm.chatgpt_config import get_config
+
+    apply_cli_settings(chatgpt_log, chatgpt_config_name, None)
+    LOGGER.enable(settings.chatgpt.logging.enabled == 1)
+
+    state = read_state()
+    if state:
+        click.echo(json.dumps(state, ensure_ascii=False, indent=2))
+        return
+
+    if foreground:
+        asyncio.run(run_browser_host(get_config(settings.chatgpt.config.name).main_page))
+        return
+
+    args = [sys.executable, sys.argv[0], "browser", "up", "--foreground"]
+    if chatgpt_log is not None:
+        args += ["--chatgpt-log", str(chatgpt_log)]
+    if chatgpt_config_name:
+        args += ["--chatgpt-config-name", chatgpt_config_name]
+
+    log_path = get_state_path().with_suffix(".log")
+    with log_path.open("ab") as log:
+        # своя сессия/группа процессов: Ctrl-C в терминале не останавливает браузер
+        if os.name == "nt":
+            process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                                       creationflags=subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.DETACHED_PROCESS)
+        else:
+            process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                                       start_new_session=True)
+
+    deadline = time.monotonic() + timeout
+    while (state := read_state()) is None:
+        if process.poll() is not None:
+            raise click.ClickException(f"Браузер не запустился (код {process.returncode}), см. {log_path}")
+        if time.monotonic() > deadline:
+            process.terminate()
+            raise click.ClickException(f"Браузер не запустился за {timeout:.0f} с, см. {log_path}")
+        time.sleep(0.2)
+    click.echo(json.dumps(state, ensure_ascii=False, indent=2))
+
+
+@browser.command()
+@click.option("--timeout", type=float, default=30, show_default=True, help="Сколько секунд ждать остановки")
+def down(timeout):
+    """Остановить браузер, запущенный browser up"""
+    import signal
+
+    from attach import read_state, get_state_path, get_stop_path
+    from profiles import pid_alive
+
+    state = read_state()
+    if not state:
+        click.echo("Браузер не запущен")
+        return
+
+    pid = state["pid"]
+    if os.name == "nt":
+        # os.kill на Windows убивает процесс без очистки: браузер, блокировка профиля и файл состояния
+        # остались бы, поэтому хост останавливается сам при следующей проверке браузера
+        get_stop_path().touch()
+    else:
+        os.kill(pid, signal.SIGTERM)
+    deadline = time.monotonic() + timeout
+    while pid_alive(pid):
+        if time.monotonic() > deadline:
+            raise click.ClickException(f"Процесс браузера {pid} не завершился за {timeout:.0f} с")
+        time.sleep(0.2)
+    get_state_path().unlink(missing_ok=True)
+    click.echo("Браузер остановлен")
@@ -1,16 +1,23 @@
-from typing import Optional
+import os
+import signal
+import sys
+import threading
+from typing import Optional, TYPE_CHECKING
 
 import click
 import asyncio
 
-from akp.logger import LOGGER
+from commands.options import LazyChoice
 from config.config import settings, apply_cli_settings
-from llm.chatgpt import ChatGPT
 from llm.chatgpt_config import list_config_names
 from llm.chatgpt_person import list_person_names, get_person
-from utils import start_driver
 
-_CHAT_GPT_INSTANCE: Optional[ChatGPT] = None
+# браузерные модули импортируются внутри функций, чтобы не замедлять запуск CLI (см. main.py)
+if TYPE_CHECKING:
+    from llm.chatgpt import ChatGPT
+
+_CHAT_GPT_INSTANCE: Optional['ChatGPT'] = None
+_READER: Optional['PromptReader'] = None
 
 _COMMANDS = {
     '-q': (lambda: _cmd_exit(_CHAT_GPT_INSTANCE), "Выход из чата."),
@@ -19,10 +26,59 @@ _COMMANDS = {
     '--help': (lambda: _cmd_show_help(_CHAT_GPT_INSTANCE), "Показать доступные команды."),
     '-h': (lambda: _cmd_show_help(_CHAT_GPT_INSTANCE), "Показать доступные команды."),
     '--person': (lambda: _cmd_change_person(_CHAT_GPT_INSTANCE), "Изменить текущую персону."),
+    '--stats': (lambda: _cmd_show_stats(_CHAT_GPT_INSTANCE), "Показать статистику диалога."),
 }
 
 
-def _cmd_change_person(chatgpt: ChatGPT):
+class PromptReader:
+    """Reads input lines in a daemon thread so the event loop keeps running while the user types.
+
+    Lines typed while a reply is generating are queued and sent one by one afterwards.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        threading.Thread(target=self._run, name="chat-input", daemon=True).start()
+
+    def _run(self):
+        # os.read вместо input(): поток, ждущий ввода при выходе, не держит блокировку буфера stdin
+        fd, encoding = sys.stdin.fileno(), sys.stdin.encoding or "utf-8"
+        buffer = b""
+        while chunk := os.read(fd, 4096):
+            buffer += chunk
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                self._put(line.decode(encoding, errors="replace").rstrip("\r"))
+        if buffer:
+            self._put(buffer.decode(encoding, errors="replace"))
+        self._put(None)
+
+    def _put(self, line: Optional[str]):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, line)
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    async def read(self, label: str, timeout: Optional[float] = None, show_label=True) -> Optional[str]:
+        """Next line, None on end of input; raises asyncio.TimeoutError after `timeout` seconds."""
+        if not self._queue.empty():
+            line = self._queue.get_nowait()
+            if line is not None:
+                # промт, набранный во время ответа, повторяется в истории на своём месте
+                click.echo(f"{label}: {line}")
+            return line
+
+        if show_label:
+            click.echo(f"{label}: ", nl=False)
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+    def close(self):
+        self._queue.put_nowait(None)
+
+
+async def _cmd_change_person(chatgpt: 'ChatGPT'):
     click.echo(f"Текущая персона: {chatgpt.get_person().name}")
 
     person_names = list_person_names()
@@ -30,7 +86,8 @@ def _cmd_change_person(chatgpt: ChatGPT):
     for idx, name in enumerate(person_names, 1):
         click.echo(f"  {idx}. {name} ({get_person(name).ai_character})")
 
-    choice = click.prompt("Введите номер новой персоны", type=int)
+    line = await _READER.read("Введите номер новой персоны")
+    choice = int(line) if line and line.strip().isdigit() else 0
     if 1 <= choice <= len(person_names):
         new_person = person_names[choice - 1]
         settings.update({"chatgpt.person.name": new_person})
@@ -42,12 +99,22 @@ def _cmd_change_person(chatgpt: ChatGPT):
     return None
 
 
-def _cmd_exit(chatgpt: ChatGPT):
+def _cmd_show_stats(chatgpt: 'ChatGPT'):
+    stats = chatgpt.conversation.stats()
+    click.echo(f"Сообщений: {stats['messages']}, персона передана: {stats['primes']} раз\n"
+               f"Отправлено символов: {stats['chars_sent']}, сэкономлено: {stats['chars_saved']}")
+    timings = chatgpt.rpa.wait_timings()
+    click.echo(f"Ожидания: страница {timings.page_timeout:.1f} с, ответ {timings.response_timeout:.1f} с, "
+               f"пауза в ответе {timings.quiet:.2f} с")
+    return None
+
+
+def _cmd_exit(chatgpt: 'ChatGPT'):
     click.echo("Выход из чата.")
     return 'exit'
 
 
-def _cmd_show_help(chatgpt: ChatGPT):
+def _cmd_show_help(chatgpt: 'ChatGPT'):
     click.echo("Доступные команды:")
     for cmd, (func, description) in _COMMANDS.items():
         click.echo(f"  {cmd.ljust(12)} {description}")
@@ -56,48 +123,118 @@ def _cmd_show_help(chatgpt: ChatGPT):
 
 @click.command()
 @click.option("--chatgpt-log", type=int, help="Включить лог (0/1)")
-@click.option("--chatgpt-config-name", type=click.Choice(list_config_names()), help="Имя конфигурации")
-@click.option("--chatgpt-person-name", type=click.Choice(list_person_names()), help="Имя персонализации")
+@click.option("--chatgpt-config-name", type=LazyChoice(list_config_names), help="Имя конфигурации")
+@click.option("--chatgpt-person-name", type=LazyChoice(list_person_names), help="Имя персонализации")
 def chat(chatgpt_log, chatgpt_config_name, chatgpt_person_name):
     """Интерактивный режим чата"""
+    from akp.logger import LOGGER
+
     apply_cli_settings(chatgpt_log, chatgpt_config_name, chatgpt_person_name)
     LOGGER.enable(settings.chatgpt.logging.enabled == 1)
     asyncio.run(run_chat())
 
 
-async def run_chat():
-    global _CHAT_GPT_INSTANCE
-
-    driver = await start_driver()
-    chat_gpt = _CHAT_GPT_INSTANCE = ChatGPT(driver, True,
-                                            config_name=settings.chatgpt.config.name,
-                                            person_name=settings.chatgpt.person.name)
+async def _answer(chat_gpt: 'ChatGPT', prompt: str):
+    click.echo("Ответ: ", nl=False)
+    async for delta in chat_gpt.rpa.ask_stream(prompt):
+        click.echo(delta, nl=False)
+    click.echo()
 
-    try:
-        if await chat_gpt.rpa.open_main_page():
 
-            config_name = chat_gpt.get_config().name
-            person_name = chat_gpt.get_person().name
-            config_main_page = chat_gpt.get_config().main_page
-            person_ai_character = chat_gpt.get_person().ai_character
+async def run_chat():
+    from akp.logger import LOGGER
+    from llm.chatgpt import ChatGPT
+    from utils import driver_session
+
+    global _CHAT_GPT_INSTANCE, _READER
+
+    async with driver_session() as driver:
+        chat_gpt = _CHAT_GPT_INSTANCE = ChatGPT(driver, True,
+                                                config_name=settings.chatgpt.config.name,
+                                                person_name=settings.chatgpt.person.name)
+        chat_gpt.keep_context = True
+        if not await chat_gpt.rpa.open_main_page():
+            return
+
+        config_name = chat_gpt.get_config().name
+        person_name = chat_gpt.get_person().name
+        config_main_page = chat_gpt.get_config().main_page
+        person_ai_character = chat_gpt.get_person().ai_character
+
+        click.echo(f"Конфигурация: {config_name} ({config_main_page})\n"
+                   f"Персона: {person_name} ({person_ai_character})\n"
+                   f"Промты можно вводить, пока генерируется ответ; Ctrl-C останавливает генерацию.")
+
+        reader = _READER = PromptReader()
+        generation: Optional[asyncio.Task] = None
+        stopped = False
+
+        def interrupt():
+            nonlocal stopped
+            # Ctrl-C во время ответа нажимает кнопку остановки, в ожидании ввода - выход из чата
+            if generation and not generation.done():
+                stopped = True
+                generation.cancel()
+            else:
+                reader.close()
+
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGINT, interrupt)
+        except NotImplementedError:
+            # Windows: Ctrl-C прерывает чат как раньше
+            pass
+
+        keep_warm = settings.get("chatgpt.chat.keep_warm", 60) or None
+        # сразу после ответа страница готовится к следующему ходу, дальше - раз в keep_warm секунд простоя
+        warm, waiting = True, False
+        try:
+            while True:
+                if warm:
+                    try:
+                        await chat_gpt.rpa.keep_warm()
+                    except Exception:
+                        LOGGER.warning("ChatGPT: Не удалось подготовить страницу к следующему ходу.", exc_info=True)
+
+                try:
+                    prompt = await reader.read("Введите промт", keep_warm, show_label=not waiting)
+                except asyncio.TimeoutError:
+                    warm, waiting = True, True
+                    continue
+                warm, waiting = False, False
 
-            click.echo(f"Конфигурация: {config_name} ({config_main_page})\n"
-                       f"Персона: {person_name} ({person_ai_character})")
+                if prompt is None:
+                    click.echo()
+                    break
 
-            while True:
-                prompt = click.prompt("Введите промт")
                 command = prompt.strip().lower()
+                if not command:
+                    continue
                 if command in _COMMANDS:
                     result = _COMMANDS[command][0]()
+                    if asyncio.iscoroutine(result):
+                        result = await result
                     if result == 'exit':
                         break
                     continue
 
                 # Обработка обычного промта
-                await chat_gpt.rpa.send_prompt(prompt)
-                response = await chat_gpt.rpa.get_last_response(start_delay=1)
-                click.echo(f"Ответ: {response}")
-
-    finally:
-        if driver:
-            await driver.quit(clean_dirs=False)
+                generation, stopped = asyncio.create_task(_answer(chat_gpt, prompt)), False
+                try:
+                    await generation
+                except asyncio.CancelledError:
+                    if not stopped:
+                        raise
+                    click.echo("\n[Генерация остановлена]")
+                    await chat_gpt.rpa.stop_generation()
+                finally:
+                    generation = None
+
+                if reader.queued:
+                    click.echo(f"[В очереди промтов: {reader.queued}]")
+                warm = True
+        finally:
+            try:
+                loop.remove_signal_handler(signal.SIGINT)
+            except NotImplementedError:
+                pass
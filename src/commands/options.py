@@ -0,0 +1,18 @@
+from typing import Callable, Optional, Sequence
+
+import click
+
+
+class LazyChoice(click.Choice):
+    """click.Choice whose choices are computed on first use rather than at import time."""
+
+    def __init__(self, get_choices: Callable[[], Sequence[str]], case_sensitive: bool = True):
+        self._get_choices = get_choices
+        self._choices: Optional[Sequence[str]] = None
+        self.case_sensitive = case_sensitive
+
+    @property
+    def choices(self) -> Sequence[str]:
+        if self._choices is None:
+            self._choices = list(self._get_choices())
+        return self._choices
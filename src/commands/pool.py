@@ -0,0 +1,53 @@
+import asyncio
+from typing import TYPE_CHECKING
+
+import click
+
+from commands.options import LazyChoice
+from config.config import apply_cli_settings, settings
+from llm.chatgpt_config import list_config_names
+from llm.chatgpt_person import list_person_names
+
+if TYPE_CHECKING:
+    from llm.chatgpt_pool import ChatGPTPool
+
+
+@click.command()
+@click.option("--chatgpt-log", type=int, help="Включить лог (0/1)")
+@click.option("--chatgpt-config-name", type=LazyChoice(list_config_names), help="Имя конфигурации")
+@click.option("--chatgpt-person-name", type=LazyChoice(list_person_names), help="Имя персонализации")
+@click.option("--size", type=int, help="Количество прогретых браузеров")
+@click.option("--max-browsers", type=int, help="Максимальное количество браузеров")
+@click.option("--idle-timeout", type=float, help="Закрывать браузеры, простаивающие дольше N секунд (0 - не закрывать)")
+@click.option("--host", help="Адрес демона пула")
+@click.option("--port", type=int, help="Порт демона пула")
+def pool(chatgpt_log, chatgpt_config_name, chatgpt_person_name, size, max_browsers, idle_timeout, host, port):
+    """Запустить демон пула прогретых браузеров для команды ask --pool"""
+    from akp.logger import LOGGER
+    from llm.chatgpt_cache import get_response_cache
+    from llm.chatgpt_pool import ChatGPTPool
+
+    apply_cli_settings(chatgpt_log, chatgpt_config_name, chatgpt_person_name)
+    LOGGER.enable(settings.chatgpt.logging.enabled == 1)
+
+    chatgpt_pool = ChatGPTPool(
+        size=size or settings.get("chatgpt.pool.size", 1),
+        max_browsers=max_browsers or settings.get("chatgpt.pool.max_browsers", 4),
+        idle_timeout=settings.get("chatgpt.pool.idle_timeout", 600) if idle_timeout is None else idle_timeout,
+        config_name=settings.chatgpt.config.name,
+        person_name=settings.chatgpt.person.name,
+        cache=get_response_cache(),
+    )
+    asyncio.run(run_pool(chatgpt_pool,
+                         host or settings.get("chatgpt.pool.host", "127.0.0.1"),
+                         port or settings.get("chatgpt.pool.port", 8710)))
+
+
+async def run_pool(chatgpt_pool: 'ChatGPTPool', host: str, port: int):
+    from llm.chatgpt_pool import serve_pool
+
+    await chatgpt_pool.start()
+    try:
+        await serve_pool(chatgpt_pool, host, port)
+    finally:
+        await chatgpt_pool.close()
@@ -0,0 +1,39 @@
+import asyncio
+
+import click
+
+from commands.options import LazyChoice
+from config.config import apply_cli_settings, settings
+from llm.chatgpt_config import list_config_names
+from llm.chatgpt_person import list_person_names
+
+
+@click.command()
+@click.option("--chatgpt-log", type=int, help="Включить лог (0/1)")
+@click.option("--chatgpt-config-name", type=LazyChoice(list_config_names), help="Имя конфигурации")
+@click.option("--chatgpt-person-name", type=LazyChoice(list_person_names), help="Имя персонализации")
+@click.option("--sessions", type=int, help="Количество живых сессий GPT")
+@click.option("--max-queue", type=int, help="Размер очереди запросов (при переполнении - 429)")
+@click.option("--timeout", type=float, help="Таймаут одного запроса в секундах")
+@click.option("--host", help="Адрес HTTP сервера")
+@click.option("--port", type=int, help="Порт HTTP сервера")
+def serve(chatgpt_log, chatgpt_config_name, chatgpt_person_name, sessions, max_queue, timeout, host, port):
+    """Запустить OpenAI-совместимый HTTP API (/v1/chat/completions)"""
+    from akp.logger import LOGGER
+    from api.openai import OpenAICompatibleAPI
+    from llm.chatgpt_cache import get_response_cache
+    from llm.chatgpt_pool import ChatGPTPool
+
+    apply_cli_settings(chatgpt_log, chatgpt_config_name, chatgpt_person_name)
+    LOGGER.enable(settings.chatgpt.logging.enabled == 1)
+
+    sessions = sessions or settings.get("chatgpt.serve.sessions", 2)
+    chatgpt_pool = ChatGPTPool(size=sessions, max_browsers=sessions, idle_timeout=0,
+                               config_name=settings.chatgpt.config.name,
+                               person_name=settings.chatgpt.person.name,
+                               cache=get_response_cache())
+    api = OpenAICompatibleAPI(chatgpt_pool,
+                              max_queue=max_queue or settings.get("chatgpt.serve.max_queue", 16),
+                              timeout=timeout or settings.get("chatgpt.serve.timeout", 120))
+    asyncio.run(api.serve(host or settings.get("chatgpt.serve.host", "127.0.0.1"),
+                          port or settings.get("chatgpt.serve.port", 8711)))
@@ -1,11 +1,28 @@
-import click
-from dynaconf import Dynaconf
-
-# Загружаем конфигурацию из файлов
-settings = Dynaconf(
-    envvar_prefix="DYNACONF",
-    settings_files=['config/settings.yaml', 'config/.secrets.yaml'],
-)
+class _LazySettings:
+    """Dynaconf settings loaded on first access, so `--help` does not import dynaconf and read the YAML files."""
+
+    def __init__(self):
+        self._settings = None
+
+    def _load(self):
+        if self._settings is None:
+            from dynaconf import Dynaconf
+
+            # Загружаем конфигурацию из файлов
+            self._settings = Dynaconf(
+                envvar_prefix="DYNACONF",
+                settings_files=['config/settings.yaml', 'config/.secrets.yaml'],
+            )
+        return self._settings
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+
+settings = _LazySettings()
 
 
 def apply_cli_settings(chatgpt_log, chatgpt_config_name, chatgpt_person_name):
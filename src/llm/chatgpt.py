@@ -1,15 +1,91 @@
 import asyncio
-from typing import Optional
+import re
+from typing import Optional, AsyncIterator, List, Tuple, Iterator
 
 from selenium_driverless.types.by import By
-from selenium_driverless.types.webelement import NoSuchElementException, StaleElementReferenceException
+from selenium_driverless.types.webelement import NoSuchElementException
 
 from akp.logger import LOGGER
 from akp.selenium_driverless_ex.webdriver_ex import ChromeEx
 from akp.selenium_driverless_ex.webelement_ex import WebElementEx
 from config.config import settings
-from llm import chatgpt_config, chatgpt_person
-from llm.chatgpt_config import ChatGPTFlags
+from llm import chatgpt_config, chatgpt_person, chatgpt_js, chatgpt_metrics
+from llm.chatgpt_blocking import RequestBlocker, apply_block_rules
+from llm.chatgpt_cache import ResponseCache
+from llm.chatgpt_config import BlockRules, ChatGPTFlags, INPUT_MODES
+from llm.chatgpt_conversation import ConversationState
+from llm.chatgpt_session import get_session_store
+from llm.chatgpt_stats import LatencyModel, WaitTimings, get_latency_model
+
+# заголовки частей длинного промта
+_PART_HEADER = "Часть {i}/{total} сообщения, просто ответь «ок» и жди продолжения: "
+_LAST_PART_HEADER = "Часть {total}/{total} сообщения, последняя. Ответь на всё сообщение целиком: "
+
+# границы, по которым режется текст: абзацы, предложения, слова
+_BREAKS = ((re.compile(r"\n\s*\n"), "\n\n"), (re.compile(r"(?<=[.!?…])\s+"), " "), (re.compile(r"\s+"), " "))
+
+
+def _pieces(text: str, limit: int, level=0) -> Iterator[Tuple[str, str]]:
+    """(separator, piece) pairs no longer than `limit`, split at the coarsest break that fits."""
+    if len(text) <= limit:
+        yield "", text
+        return
+    if level == len(_BREAKS):
+        # слово длиннее лимита (ссылка, base64) режется как есть
+        for i in range(0, len(text), limit):
+            yield "", text[i:i + limit]
+        return
+
+    pattern, separator = _BREAKS[level]
+    first = True
+    for part in pattern.split(text):
+        part = part.strip()
+        if not part:
+            continue
+        for i, (inner, piece) in enumerate(_pieces(part, limit, level + 1)):
+            yield (inner if i else ("" if first else separator)), piece
+        first = False
+
+
+def split_text(text: str, limit: int) -> List[str]:
+    """Pack the text into chunks of at most `limit` characters, breaking on paragraphs,
+    then sentences, then words; the original separators are kept inside a chunk."""
+    chunks: List[str] = []
+    current = ""
+    for separator, piece in _pieces(text.strip(), max(1, limit)):
+        if current and len(current) + len(separator or " ") + len(piece) <= limit:
+            current += (separator or " ") + piece
+        else:
+            if current:
+                chunks.append(current)
+            current = piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_prompt(value: str, limit: Optional[int]) -> List[str]:
+    """Split the prompt into parts of at most `limit` characters, preferring paragraph, sentence and word breaks."""
+    if not limit or len(value) <= limit:
+        return [value]
+
+    # длина заголовка зависит от числа частей, а число частей - от места, оставшегося после заголовка
+    total = 2
+    while True:
+        header = max(len(_PART_HEADER.format(i=total, total=total)), len(_LAST_PART_HEADER.format(total=total)))
+        parts = split_text(value, max(1, limit - header))
+        if len(parts) <= total:
+            break
+        total = len(parts)
+
+    total = len(parts)
+    headed = [_PART_HEADER.format(i=i, total=total) + part for i, part in enumerate(parts[:-1], 1)]
+    headed.append(_LAST_PART_HEADER.format(total=total) + parts[-1])
+    return headed
+
+
+def _same_text(a: Optional[str], b: str) -> bool:
+    return a is not None and " ".join(a.split()) == " ".join(b.split())
 
 
 class ChatGPTRPA:
@@ -18,29 +94,70 @@ class ChatGPTRPA:
         self._driver = driver
         self._gpt = gpt
         self._authorized = False
-
-    async def _is_ready(self):
-        link = await self._driver.current_url
+        self.last_response_error = False
+        # ответ не дождался окончания генерации и может быть неполным
+        self.last_response_timeout = False
+        self.last_response_cached = False
+        # способ ввода, который сайт принял в последний раз
+        self._input_mode: Optional[str] = None
+        self._blocker: Optional[RequestBlocker] = None
+        self._blocking_applied = False
+        # правила блокировки, включённые во вкладке
+        self._block_rules: Optional[BlockRules] = None
+        self._performance_enabled = False
+        # отправленные промты всего и на момент последнего замера JS heap
+        self._sends = 0
+        self._heap_checked_at = 0
+        # число ответов и номер хода в странице на момент отправки (см. chatgpt_js.ARM_JS)
+        self._armed: Optional[dict] = None
+        # адрес вкладки по событиям CDP - пока он на главной, перед отправкой страницу не опрашиваем
+        self._url: Optional[str] = None
+        self._main_frame: Optional[str] = None
+        self._nav_tracking = False
+        # скрипт закрытия диалогов, добавленный в каждый новый документ вкладки, и его конфиг
+        self._watch_script: Optional[Tuple[str, str]] = None
+
+    def _latency_key(self, reply=False) -> str:
+        """Page metrics depend on the config only, reply metrics also on the persona."""
+        person = self._gpt.get_person().name if reply and self._gpt.is_personalization_enabled() else None
+        return LatencyModel.key(self._gpt.get_config().name, person)
+
+    def wait_timings(self) -> WaitTimings:
+        person = self._gpt.get_person().name if self._gpt.is_personalization_enabled() else None
+        return get_latency_model().timings(self._gpt.get_config().name, person)
+
+    async def _probe(self, dismiss_dialog=False) -> dict:
+        return await self._driver.eval_async(self._gpt.get_config().probe_script, dismiss_dialog)
+
+    async def _is_ready(self, probe=True) -> Optional[dict]:
+        """Make sure the tab is on the main page; without `probe` trust the tracked navigation
+        and return None instead of the page state when no round trip was needed."""
         cfg = self._gpt.get_config()
+        if not probe and self._nav_tracking and self._url and cfg.main_page in self._url:
+            # диалоги закрывает наблюдатель в странице, уход с главной виден по событиям навигации
+            return None
 
-        if cfg.main_page not in link:
-            LOGGER.warning(f"Драйвер не находится на странице ИИ-ассистента! Тек. страница: {link}")
+        # одно обращение к странице: адрес, диалог (закрывается прямо в странице), генерация, ответы
+        try:
+            state = await self._probe(dismiss_dialog=True)
+        except Exception:
+            LOGGER.warning("ChatGPT: Не удалось опросить страницу.", exc_info=True)
+            state = {"on_main_page": False, "url": None}
+
+        if not state["on_main_page"]:
+            LOGGER.warning(f"Драйвер не находится на странице ИИ-ассистента! Тек. страница: {state['url']}")
+            # open_main_page возвращается, когда поле ввода уже на странице
             await self.open_main_page()
-            await asyncio.sleep(1)
+            state = await self._probe(dismiss_dialog=True)
 
-    async def _pass_thanks_window(self):
-        await self._is_ready()
-        cfg = self._gpt.get_config()
-        thanks_sel = cfg.selectors.get('thanks_dialog_sel')
-        cancel_sel = ".//a[text()='Не входить']"
+        return state
 
-        if thanks_sel:
-            try:
-                dialog = await self._driver.find_element(By.XPATH, thanks_sel, 1)
-                cancel_btn = await dialog.find_element(By.XPATH, cancel_sel)
-                await cancel_btn.click()
-            except NoSuchElementException:
-                pass
+    async def is_alive(self) -> bool:
+        try:
+            state = await self._probe()
+        except Exception:
+            return False
+        return state["on_main_page"]
 
     async def authorize(self):
         if self._authorized:
@@ -52,36 +169,50 @@ class ChatGPTRPA:
 
         LOGGER.debug("ChatGPT: попытка авторизации...")
         try:
-            await self._driver.get(cfg.login_page)
-
-            # ввод логина и пароля
-            login_element = await self._driver.find_element(By.XPATH, cfg.selectors['login_sel'])
-            await login_element.click()
-            await login_element.send_keys(login)
-
-            password_element = await self._driver.find_element(By.XPATH, cfg.selectors['password_sel'])
-            await password_element.click()
-            await password_element.send_keys(password)
-
-            checkbox = cfg.selectors.get('login_checkbox_sel')
-            if checkbox:
-                cb_elem = await self._driver.find_element(By.XPATH, checkbox)
-                await cb_elem.click()
-
-            btn = cfg.selectors.get('login_button_sel')
-            if btn:
-                btn_elem = await self._driver.find_element(By.XPATH, btn)
-                await btn_elem.click()
-
-            await self._driver.wait_element_disappear(login_element)
+            with chatgpt_metrics.stage("authorize", cfg.name):
+                await self._authorize(cfg, login, password)
             self._authorized = True
             LOGGER.info("ChatGPT: Авторизация удалась")
+            await get_session_store().save(self._driver, cfg)
         except Exception:
             LOGGER.error("ChatGPT: Авторизация не удалась", exc_info=True)
             self._authorized = False
 
         return self._authorized
 
+    async def _authorize(self, cfg: chatgpt_config.ChatGPTConfig, login: str, password: str):
+        await self._driver.get(cfg.login_page)
+
+        # ввод логина и пароля
+        login_element = await self._driver.find_element(By.XPATH, cfg.selectors['login_sel'])
+        await login_element.click()
+        await login_element.send_keys(login)
+
+        password_element = await self._driver.find_element(By.XPATH, cfg.selectors['password_sel'])
+        await password_element.click()
+        await password_element.send_keys(password)
+
+        checkbox = cfg.selectors.get('login_checkbox_sel')
+        if checkbox:
+            cb_elem = await self._driver.find_element(By.XPATH, checkbox)
+            await cb_elem.click()
+
+        btn = cfg.selectors.get('login_button_sel')
+        if btn:
+            btn_elem = await self._driver.find_element(By.XPATH, btn)
+            await btn_elem.click()
+
+        await self._driver.wait_element_disappear(login_element)
+
+    async def _is_session_valid(self) -> bool:
+        cfg = self._gpt.get_config()
+        state = await self._probe()
+        if not state["on_main_page"] or (cfg.login_page and cfg.login_page in state["url"]):
+            return False
+
+        login_sel = cfg.selectors.get('login_sel')
+        return not (login_sel and await self._driver.eval_async(chatgpt_js.EXISTS_JS, login_sel))
+
     async def new_chat(self):
         cfg = self._gpt.get_config()
         new_sel = cfg.selectors.get('new_chat_sel')
@@ -89,16 +220,82 @@ class ChatGPTRPA:
             return False
         try:
             elem = await self._driver.find_element(By.XPATH, new_sel)
+            before = await self._reply_count()
+            started = asyncio.get_running_loop().time()
             await elem.click()
-            await asyncio.sleep(1)
-            return True
+            self._gpt.conversation.reset("новый чат")
         except NoSuchElementException:
             return False
 
-    async def open_main_page(self, timeout=30):
+        # в пустом чате ждать нечего
+        if before != 0:
+            await self._wait_chat_cleared(started, before)
+        return True
+
+    async def _reply_count(self) -> Optional[int]:
+        try:
+            return (await self._probe()).get("count", 0)
+        except Exception:
+            LOGGER.debug("ChatGPT: Не удалось опросить страницу.", exc_info=True)
+            return None
+
+    async def _wait_chat_cleared(self, started: float, before: Optional[int]):
+        """Poll until the previous replies are gone instead of sleeping a fixed second.
+        Some sites keep a greeting in a new chat, so fewer replies than `before` is enough."""
+        loop = asyncio.get_running_loop()
+        timings = self.wait_timings()
+        deadline = started + timings.page_timeout
+        while loop.time() < deadline:
+            try:
+                count = (await self._probe()).get("count", 0)
+                if not count or (before is not None and count < before):
+                    get_latency_model().record(self._latency_key(), "new_chat", loop.time() - started)
+                    return
+            except Exception:
+                LOGGER.debug("ChatGPT: Не удалось опросить страницу после нового чата.", exc_info=True)
+            await asyncio.sleep(timings.poll)
+        LOGGER.debug("ChatGPT: Старые ответы не пропали после нового чата.")
+
+    async def stop_generation(self) -> bool:
+        try:
+            return await self._driver.eval_async(chatgpt_js.STOP_JS, self._gpt.get_config().js_selectors)
+        except Exception:
+            LOGGER.warning("ChatGPT: Не удалось остановить генерацию.", exc_info=True)
+            return False
+
+    async def reset_conversation(self) -> bool:
+        """Abort the current reply and start from a clean conversation."""
+        await self.stop_generation()
+        if await self.new_chat():
+            return True
+        return await self.open_main_page()
+
+    async def open_main_page(self, timeout=30, reuse=False):
+        """Load the main page; with `reuse` a tab already on an authorized main page is kept as is."""
+        with chatgpt_metrics.stage("open_main_page", self._gpt.get_config().name):
+            return await self._open_main_page(timeout, reuse)
+
+    async def _open_main_page(self, timeout, reuse=False):
         cfg = self._gpt.get_config()
         timer = timeout
         text_area: Optional[WebElementEx] = None
+        self._gpt.conversation.reset("главная страница открыта заново")
+
+        # правила действуют на всю вкладку и включаются до загрузки сайта; после set_config
+        # с другими правилами прежние снимаются при открытии главной страницы новой конфигурации
+        if not self._blocking_applied or self._block_rules != cfg.block_rules:
+            if self._blocker:
+                await self._blocker.stop()
+            self._blocking_applied = True
+            self._block_rules = cfg.block_rules
+            self._blocker = await apply_block_rules(self._driver, cfg.block_rules)
+        await self._watch_page(cfg)
+
+        # свободная вкладка общего браузера (ask --attach) уже загружена: опрос ставит в неё наблюдатель
+        loaded = reuse and await self._is_session_valid()
+        if loaded:
+            LOGGER.debug("ChatGPT: Вкладка уже на главной странице, не перезагружаю")
+            self._authorized = True
 
         # while True:
         #     try:
@@ -124,90 +321,369 @@ class ChatGPTRPA:
         #         LOGGER.error("ChatGPT: Ошибка при открытии главной страницы.", exc_info=True)
         #         return False
 
-        await self._driver.get(cfg.main_page)
-        await self._driver.scroll_to_location(0, 100)
-
-        # TODO: если нужна авторизация перенаправлением
+        # сначала пробуем сохранённую сессию, полный вход - только если её нет или она истекла
+        restored = None
+        if cfg.login_page and not self._authorized:
+            restored = await get_session_store().restore(self._driver, cfg)
+            if not restored:
+                await self.authorize()
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        if not loaded:
+            await self._driver.get(cfg.main_page)
+            await self._driver.scroll_to_location(0, 100)
+
+        if restored:
+            if await self._is_session_valid():
+                self._authorized = True
+            else:
+                LOGGER.info("ChatGPT: Сохранённая сессия недействительна, выполняю вход...")
+                await get_session_store().invalidate(cfg.name, self._driver, restored)
+                if await self.authorize():
+                    started = loop.time()
+                    await self._driver.get(cfg.main_page)
 
         text_area = await self._driver.find_element(
-            By.XPATH, cfg.selectors['text_area_sel'], timeout=10)
+            By.XPATH, cfg.selectors['text_area_sel'], timeout=self.wait_timings().page_timeout)
+        if not loaded:
+            get_latency_model().record(self._latency_key(), "page_load", loop.time() - started)
 
         if cfg.flags & ChatGPTFlags.START_NEW_CHAT:
             await self.new_chat()
 
         return bool(text_area)
 
+    async def _watch_page(self, cfg: chatgpt_config.ChatGPTConfig):
+        """Follow the tab's navigations through CDP events and install the config's dialog
+        watcher into every new document, so sends and replies need no page probe."""
+        try:
+            if not self._nav_tracking:
+                await self._driver.add_cdp_listener("Page.frameNavigated", self._on_frame_navigated)
+                await self._driver.add_cdp_listener("Page.navigatedWithinDocument", self._on_navigated_within_document)
+                await self._driver.execute_cdp_cmd("Page.enable", {})
+                self._nav_tracking = True
+
+            if self._watch_script and self._watch_script[0] != cfg.name:
+                await self._driver.execute_cdp_cmd("Page.removeScriptToEvaluateOnNewDocument",
+                                                   {"identifier": self._watch_script[1]})
+                self._watch_script = None
+            if cfg.watch_script and not self._watch_script:
+                added = await self._driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument",
+                                                           {"source": cfg.watch_script})
+                self._watch_script = (cfg.name, added["identifier"])
+        except Exception:
+            LOGGER.warning("ChatGPT: Не удалось включить отслеживание страницы, "
+                           "она будет опрашиваться перед каждой отправкой.", exc_info=True)
+
+    async def _on_frame_navigated(self, params: dict):
+        frame = params["frame"]
+        # вложенные фреймы (реклама, капча) не меняют адрес вкладки
+        if frame.get("parentId"):
+            return
+        self._main_frame = frame["id"]
+        self._url = frame["url"] + frame.get("urlFragment", "")
+
+    async def _on_navigated_within_document(self, params: dict):
+        # SPA меняет адрес через history API без новой загрузки
+        if params.get("frameId") == self._main_frame:
+            self._url = params["url"]
+
     async def send_prompt(self, value: str):
-        await self._is_ready()
-        await self._pass_thanks_window()
+        with chatgpt_metrics.stage("send_prompt", self._gpt.get_config().name):
+            await self._is_ready(probe=False)
+
+            cfg = self._gpt.get_config()
+            conversation = self._gpt.conversation
+            # подготовка отправки заодно сообщает число ответов - отдельный опрос страницы не нужен
+            armed = await self._arm()
+            conversation.observe_replies(armed.get("count", 0))
+            if await self._recycle_if_needed(armed):
+                armed = None
+
+            if conversation.pending_summary:
+                value = f"[Краткое содержание нашего предыдущего диалога: {conversation.pending_summary}] {value}"
+
+            person, preamble, primed = None, None, False
+            if self._gpt.is_personalization_enabled():
+                # настройки персоны передаются один раз за диалог
+                person = self._gpt.get_person()
+                preamble = person.build_prompt()
+                primed = conversation.needs_preamble(person.name)
+                value = (preamble if primed else "") + value
+
+            # промт режется по абзацам до того, как из него убираются переводы строк
+            parts = split_prompt(value, cfg.max_input_length)
+            if person:
+                # перевод строки в поле ввода отправил бы сообщение - заменяем пробелом, чтобы слова не слиплись
+                parts = [part.replace("\n", " ") for part in parts]
+            if len(parts) > 1:
+                LOGGER.debug(f"ChatGPT: Промт длиннее {cfg.max_input_length} символов, отправляю {len(parts)} частями")
+            for i, part in enumerate(parts, 1):
+                await self._send_message(part, armed if i == 1 else None)
+                if i < len(parts):
+                    # промежуточные части подтверждаются коротким ответом, который не нужен и не должен
+                    # попасть в замеры ответов - иначе таймаут ответа подстроится под "ок"
+                    await self.get_last_response(record=False)
+
+            conversation.record(value, person and person.name, preamble, primed)
+            self._sends += 1
+
+    async def keep_warm(self):
+        """Do between turns what the next send would otherwise wait for: dismiss dialogs,
+        return to the main page and recycle an outgrown conversation."""
+        state = await self._is_ready()
+        self._gpt.conversation.observe_replies(state.get("count", 0))
+        await self._recycle_if_needed(state)
+
+    async def _heap_mb(self) -> Optional[float]:
+        try:
+            if not self._performance_enabled:
+                await self._driver.execute_cdp_cmd("Performance.enable", {})
+                self._performance_enabled = True
+            metrics = (await self._driver.execute_cdp_cmd("Performance.getMetrics", {}))["metrics"]
+        except Exception:
+            LOGGER.debug("ChatGPT: Не удалось получить метрики вкладки.", exc_info=True)
+            return None
+        heap = next((m["value"] for m in metrics if m["name"] == "JSHeapUsedSize"), None)
+        return heap / 2 ** 20 if heap is not None else None
+
+    async def _recycle_if_needed(self, state: dict) -> bool:
+        """Start a fresh conversation when the current one outgrew the config's RecyclePolicy."""
+        cfg = self._gpt.get_config()
+        policy = cfg.recycle
+        if not policy:
+            return False
+
+        conversation = self._gpt.conversation
+        reason, reload = None, False
+        if policy.max_turns and conversation.turns >= policy.max_turns:
+            reason = f"{conversation.turns} ходов"
+        elif policy.max_replies and state.get("count", 0) >= policy.max_replies:
+            reason = f"{state['count']} ответов на странице"
+        elif policy.max_heap_mb and self._sends - self._heap_checked_at >= max(1, policy.heap_check_every):
+            # Performance.getMetrics - лишний запрос CDP, память растёт медленно: меряем раз в несколько ходов
+            self._heap_checked_at = self._sends
+            heap = await self._heap_mb()
+            if heap is not None and heap >= policy.max_heap_mb:
+                # новый чат в SPA не освобождает память вкладки, нужна перезагрузка
+                reason, reload = f"JS heap {heap:.0f} МБ", True
+        if not reason:
+            return False
+
+        LOGGER.info(f"ChatGPT: Диалог слишком большой ({reason}), начинаю новый...")
+        chatgpt_metrics.count("recycles", cfg.name)
+        summary = conversation.summary(policy.summary_chars) if self._gpt.keep_context else None
+        if reload or not await self.new_chat():
+            await self.open_main_page()
+        conversation.carry(summary)
+        return True
+
+    async def _arm(self) -> dict:
+        # запоминаем число сообщений и последнее из них до отправки, чтобы отличить новый ответ от старых
+        return await self._driver.eval_async(chatgpt_js.ARM_JS, self._gpt.get_config().js_selectors)
 
+    async def _send_message(self, value: str, armed: Optional[dict] = None):
         cfg = self._gpt.get_config()
-        if self._gpt.is_personalization_enabled():
-            person = self._gpt.get_person()
-            prefix = person.build_prompt()
-            value = (prefix + value).replace("\n", "")
+        self._armed = armed or await self._arm()
 
         text_area = await self._driver.find_element(By.XPATH, cfg.selectors['text_area_sel'])
-        await text_area.write(value)
+        await self._write_input(text_area, value)
         await text_area.send_keyboard_event("keydown", "Enter")
 
         btn = await self._driver.find_element(By.XPATH, cfg.selectors['send_button_sel'])
         await btn.click()
 
-    async def get_last_response(self, start_delay=5, timer=30):
-        await self._is_ready()
-        await self._pass_thanks_window()
-
+    async def _write_input(self, text_area: WebElementEx, value: str):
+        """Put the whole text into the input at once; fall back to slower modes if the site rejects it."""
         cfg = self._gpt.get_config()
-        current_timer = timer
-        response = None
+        sel = cfg.selectors['text_area_sel']
+        first = self._input_mode or cfg.input_mode
+        for mode in [first] + [m for m in INPUT_MODES if m != first]:
+            if mode == "keys":
+                await text_area.write(value)
+                self._input_mode = mode
+                return
+
+            if mode == "insert_text":
+                await self._driver.eval_async(chatgpt_js.SET_INPUT_JS, sel, "focus", None)
+                await self._driver.execute_cdp_cmd("Input.insertText", {"text": value})
+                typed = await self._driver.eval_async(chatgpt_js.INPUT_VALUE_JS, sel)
+            else:
+                typed = await self._driver.eval_async(chatgpt_js.SET_INPUT_JS, sel, mode, value)
+
+            if _same_text(typed, value):
+                self._input_mode = mode
+                return
+
+            LOGGER.debug(f"ChatGPT: Поле ввода {cfg.name} не приняло текст способом {mode}, пробую следующий...")
+            await self._driver.eval_async(chatgpt_js.SET_INPUT_JS, sel, "native_setter", "")
+
+    async def _next(self, sent: Optional[int], timer: float, quiet: float) -> dict:
+        """Wait in the page for the reply to grow past `sent` characters or to finish (`sent` is None)."""
+        armed = self._armed or {}
+        state = await self._driver.eval_async(chatgpt_js.NEXT_JS, sent, int(timer * 1000), int(quiet * 1000),
+                                              self._gpt.get_config().js_selectors, armed.get("count", 0),
+                                              timeout=timer + 5)
+        if armed and state.get("turn") != armed.get("turn"):
+            LOGGER.debug("ChatGPT: Страница перезагрузилась после отправки, ответ отслеживается заново.")
+            self._armed = {"count": armed.get("count"), "turn": state.get("turn")}
+        return state
+
+    async def get_last_response(self, timer: Optional[float] = None, quiet: Optional[float] = None,
+                                record: bool = True):
+        """Wait for the reply; `timer` and `quiet` default to the provider's learned WaitTimings.
+
+        With `record=False` (acknowledgement of a prompt part) the wait is timed as the
+        `part_ack` stage and kept out of the response latency samples.
+        """
+        await self._is_ready(probe=False)
+        self.last_response_error = False
+        self.last_response_timeout = False
 
+        cfg = self._gpt.get_config()
+        timings = self.wait_timings()
+        timer = timer or timings.response_timeout
+        quiet = quiet or timings.quiet
+        loop = asyncio.get_running_loop()
+        started = loop.time()
         LOGGER.debug("ChatGPT: Сообщение генерируется...")
-        await asyncio.sleep(start_delay)
-
-        while True:
-            try:
-                stop_btn = await self._driver.find_element(By.XPATH, cfg.selectors['stop_button_sel'], 1)
-                if await stop_btn.is_visible():
-                    continue
-            except (StaleElementReferenceException, NoSuchElementException):
-                pass
-
-            # Поиск сообщения об ошибке
-            try:
-                msg_error = cfg.selectors.get("assistant_msg_error_sel", None)
-                if msg_error:
-                    element = await self._driver.find_element(By.XPATH, msg_error, timeout=3)
-                    response = (await element.text).strip()
-                    return response
-            except NoSuchElementException:
-                pass
-
-            # Поиск последнего сообщения от ИИ
-            try:
-                elements = await self._driver.find_elements(By.XPATH, cfg.selectors['assistant_msg_sel'], 1)
-                response = elements[-1] if elements else None
-            except Exception:
-                LOGGER.warning("ChatGPT: Не удалось найти ответ.")
-            finally:
-                current_timer -= 1
-                if response or current_timer <= 0:
-                    if response:
-                        LOGGER.debug("ChatGPT: Ответ получен!")
-                        return (await response.text).strip()
-                    break
-                await asyncio.sleep(1)
+        try:
+            # промис в странице разрешается, когда кнопка остановки пропала и ответ не меняется `quiet` секунд
+            with chatgpt_metrics.stage("get_last_response" if record else "part_ack", cfg.name):
+                state = await self._next(None, timer, quiet)
+        except Exception:
+            LOGGER.warning("ChatGPT: Не удалось найти ответ.", exc_info=True)
+            return None
+
+        if record and (state.get("done") or state.get("timeout")):
+            # таймаут - цензурированный замер: ответ был дольше, чем его ждали
+            get_latency_model().record(self._latency_key(reply=True), "response", loop.time() - started,
+                                       timed_out=bool(state.get("timeout")))
+        if state.get("timeout"):
+            self.last_response_timeout = True
+            chatgpt_metrics.count("timeouts", cfg.name)
+
+        if state.get("error"):
+            self.last_response_error = True
+            chatgpt_metrics.count("error_responses", cfg.name)
+            LOGGER.warning("ChatGPT: Получено сообщение об ошибке.")
+            return state["error"].strip()
+
+        if state.get("text"):
+            if state.get("done"):
+                LOGGER.debug("ChatGPT: Ответ получен!")
+            else:
+                LOGGER.warning("ChatGPT: Ответ не дождался завершения генерации и может быть неполным.")
+            return state["text"].strip()
 
         LOGGER.debug("ChatGPT: Ответ не получен!")
         return None
 
+    async def stream_response(self, timer: Optional[float] = None,
+                              quiet: Optional[float] = None) -> AsyncIterator[str]:
+        """Yield text deltas of the reply to the last sent prompt as it grows."""
+        await self._is_ready(probe=False)
+
+        timings = self.wait_timings()
+        timer = timer or timings.response_timeout
+        quiet = quiet or timings.quiet
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + timer
+        cfg = self._gpt.get_config()
+        model, key = get_latency_model(), self._latency_key(reply=True)
+        emitted = ""
+        # самая длинная пауза между фрагментами ответа - по ней подбирается `quiet`
+        last_delta, gap = None, 0.0
+        self.last_response_error = False
+        self.last_response_timeout = False
+
+        LOGGER.debug("ChatGPT: Сообщение генерируется...")
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                LOGGER.debug("ChatGPT: Ответ не получен полностью!")
+                self.last_response_timeout = True
+                chatgpt_metrics.count("timeouts", cfg.name)
+                chatgpt_metrics.record("stream_response", loop.time() - started, cfg.name)
+                model.record(key, "response", loop.time() - started, timed_out=True)
+                return
+
+            # промис в странице разрешается по MutationObserver, когда текст ответа меняется
+            state = await self._next(len(emitted), remaining, quiet)
+            self.last_response_error = bool(state.get("error"))
+            text = state.get("error") or state.get("text") or ""
+
+            if text.startswith(emitted):
+                if len(text) > len(emitted):
+                    now = loop.time()
+                    if not emitted:
+                        chatgpt_metrics.record("first_token", now - started, cfg.name)
+                        model.record(key, "first_token", now - started)
+                    elif last_delta is not None:
+                        gap = max(gap, now - last_delta)
+                    last_delta = now
+                    yield text[len(emitted):]
+            else:
+                LOGGER.warning("ChatGPT: Ответ был перерисован, часть потока пропущена.")
+            emitted = text
+
+            if state.get("done"):
+                LOGGER.debug("ChatGPT: Ответ получен!")
+                if self.last_response_error:
+                    chatgpt_metrics.count("error_responses", cfg.name)
+                chatgpt_metrics.record("stream_response", loop.time() - started, cfg.name)
+                model.record(key, "response", loop.time() - started)
+                if gap:
+                    model.record(key, "gap", gap)
+                return
+
+    async def ask(self, prompt: str, refresh=False):
+        """Send the prompt and return the reply, going through the response cache if any."""
+        cache = self._gpt.cache
+        key = self._gpt.cache_key(prompt) if cache else None
+        self.last_response_cached = False
+
+        if cache and not refresh:
+            response = cache.get(key)
+            if response is not None:
+                LOGGER.debug("ChatGPT: Ответ взят из кэша.")
+                chatgpt_metrics.count("cache_hits", self._gpt.get_config().name)
+                self.last_response_cached = True
+                return response
+
+        await self.send_prompt(prompt)
+        response = await self.get_last_response()
+        if not self.last_response_error:
+            self._gpt.conversation.record_exchange(prompt, response)
+
+        # сообщения об ошибке провайдера и оборванные по таймауту ответы не кэшируются
+        if cache and response and not self.last_response_error and not self.last_response_timeout:
+            cache.put(key, response)
+        return response
+
+    async def ask_stream(self, prompt: str) -> AsyncIterator[str]:
+        await self.send_prompt(prompt)
+        response = ""
+        async for delta in self.stream_response():
+            response += delta
+            yield delta
+        if not self.last_response_error:
+            self._gpt.conversation.record_exchange(prompt, response)
+
 
 class ChatGPT:
 
     def __init__(self, driver: ChromeEx, enable_personalization: bool,
                  config_name: Optional[str] = None,
-                 person_name: Optional[str] = None):
+                 person_name: Optional[str] = None,
+                 cache: Optional[ResponseCache] = None):
         self.rpa = ChatGPTRPA(driver, self)
+        self.cache = cache
+        self.conversation = ConversationState()
+        # переносить краткое содержание диалога при его пересоздании (интерактивный чат)
+        self.keep_context = False
         self._current_config = chatgpt_config.get_config(config_name or "DEFAULT")
         self._current_personalization = chatgpt_person.get_person(person_name or "DEFAULT")
         self._personalization_enabled = enable_personalization
@@ -229,7 +705,13 @@ class ChatGPT:
     def set_config(self, name: str):
         config = chatgpt_config.get_config(name)
         if config:
+            if config is not self._current_config:
+                self.conversation.reset("смена конфигурации")
             self._current_config = config
 
     def get_config(self) -> chatgpt_config.ChatGPTConfig:
         return self._current_config
+
+    def cache_key(self, prompt: str) -> str:
+        person = self._current_personalization if self._personalization_enabled else None
+        return ResponseCache.make_key(self._current_config.name, person, prompt)
@@ -0,0 +1,71 @@
+from fnmatch import fnmatchcase
+from typing import Optional
+
+from akp.logger import LOGGER
+from akp.selenium_driverless_ex.webdriver_ex import ChromeEx
+from config.config import settings
+from llm.chatgpt_config import BlockRules
+
+
+class RequestBlocker:
+    """Applies a config's BlockRules to the driver's tab and counts what was dropped."""
+
+    def __init__(self, driver: ChromeEx, rules: BlockRules):
+        self._driver = driver
+        self._rules = rules
+        self.blocked = 0
+        self.allowed = 0
+
+    async def start(self):
+        rules = self._rules
+        if rules.block_urls:
+            await self._driver.execute_cdp_cmd("Network.enable", {})
+            await self._driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(rules.block_urls)})
+
+        if rules.resource_types:
+            # перехватываются только запросы нужных типов, остальные идут без задержки
+            await self._driver.add_cdp_listener("Fetch.requestPaused", self._on_request_paused)
+            await self._driver.execute_cdp_cmd("Fetch.enable", {"patterns": [
+                {"resourceType": resource_type, "requestStage": "Request"} for resource_type in rules.resource_types
+            ]})
+
+    async def stop(self):
+        """Lift the rules from the tab (before another config's rules are applied)."""
+        rules = self._rules
+        try:
+            if rules.block_urls:
+                await self._driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": []})
+            if rules.resource_types:
+                await self._driver.execute_cdp_cmd("Fetch.disable", {})
+                await self._driver.remove_cdp_listener("Fetch.requestPaused", self._on_request_paused)
+        except Exception:
+            LOGGER.warning("ChatGPT: Не удалось снять блокировку запросов", exc_info=True)
+
+    async def _on_request_paused(self, params: dict):
+        request_id = params["requestId"]
+        url = params["request"]["url"]
+        try:
+            if any(fnmatchcase(url, pattern) for pattern in self._rules.allow_urls):
+                self.allowed += 1
+                await self._driver.execute_cdp_cmd("Fetch.continueRequest", {"requestId": request_id})
+            else:
+                self.blocked += 1
+                await self._driver.execute_cdp_cmd("Fetch.failRequest",
+                                                   {"requestId": request_id, "errorReason": "BlockedByClient"})
+        except Exception:
+            # вкладка могла закрыться или перейти на другую страницу - запрос уже не ждёт ответа
+            LOGGER.debug(f"ChatGPT: Не удалось обработать перехваченный запрос {url}", exc_info=True)
+
+
+async def apply_block_rules(driver: ChromeEx, rules: Optional[BlockRules]) -> Optional[RequestBlocker]:
+    """Start blocking for the driver's tab; a no-op when rules are empty or `chatgpt.blocking.enabled` is 0."""
+    if not rules or not settings.get("chatgpt.blocking.enabled", 1):
+        return None
+
+    blocker = RequestBlocker(driver, rules)
+    try:
+        await blocker.start()
+    except Exception:
+        LOGGER.warning("ChatGPT: Не удалось включить блокировку запросов", exc_info=True)
+        return None
+    return blocker
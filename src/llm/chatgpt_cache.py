@@ -0,0 +1,94 @@
+import hashlib
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional, Dict
+
+import akp.root
+from config.config import settings
+from llm.chatgpt_person import ChatGPTPerson
+
+
+class ResponseCache:
+    """On-disk (SQLite) cache of GPT responses with per-entry TTL and LRU eviction."""
+
+    def __init__(self, path: Path, max_entries: int = 10000, ttl: float = 7 * 24 * 3600):
+        self._max_entries = max_entries
+        self._ttl = ttl
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                expires REAL NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+            CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        """)
+
+    @staticmethod
+    def make_key(config_name: str, person: Optional[ChatGPTPerson], prompt: str) -> str:
+        """Key from the config name, the persona prefix hash and the whitespace-normalised prompt."""
+        person_hash = hashlib.sha256(person.build_prompt().encode()).hexdigest() if person else "-"
+        normalized = " ".join(prompt.split())
+        return hashlib.sha256(f"{config_name}\0{person_hash}\0{normalized}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        row = self._db.execute("SELECT response FROM responses WHERE key = ? AND expires > ?",
+                               (key, now)).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+
+        self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        self._count("hits")
+        return row[0]
+
+    def put(self, key: str, response: str, ttl: Optional[float] = None):
+        now = time.time()
+        self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                         (key, response, now + (ttl or self._ttl), now))
+        self._evict(now)
+
+    def stats(self) -> Dict[str, int]:
+        counters = dict(self._db.execute("SELECT name, value FROM counters").fetchall())
+        entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": counters.get("hits", 0), "misses": counters.get("misses", 0), "entries": entries}
+
+    def close(self):
+        self._db.close()
+
+    def _count(self, name: str):
+        self._db.execute("INSERT INTO counters VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1",
+                         (name,))
+
+    def _evict(self, now: float):
+        self._db.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+        self._db.execute("""
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?
+            )
+        """, (self._max_entries,))
+
+
+_RESPONSE_CACHE: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Shared cache configured by `chatgpt.cache` settings, or None when disabled."""
+    global _RESPONSE_CACHE
+
+    if not settings.get("chatgpt.cache.enabled", 1):
+        return None
+
+    if _RESPONSE_CACHE is None:
+        path = akp.root.get_external_project_root() / settings.get("chatgpt.cache.path", "cache/responses.sqlite")
+        _RESPONSE_CACHE = ResponseCache(path,
+                                        max_entries=settings.get("chatgpt.cache.max_entries", 10000),
+                                        ttl=settings.get("chatgpt.cache.ttl", 7 * 24 * 3600))
+    return _RESPONSE_CACHE
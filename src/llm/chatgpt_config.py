@@ -1,6 +1,10 @@
+import json
 from enum import Flag, auto
-from dataclasses import dataclass, field
-from typing import Optional, Dict
+from dataclasses import dataclass, field, replace
+from functools import cached_property
+from typing import Optional, Dict, Tuple
+
+from llm import chatgpt_js
 
 
 class ChatGPTFlags(Flag):
@@ -8,6 +12,94 @@ class ChatGPTFlags(Flag):
     AUTO_VPN = auto()
 
 
+# способы ввода промта от быстрого к медленному; если сайт не принял текст, пробуется следующий:
+# insert_text - CDP Input.insertText одним событием, native_setter - value/execCommand из JS,
+# keys - посимвольный ввод (всегда работает, но долгий на длинных промтах)
+INPUT_MODES = ("insert_text", "native_setter", "keys")
+
+
+@dataclass(frozen=True)
+class BlockRules:
+    """Requests the browser drops for a config (applied through CDP, see chatgpt_blocking).
+
+    `block_urls` are wildcard patterns dropped by Network.setBlockedURLs, `resource_types`
+    are CDP resource types (Image, Media, Font, ...) failed through the Fetch domain unless
+    the URL matches one of `allow_urls`.
+    """
+    resource_types: Tuple[str, ...] = ()
+    block_urls: Tuple[str, ...] = ()
+    allow_urls: Tuple[str, ...] = ()
+
+
+# безопасный профиль: картинки, видео, шрифты и счётчики не нужны для чтения ответов,
+# стили и скрипты сайта не трогаем - от них зависят селекторы и видимость кнопок
+DEFAULT_BLOCK_RULES = BlockRules(
+    resource_types=("Image", "Media", "Font"),
+    block_urls=(
+        "*google-analytics.com*",
+        "*googletagmanager.com*",
+        "*doubleclick.net*",
+        "*googlesyndication.com*",
+        "*mc.yandex.ru*",
+        "*connect.facebook.net*",
+        "*hotjar.com*",
+        "*clarity.ms*",
+        "*intercom.io*",
+        "*youtube.com/embed*",
+    ),
+    # капчи и проверки браузера показывают картинки - их не блокируем
+    allow_urls=(
+        "*challenges.cloudflare.com*",
+        "*recaptcha*",
+        "*hcaptcha.com*",
+    ),
+)
+
+
+@dataclass(frozen=True)
+class RecyclePolicy:
+    """When a long conversation is replaced by a fresh one to keep the tab's DOM and memory bounded.
+
+    Turn and reply limits start a new chat (or reload the main page if the site has no
+    new-chat button), the JS heap limit always reloads the tab. The heap is measured once
+    every `heap_check_every` sent prompts. In `chat` mode the last exchanges are carried
+    into the new conversation as a summary of `summary_chars`.
+    """
+    max_turns: Optional[int] = 30
+    max_replies: Optional[int] = 60
+    max_heap_mb: Optional[float] = 400
+    heap_check_every: int = 5
+    summary_chars: int = 1500
+
+
+DEFAULT_RECYCLE_POLICY = RecyclePolicy()
+
+
+@dataclass(frozen=True)
+class RateLimits:
+    """How hard the scheduler may push a provider (see chatgpt_scheduler).
+
+    Requests are admitted by a token bucket of `per_minute` with bursts of `burst` and at
+    most `concurrency` run at once. After `breaker_failures` failures in a row the provider
+    is taken out of rotation for `breaker_cooldown` seconds, then probed with one request.
+    """
+    per_minute: float = 20
+    burst: int = 3
+    concurrency: int = 4
+    breaker_failures: int = 5
+    breaker_cooldown: float = 120
+
+    def share(self, parts: int) -> "RateLimits":
+        """Limits of one of `parts` processes driving the provider together."""
+        if parts <= 1:
+            return self
+        return replace(self, per_minute=self.per_minute / parts, burst=max(1, self.burst // parts),
+                       concurrency=max(1, self.concurrency // parts))
+
+
+DEFAULT_RATE_LIMITS = RateLimits()
+
+
 @dataclass(frozen=True)
 class ChatGPTConfig:
     name: str
@@ -15,6 +107,38 @@ class ChatGPTConfig:
     login_page: Optional[str] = None
     selectors: Dict[str, Optional[str]] = field(default_factory=dict)
     flags: ChatGPTFlags = ChatGPTFlags(0)
+    input_mode: str = "insert_text"
+    # промты длиннее отправляются частями; None - без ограничения
+    max_input_length: Optional[int] = None
+    # None - ничего не блокировать
+    block_rules: Optional[BlockRules] = DEFAULT_BLOCK_RULES
+    # None - диалог не пересоздаётся
+    recycle: Optional[RecyclePolicy] = DEFAULT_RECYCLE_POLICY
+    limits: RateLimits = DEFAULT_RATE_LIMITS
+
+    @cached_property
+    def js_selectors(self) -> Dict[str, Optional[str]]:
+        """Selectors in the shape expected by the in-page helpers (see chatgpt_js)."""
+        return {
+            "mainPage": self.main_page,
+            "assistant": self.selectors.get("assistant_msg_sel"),
+            "stop": self.selectors.get("stop_button_sel"),
+            "error": self.selectors.get("assistant_msg_error_sel"),
+            "dialog": self.selectors.get("thanks_dialog_sel"),
+            "dialogCancel": self.selectors.get("thanks_dialog_cancel_sel"),
+        }
+
+    @cached_property
+    def probe_script(self) -> str:
+        """Script returning the whole page state in a single CDP round-trip."""
+        return chatgpt_js.RUNTIME_JS + chatgpt_js.PROBE_JS % json.dumps(self.js_selectors)
+
+    @cached_property
+    def watch_script(self) -> Optional[str]:
+        """Script dismissing the config's dialog as soon as it appears; None if there is no dialog."""
+        if not self.selectors.get("thanks_dialog_sel"):
+            return None
+        return chatgpt_js.RUNTIME_JS + chatgpt_js.WATCH_JS % json.dumps(self.js_selectors)
 
 
 # Registry to hold all configurations
@@ -38,6 +162,7 @@ BASE_SELECTOR_KEYS = [
     "login_sel",
     "password_sel",
     "thanks_dialog_sel",
+    "thanks_dialog_cancel_sel",
     "new_chat_sel",
 ]
 
@@ -54,7 +179,10 @@ register_config(ChatGPTConfig(
         "stop_button_sel": "//button[@data-testid='stop-button']",
         "assistant_msg_sel": "//div[@data-message-author-role='assistant']",
         "thanks_dialog_sel": "//div[@role='dialog']",
-    }
+        "thanks_dialog_cancel_sel": ".//a[text()='Не входить']",
+    },
+    # без входа длинное сообщение отклоняется целиком
+    max_input_length=30000
 ))
 
 register_config(ChatGPTConfig(
@@ -68,7 +196,11 @@ register_config(ChatGPTConfig(
         "assistant_msg_error_sel": "//div[@class='chat-box ai-completed']//div[contains(@class, 'message-error')]",
         "new_chat_sel": "//button[contains(@class, 'btn-new-chat')]",
     },
-    flags=ChatGPTFlags.START_NEW_CHAT
+    flags=ChatGPTFlags.START_NEW_CHAT,
+    # длинные сообщения обрезаются без предупреждения, лимит взят с запасом
+    max_input_length=4000,
+    # на частых и параллельных запросах отвечает сообщением об ошибке
+    limits=RateLimits(per_minute=10, burst=2, concurrency=2, breaker_failures=3)
 ))
 
 # генерируются номера классов, нерентабельно
@@ -110,7 +242,9 @@ register_config(ChatGPTConfig(
         "send_button_sel": "//button[(@type='submit') and (contains(@style, 'margin-right')) and (./span[@class='md:flex'])]",
         "stop_button_sel": "//button[not(@type='submit') and (contains(@style, 'margin-right')) and (./span[@class='md:flex'])]",
         "assistant_msg_sel": "//div[contains(@class, 'prose break-words')]",
-    }
+    },
+    # на длинных сообщениях отвечает ошибкой, лимит взят с запасом
+    max_input_length=8000
 ))
 
 # Быстро меняется, нерентабельно поддерживать
@@ -132,13 +266,54 @@ register_config(ChatGPTConfig(
     main_page=_def_config.main_page,
     login_page=_def_config.login_page,
     selectors=_def_config.selectors,
-    flags=_def_config.flags
+    flags=_def_config.flags,
+    input_mode=_def_config.input_mode,
+    max_input_length=_def_config.max_input_length,
+    block_rules=_def_config.block_rules,
+    recycle=_def_config.recycle,
+    limits=_def_config.limits
 ))
 
 
 # Additional configs can be registered in the same way...
 
 
+# Локальная заглушка сайтов для замеров без сети (python -m bench.stub_site)
+STUB_BASE_URL = "http://127.0.0.1:8712"
+STUB_SITES = ("CHATAPP", "BLACKBOX", "OPENAI")
+
+# у заглушки общая разметка ошибок и диалогов; собственные селекторы сайта важнее
+_STUB_SELECTORS = {
+    "assistant_msg_error_sel": "//div[@data-stub-error]",
+    "thanks_dialog_sel": "//div[@role='dialog']",
+    "thanks_dialog_cancel_sel": ".//a[text()='Не входить']",
+}
+
+
+_STUB_RATE_LIMITS = RateLimits(per_minute=6000, burst=100, concurrency=100)
+
+
+def register_stub_configs(base_url: str = STUB_BASE_URL) -> None:
+    """Register STUB_<NAME> copies of the site configs pointed at the local stub site.
+
+    Called by the benchmarks only, so the copies never show up in CLI choices or /v1/models.
+    """
+    for name in STUB_SITES:
+        site = _CONFIG_REGISTRY[name]
+        register_config(ChatGPTConfig(
+            name=f"STUB_{name}",
+            main_page=f"{base_url}/{name.lower()}",
+            selectors={**_STUB_SELECTORS, **site.selectors},
+            flags=site.flags,
+            input_mode=site.input_mode,
+            max_input_length=site.max_input_length,
+            block_rules=site.block_rules,
+            recycle=site.recycle,
+            # заглушка не ограничивает частоту запросов: бенчмарк меряет RPA, а не лимиты сайта
+            limits=_STUB_RATE_LIMITS
+        ))
+
+
 def get_config(name: str) -> Optional[ChatGPTConfig]:
     """Retrieve a registered ChatGPTConfig by name (case-sensitive)."""
     return _CONFIG_REGISTRY.get(name)
@@ -0,0 +1,85 @@
+from collections import deque
+from typing import Optional, Dict, Deque, Tuple
+
+from akp.logger import LOGGER
+
+
+class ConversationState:
+    """Whether the open chat already got the persona preamble, and how much input that saved.
+
+    The preamble is sent with the first message of a conversation and again only after
+    the conversation is reset (new chat, main page reopened, site cleared the chat) or
+    the persona changes. When a conversation is recycled (see RecyclePolicy) a summary of
+    the last exchanges can be carried into the next one.
+    """
+
+    def __init__(self):
+        self.primed_person: Optional[str] = None
+        # ответов в чате на момент последней отправки - если их стало меньше, сайт начал новый диалог
+        self.replies = 0
+        # ходов в текущем диалоге
+        self.turns = 0
+        self.pending_summary: Optional[str] = None
+        self._exchanges: Deque[Tuple[str, str]] = deque(maxlen=10)
+        self.messages = 0
+        self.primes = 0
+        self.chars_sent = 0
+        self.chars_saved = 0
+
+    def reset(self, reason: str):
+        if self.primed_person:
+            LOGGER.debug(f"ChatGPT: Новый диалог ({reason}), персона будет передана заново")
+        self.primed_person = None
+        self.replies = 0
+        self.turns = 0
+        self._exchanges.clear()
+
+    def observe_replies(self, count: int):
+        """Compare the number of replies on the page with the last send to detect a cleared chat."""
+        if count < self.replies:
+            self.reset("сайт очистил диалог")
+        self.replies = count
+
+    def needs_preamble(self, person_name: str) -> bool:
+        return self.primed_person != person_name
+
+    def record(self, sent: str, person_name: Optional[str] = None, preamble: Optional[str] = None, primed=False):
+        """Account a sent message; `preamble` is the persona text that was sent or skipped."""
+        self.messages += 1
+        self.turns += 1
+        self.chars_sent += len(sent)
+        self.pending_summary = None
+        if primed:
+            self.primes += 1
+            self.primed_person = person_name
+        elif preamble:
+            self.chars_saved += len(preamble)
+
+    def record_exchange(self, prompt: str, response: Optional[str]):
+        if response:
+            self._exchanges.append((prompt, response))
+
+    def summary(self, limit: int) -> Optional[str]:
+        """Compact transcript of the latest exchanges that fits into `limit` characters."""
+        lines = []
+        size = 0
+        for prompt, response in reversed(self._exchanges):
+            line = " ".join(f"Я: {prompt[:limit // 4]} Ты: {response[:limit // 3]}".split())
+            if lines and size + len(line) > limit:
+                break
+            lines.insert(0, line[:limit])
+            size += len(line)
+        return " | ".join(lines) or None
+
+    def carry(self, summary: Optional[str]):
+        """Keep the summary to be sent with the first message of the next conversation."""
+        self.pending_summary = summary
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "person": self.primed_person,
+            "messages": self.messages,
+            "primes": self.primes,
+            "chars_sent": self.chars_sent,
+            "chars_saved": self.chars_saved,
+        }
@@ -0,0 +1,223 @@
+"""In-page JavaScript used by ChatGPTRPA.
+
+Every snippet starts with RUNTIME_JS, which installs `window.__rpa` once per
+document, so a reload or navigation transparently re-creates the helpers.
+Snippets are run through `eval_async`, i.e. as the body of an async function.
+ChatGPTConfig.watch_script is also registered to run at the start of every new
+document, so dialogs are dismissed from the first paint, before any snippet runs.
+"""
+
+RUNTIME_JS = r"""
+if (!window.__rpa) {
+    const rpa = window.__rpa = {
+        waiters: [], sel: null, baseline: 0, errBaseline: 0, turn: 0, structural: true,
+        dialogSel: null, dismissScheduled: false, dismissed: 0,
+    };
+
+    rpa.first = (xpath) => xpath
+        ? document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue
+        : null;
+    rpa.count = (xpath) => xpath
+        ? document.evaluate(`count(${xpath})`, document, null, XPathResult.NUMBER_TYPE, null).numberValue
+        : 0;
+    rpa.last = (xpath) => xpath ? rpa.first(`(${xpath})[last()]`) : null;
+    rpa.visible = (el) => !!el && !!(el.offsetWidth || el.offsetHeight || el.getClientRects().length);
+    rpa.live = (el) => el && el.isConnected ? el : null;
+
+    // Любое изменение DOM будит ожидающие промисы - без опроса из Python.
+    // structural - добавлялись элементы: только тогда элементы ответа ищутся заново
+    rpa.changed = () => new Promise(resolve => rpa.waiters.push(resolve));
+    new MutationObserver((mutations) => {
+        const added = mutations.some(m => Array.prototype.some.call(m.addedNodes, n => n.nodeType === 1));
+        rpa.structural = rpa.structural || added;
+        if (added) rpa.scheduleDismiss();
+        const waiters = rpa.waiters;
+        rpa.waiters = [];
+        waiters.forEach(resolve => resolve(true));
+    }).observe(document, {childList: true, subtree: true, characterData: true, attributes: true});
+
+    // Известный диалог конфигурации закрывается, как только появился, - без ожидания из Python.
+    // Проверка откладывается, чтобы пачка изменений DOM стоила одного XPath
+    rpa.dismiss = () => {
+        const sel = rpa.dialogSel;
+        const dialog = sel && rpa.first(sel.dialog);
+        if (!dialog || !sel.dialogCancel) return !!dialog;
+        const cancel = document.evaluate(sel.dialogCancel, dialog, null,
+            XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+        if (!cancel) return true;
+        cancel.click();
+        rpa.dismissed += 1;
+        return false;
+    };
+    rpa.scheduleDismiss = () => {
+        if (!rpa.dialogSel || rpa.dismissScheduled) return;
+        rpa.dismissScheduled = true;
+        setTimeout(() => {
+            rpa.dismissScheduled = false;
+            rpa.dismiss();
+        }, 0);
+    };
+    rpa.watch = (sel) => {
+        if (!sel.dialog || rpa.dialogSel) return;
+        rpa.dialogSel = {dialog: sel.dialog, dialogCancel: sel.dialogCancel};
+        rpa.scheduleDismiss();
+    };
+
+    rpa.sleep = (ms) => new Promise(resolve => setTimeout(() => resolve(false), ms));
+
+    // Перед отправкой: число ответов и последний из них - новый ответ должен быть после него.
+    // baseline - число ответов, известное из Python, когда страница перезагрузилась после отправки
+    rpa.arm = (sel, baseline) => {
+        const restored = baseline !== undefined && baseline !== null;
+        rpa.sel = sel;
+        rpa.watch(sel);
+        rpa.turn += 1;
+        rpa.baseline = restored ? Math.min(rpa.count(sel.assistant), baseline) : rpa.count(sel.assistant);
+        rpa.errBaseline = rpa.count(sel.error);
+        rpa.previous = restored ? null : rpa.last(sel.assistant);
+        rpa.current = rpa.error = rpa.stopButton = null;
+        rpa.structural = true;
+        return {count: rpa.baseline, turn: rpa.turn};
+    };
+
+    rpa.locate = () => {
+        const sel = rpa.sel;
+        if (!rpa.live(rpa.current) && rpa.count(sel.assistant) > rpa.baseline) {
+            const last = rpa.last(sel.assistant);
+            if (last !== rpa.previous) rpa.current = last;
+        }
+        if (!rpa.live(rpa.error) && rpa.count(sel.error) > rpa.errBaseline) rpa.error = rpa.last(sel.error);
+        if (!rpa.live(rpa.stopButton)) rpa.stopButton = rpa.first(sel.stop);
+    };
+
+    // Ответ текущего хода. Найденные элементы запоминаются, поэтому опрос без новых элементов
+    // в DOM стоит O(1) и не зависит от длины диалога
+    rpa.reply = () => {
+        if (rpa.structural) {
+            rpa.structural = false;
+            rpa.locate();
+        }
+        const current = rpa.live(rpa.current);
+        const error = rpa.live(rpa.error);
+        return {
+            text: current ? current.innerText : null,
+            error: error ? error.innerText : null,
+            generating: rpa.visible(rpa.live(rpa.stopButton)),
+            turn: rpa.turn,
+        };
+    };
+
+    // Полное состояние страницы за одно обращение; при dismiss диалог закрывается сразу
+    rpa.probe = (sel, dismiss) => {
+        rpa.watch(sel);
+        const dialog = dismiss ? rpa.dismiss() : !!rpa.first(sel.dialog);
+
+        const last = rpa.last(sel.assistant);
+        const error = rpa.last(sel.error);
+        return {
+            url: location.href,
+            on_main_page: location.href.includes(sel.mainPage),
+            dialog: dialog,
+            dismissed: rpa.dismissed,
+            generating: rpa.visible(rpa.first(sel.stop)),
+            error: error ? error.innerText : null,
+            count: rpa.count(sel.assistant),
+            last: last ? last.innerText : null,
+        };
+    };
+
+    rpa.inputValue = (el) => el.value !== undefined ? el.value : el.innerText;
+
+    rpa.selectContents = (el) => {
+        if (el.value !== undefined) return el.select();
+        const range = document.createRange();
+        range.selectNodeContents(el);
+        const selection = getSelection();
+        selection.removeAllRanges();
+        selection.addRange(range);
+    };
+
+    // mode "focus" - только фокус и выделение содержимого (текст затем вставляет CDP Input.insertText);
+    // "native_setter" - value через сеттер прототипа в обход обёрток React/Vue и событие input
+    rpa.setInput = (xpath, mode, text) => {
+        const el = rpa.first(xpath);
+        if (!el) return null;
+        el.focus();
+        rpa.selectContents(el);
+        if (mode === "native_setter") {
+            if (el.value !== undefined) {
+                const proto = el instanceof HTMLTextAreaElement ? HTMLTextAreaElement.prototype : HTMLInputElement.prototype;
+                Object.getOwnPropertyDescriptor(proto, "value").set.call(el, text);
+                el.dispatchEvent(new InputEvent("input", {bubbles: true, inputType: "insertText", data: text}));
+                el.dispatchEvent(new Event("change", {bubbles: true}));
+            } else if (!document.execCommand(text ? "insertText" : "delete", false, text)) {
+                // contenteditable: execCommand проходит через обработчики beforeinput редактора
+                el.textContent = text;
+                el.dispatchEvent(new InputEvent("input", {bubbles: true, inputType: "insertText", data: text}));
+            }
+        }
+        return rpa.inputValue(el);
+    };
+
+    rpa.stop = (sel) => {
+        const btn = rpa.first(sel.stop);
+        if (!rpa.visible(btn)) return false;
+        btn.click();
+        return true;
+    };
+
+    // Ждёт, пока текст ответа изменится относительно `sent` символов, либо генерация закончится.
+    // sent === null - ждать только окончания генерации.
+    // Паузу `quietMs` прерывает только изменение ответа текущего хода (текст, ошибка, кнопка остановки),
+    // а не любое изменение страницы: спиннеры, часы и реклама не должны продлевать ожидание до таймаута
+    rpa.next = async (sent, timeoutMs, quietMs) => {
+        const deadline = Date.now() + timeoutMs;
+        let previous = null;
+        let quietSince = Date.now();
+        while (true) {
+            const state = rpa.reply();
+            if (state.error) return {...state, done: true};
+            if (sent !== null && state.text !== null && state.text.length !== sent) return {...state, done: false};
+
+            const now = Date.now();
+            const remaining = deadline - now;
+            if (remaining <= 0) return {...state, done: false, timeout: true};
+
+            if (!previous || state.text !== previous.text || state.generating !== previous.generating) quietSince = now;
+            previous = state;
+
+            const quiet = !state.generating && !!state.text;
+            if (quiet && now - quietSince >= quietMs) return {...state, done: true};
+            await Promise.race([rpa.changed(), rpa.sleep(quiet ? Math.min(quietSince + quietMs - now, remaining) : remaining)]);
+        }
+    };
+}
+"""
+
+# подставляется ChatGPTConfig.probe_script: %s - селекторы конфигурации в JSON
+PROBE_JS = "return window.__rpa.probe(%s, arguments[0]);"
+
+# подставляется ChatGPTConfig.watch_script; выполняется не через eval_async, а в начале каждого документа
+WATCH_JS = "window.__rpa.watch(%s);"
+
+ARM_JS = RUNTIME_JS + "return window.__rpa.arm(arguments[0]);"
+
+# arguments: sent, timeoutMs, quietMs, селекторы, число ответов при отправке.
+# После перезагрузки страницы runtime создаётся заново - базовая линия восстанавливается из arguments[4]
+# (0, если промт не отправлялся - тогда берётся последнее сообщение)
+NEXT_JS = RUNTIME_JS + """
+if (!window.__rpa.sel) window.__rpa.arm(arguments[3], arguments[4]);
+return await window.__rpa.next(arguments[0], arguments[1], arguments[2]);
+"""
+
+# arguments: XPath поля ввода, режим ("focus" | "native_setter"), текст
+SET_INPUT_JS = RUNTIME_JS + "return window.__rpa.setInput(arguments[0], arguments[1], arguments[2]);"
+
+INPUT_VALUE_JS = RUNTIME_JS + """
+const el = window.__rpa.first(arguments[0]);
+return el ? window.__rpa.inputValue(el) : null;
+"""
+
+STOP_JS = RUNTIME_JS + "return window.__rpa.stop(arguments[0]);"
+
+EXISTS_JS = RUNTIME_JS + "return !!window.__rpa.first(arguments[0]);"
@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import json
+from pathlib import Path
+from typing import Optional, List, Dict
+
+from akp.logger import LOGGER
+from config.config import settings
+from llm.chatgpt import split_text
+from llm.chatgpt_config import get_config
+from llm.chatgpt_person import get_person
+from llm.chatgpt_scheduler import ChatGPTScheduler
+from llm.chatgpt_workers import answer_item
+
+
+def input_limit(config_names: List[str]) -> int:
+    """Longest single message every config accepts."""
+    limits = [cfg.max_input_length for cfg in map(get_config, config_names) if cfg and cfg.max_input_length]
+    return min(limits) if limits else settings.get("chatgpt.map_reduce.chunk_chars", 3000)
+
+
+def chunk_budget(config_names: List[str], person_name: Optional[str], map_prompt: Optional[str] = None,
+                 rewrite=False) -> int:
+    """Chunk size that every config accepts in one message together with the persona preamble;
+    with `rewrite` (the answer is the chunk rewritten, e.g. HTML_FORMATTER) also short enough
+    for the persona to answer in full."""
+    person = get_person(person_name or "DEFAULT")
+    # настройки персоны уходят первым сообщением вместе с куском
+    budget = input_limit(config_names) - (len(person.build_prompt()) if person else 0)
+    if rewrite and person and person.ai_response_length:
+        # ответ не длиннее ai_response_length, переписанному куску нужно место под разметку
+        budget = min(budget, int(person.ai_response_length * settings.get("chatgpt.map_reduce.answer_share", 0.7)))
+    if map_prompt:
+        budget -= len(map_prompt) + 1
+    return max(200, budget)
+
+
+class MapReduceCheckpoint:
+    """Answers of finished chunks, one JSON line each, appended as they arrive.
+
+    The first line names the job (a hash of the text, prompts, configs and chunk size):
+    a checkpoint left by another job is started over instead of being mixed in.
+    """
+
+    def __init__(self, path: Path, job: str):
+        self._path = path
+        self._job = job
+        self._file = None
+
+    def load(self) -> Dict[int, str]:
+        done: Dict[int, str] = {}
+        if not self._path.exists():
+            return done
+
+        with self._path.open(encoding="utf-8") as f:
+            lines = iter(f)
+            try:
+                header = json.loads(next(lines, "{}"))
+            except json.JSONDecodeError:
+                header = {}
+            if header.get("job") != self._job:
+                LOGGER.warning(f"ChatGPT: {self._path} - контрольная точка другого задания, начинаю заново")
+                return done
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # строка, оборванная при падении процесса
+                    continue
+                done[record["index"]] = record["response"]
+        return done
+
+    def open(self, resumed: bool):
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self._path.open("a" if resumed else "w", encoding="utf-8")
+        if not resumed:
+            self._write({"job": self._job})
+
+    def save(self, index: int, response: str):
+        self._write({"index": index, "response": response})
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _write(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+
+async def map_reduce(scheduler: ChatGPTScheduler, text: str,
+                     map_prompt: Optional[str] = None,
+                     reduce_prompt: Optional[str] = None,
+                     config_names: Optional[List[str]] = None,
+                     person_name: Optional[str] = None,
+                     checkpoint_path: Optional[Path] = None,
+                     budget: Optional[int] = None,
+                     retries: Optional[int] = None,
+                     separator: str = "\n\n",
+                     rewrite=False) -> dict:
+    """Answer a text too long for one message: split it into chunks, send them to concurrent
+    sessions of the scheduler's pool, join the answers in order and optionally reduce them
+    with one more prompt. Failures are returned with an "error" key instead of raised.
+
+    Each chunk is retried on its own (the scheduler's retries, then `retries` more rounds
+    for the chunks still without an answer); with `checkpoint_path` answered chunks are
+    kept on disk and skipped when an interrupted job is run again. `rewrite` sizes the
+    chunks so that the map answer can repeat the whole chunk (see `chunk_budget`).
+    """
+    config_names = list(config_names or [scheduler.pool.config_name])
+    person_name = person_name or scheduler.pool.person_name
+    budget = budget or chunk_budget(config_names, person_name, map_prompt, rewrite)
+    retries = retries if retries is not None else settings.get("chatgpt.map_reduce.retries", 1)
+    chunks = split_text(text, budget)
+
+    responses: Dict[int, str] = {}
+    checkpoint = None
+    if checkpoint_path:
+        job = hashlib.sha256(json.dumps([text, map_prompt, config_names, person_name, budget],
+                                        ensure_ascii=False).encode("utf-8")).hexdigest()
+        checkpoint = MapReduceCheckpoint(checkpoint_path, job)
+        responses = {i: r for i, r in checkpoint.load().items() if i < len(chunks)}
+        checkpoint.open(resumed=bool(responses))
+    resumed = len(responses)
+    LOGGER.info(f"ChatGPT: Текст {len(text)} символов разбит на {len(chunks)} частей по {budget}, "
+                f"уже готово {resumed}")
+
+    errors: Dict[int, str] = {}
+
+    async def answer(index: int):
+        prompt = f"{map_prompt} {chunks[index]}" if map_prompt else chunks[index]
+        result = await answer_item(scheduler, {"id": index, "prompt": prompt, "configs": config_names,
+                                               "person": person_name})
+        if "error" in result or not result.get("response"):
+            errors[index] = result.get("error") or "no_response"
+            return
+        errors.pop(index, None)
+        responses[index] = result["response"]
+        if checkpoint:
+            checkpoint.save(index, result["response"])
+        LOGGER.debug(f"ChatGPT: Часть {index + 1}/{len(chunks)} готова")
+
+    try:
+        pending = [i for i in range(len(chunks)) if i not in responses]
+        for round_ in range(retries + 1):
+            if not pending:
+                break
+            if round_:
+                LOGGER.warning(f"ChatGPT: Повторяю {len(pending)} частей без ответа")
+            await asyncio.gather(*[answer(i) for i in pending])
+            pending = sorted(errors)
+    finally:
+        if checkpoint:
+            checkpoint.close()
+
+    result = {
+        "configs": config_names,
+        "person": person_name,
+        "chunks": len(chunks),
+        "resumed": resumed,
+        "responses": [responses.get(i) for i in range(len(chunks))],
+        "response": None,
+    }
+    if errors:
+        result["failed"] = sorted(errors)
+        result["error"] = f"Без ответа {len(errors)} из {len(chunks)} частей: {errors[min(errors)]}"
+        return result
+
+    joined = separator.join(responses[i] for i in range(len(chunks)))
+    if not reduce_prompt:
+        result["response"] = joined
+        return result
+
+    reduced, error = await _reduce(scheduler, joined, reduce_prompt, config_names, person_name)
+    result["response"] = reduced
+    if error:
+        result["error"] = error
+    return result
+
+
+async def _reduce(scheduler: ChatGPTScheduler, joined: str, reduce_prompt: str, config_names: List[str],
+                  person_name: Optional[str], rounds=4):
+    """Reduce the joined answers in rounds: answers that do not fit one message are split
+    into groups, each group is reduced on its own and the results are reduced again."""
+    size = chunk_budget(config_names, person_name, reduce_prompt)
+    for round_ in range(rounds):
+        groups = split_text(joined, size)
+        if len(groups) > 1:
+            LOGGER.info(f"ChatGPT: Свёртка, шаг {round_ + 1}: {len(groups)} групп")
+        results = await asyncio.gather(*[
+            answer_item(scheduler, {"id": f"reduce-{round_}-{i}", "prompt": f"{reduce_prompt} {group}",
+                                    "configs": config_names, "person": person_name})
+            for i, group in enumerate(groups)])
+        failed = next((r for r in results if "error" in r or not r.get("response")), None)
+        if failed:
+            return None, failed.get("error") or "no_response"
+        if len(results) == 1:
+            return results[0]["response"], None
+        reduced = "\n\n".join(r["response"] for r in results)
+        if len(reduced) >= len(joined):
+            # ответы не короче исходного текста: следующий шаг ничего не сожмёт
+            return None, f"Свёртка не уменьшает текст ({len(joined)} -> {len(reduced)} символов)"
+        joined = reduced
+    return None, f"Свёртка не уложилась в {rounds} шагов"
@@ -0,0 +1,174 @@
+import json
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Iterator
+
+import akp.root
+from akp.logger import LOGGER
+from config.config import settings
+
+# границы корзин гистограмм этапов, с
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+COUNTERS = ("requests", "cache_hits", "timeouts", "error_responses", "retries", "recycles")
+
+
+class Trace:
+    """Stage durations of one request. Nested stages are also part of their parent
+    (e.g. `authorize` inside `open_main_page`), so they do not add up to `total`."""
+
+    def __init__(self, config_name: str):
+        self.config_name = config_name
+        self.stages: Dict[str, float] = {}
+        self._started = time.perf_counter()
+
+    def add(self, stage_name: str, seconds: float):
+        self.stages[stage_name] = self.stages.get(stage_name, 0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def timings(self) -> Dict[str, float]:
+        timings = {name: round(seconds, 3) for name, seconds in self.stages.items()}
+        timings["total"] = round(self.elapsed(), 3)
+        return timings
+
+
+_TRACE: ContextVar[Optional[Trace]] = ContextVar("chatgpt_trace", default=None)
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        total = 0
+        for le, count in zip([*map(str, BUCKETS), "+Inf"], self.counts):
+            total += count
+            yield le, total
+
+
+class Metrics:
+    """Per-provider stage histograms and counters of a long-running process."""
+
+    def __init__(self, log_path: Optional[Path] = None):
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._counters: Dict[Tuple[str, str], int] = {}
+        self._log_path = log_path
+
+    def observe(self, stage_name: str, config_name: str, seconds: float):
+        self._histograms.setdefault((stage_name, config_name), Histogram()).observe(seconds)
+
+    def inc(self, counter: str, config_name: str, n: int = 1):
+        self._counters[(counter, config_name)] = self._counters.get((counter, config_name), 0) + n
+
+    def log(self, trace: Trace):
+        """Append the finished trace to the JSON-lines log, if one is configured."""
+        if not self._log_path:
+            return
+        record = {"ts": round(time.time(), 3), "config": trace.config_name, "timings": trace.timings()}
+        try:
+            self._log_path.parent.mkdir(parents=True, exist_ok=True)
+            with self._log_path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError:
+            LOGGER.warning(f"ChatGPT: Не удалось записать метрики в {self._log_path}", exc_info=True)
+
+    def snapshot(self) -> dict:
+        stages: Dict[str, dict] = {}
+        for (stage_name, config_name), h in sorted(self._histograms.items()):
+            stages.setdefault(config_name, {})[stage_name] = {
+                "count": h.count,
+                "sum": round(h.sum, 3),
+                "buckets": dict(h.cumulative()),
+            }
+        counters: Dict[str, dict] = {}
+        for (counter, config_name), value in sorted(self._counters.items()):
+            counters.setdefault(config_name, {})[counter] = value
+        return {"stages": stages, "counters": counters}
+
+    def prometheus(self) -> str:
+        lines = ["# HELP chatgpt_stage_seconds Duration of RPA stages",
+                 "# TYPE chatgpt_stage_seconds histogram"]
+        for (stage_name, config_name), h in sorted(self._histograms.items()):
+            labels = f'stage="{stage_name}",config="{config_name}"'
+            lines += [f'chatgpt_stage_seconds_bucket{{{labels},le="{le}"}} {count}' for le, count in h.cumulative()]
+            lines.append(f"chatgpt_stage_seconds_sum{{{labels}}} {h.sum:.6f}")
+            lines.append(f"chatgpt_stage_seconds_count{{{labels}}} {h.count}")
+
+        for counter in COUNTERS:
+            lines.append(f"# TYPE chatgpt_{counter}_total counter")
+            lines += [f'chatgpt_{counter}_total{{config="{config_name}"}} {value}'
+                      for (name, config_name), value in sorted(self._counters.items()) if name == counter]
+        return "\n".join(lines) + "\n"
+
+
+_METRICS: Optional[Metrics] = None
+
+
+def get_metrics() -> Metrics:
+    global _METRICS
+
+    if _METRICS is None:
+        log_path = settings.get("chatgpt.metrics.log")
+        _METRICS = Metrics(akp.root.get_external_project_root() / log_path if log_path else None)
+    return _METRICS
+
+
+def _config_name(config_name: Optional[str]) -> str:
+    if config_name:
+        return config_name
+    trace_ = _TRACE.get()
+    return trace_.config_name if trace_ else "-"
+
+
+@contextmanager
+def trace(config_name: str) -> Iterator[Trace]:
+    """Collect the stages run inside the block (including in tasks started from it) into one Trace."""
+    current = Trace(config_name)
+    token = _TRACE.set(current)
+    try:
+        yield current
+    finally:
+        try:
+            _TRACE.reset(token)
+        except ValueError:
+            # потоковый генератор закрыт из другого контекста (клиент отключился)
+            pass
+        metrics = get_metrics()
+        metrics.inc("requests", config_name)
+        metrics.observe("total", config_name, current.elapsed())
+        metrics.log(current)
+
+
+@contextmanager
+def stage(stage_name: str, config_name: Optional[str] = None):
+    """Time the block into the current trace and the provider histogram (failed stages included)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage_name, time.perf_counter() - started, config_name)
+
+
+def record(stage_name: str, seconds: float, config_name: Optional[str] = None):
+    """Add an already measured duration (e.g. time to the first streamed token)."""
+    trace_ = _TRACE.get()
+    if trace_:
+        trace_.add(stage_name, seconds)
+    get_metrics().observe(stage_name, _config_name(config_name), seconds)
+
+
+def count(counter: str, config_name: Optional[str] = None, n: int = 1):
+    get_metrics().inc(counter, _config_name(config_name), n)
@@ -0,0 +1,423 @@
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional, List, Dict, Set, AsyncIterator
+
+from akp.logger import LOGGER
+from akp.selenium_driverless_ex.webdriver_ex import ChromeEx
+from llm import chatgpt_metrics
+from llm.chatgpt import ChatGPT
+from llm.chatgpt_cache import ResponseCache
+from llm.chatgpt_person import get_person
+from profiles import ProfileManager, get_profile_manager
+from utils import start_driver
+
+
+class PooledSession:
+
+    def __init__(self, slot: int, driver: ChromeEx, chat_gpt: ChatGPT, profile: Path):
+        self.slot = slot
+        self.profile = profile
+        self.driver = driver
+        self.chat_gpt = chat_gpt
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.uses = 0
+
+    @property
+    def config_name(self) -> str:
+        return self.chat_gpt.get_config().name
+
+
+class ChatGPTPool:
+    """Keeps warm ChromeEx/ChatGPT sessions parked on the main page."""
+
+    def __init__(self, size: int = 1, max_browsers: int = 4, idle_timeout: float = 600,
+                 config_name: Optional[str] = None,
+                 person_name: Optional[str] = None,
+                 enable_personalization: bool = True,
+                 cache: Optional[ResponseCache] = None,
+                 profiles: Optional[ProfileManager] = None):
+        self.cache = cache
+        self._profiles = profiles or get_profile_manager()
+        self._size = max(0, min(size, max_browsers))
+        self._max_browsers = max(1, max_browsers)
+        self._idle_timeout = idle_timeout
+        self._config_name = config_name or "DEFAULT"
+        self._person_name = person_name or "DEFAULT"
+        self._enable_personalization = enable_personalization
+
+        self._idle: List[PooledSession] = []
+        self._busy: Set[PooledSession] = set()
+        # сессии, в которых после запроса начинается новый диалог; в _idle попадают после сброса
+        self._resetting: Dict[PooledSession, asyncio.Task] = {}
+        self._free_slots = list(range(self._max_browsers))
+        self._cond = asyncio.Condition()
+        self._evict_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    @property
+    def config_name(self) -> str:
+        return self._config_name
+
+    @property
+    def person_name(self) -> str:
+        return self._person_name
+
+    @property
+    def max_browsers(self) -> int:
+        return self._max_browsers
+
+    @property
+    def total(self) -> int:
+        return self._max_browsers - len(self._free_slots)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "total": self.total,
+            "idle": len(self._idle),
+            "busy": len(self._busy),
+            "resetting": len(self._resetting),
+            "max_browsers": self._max_browsers,
+        }
+
+    def cache_lookup(self, prompt: str, config_name: Optional[str] = None,
+                     person_name: Optional[str] = None) -> Optional[str]:
+        """Cached response for the prompt, checked without borrowing a browser."""
+        if not self.cache:
+            return None
+        person = get_person(person_name or self._person_name) if self._enable_personalization else None
+        return self.cache.get(ResponseCache.make_key(config_name or self._config_name, person, prompt))
+
+    async def start(self):
+        """Pre-warm `size` sessions with the default config and start idle eviction."""
+        sessions = await asyncio.gather(*[self.acquire() for _ in range(self._size)],
+                                        return_exceptions=True)
+        for session in sessions:
+            if isinstance(session, PooledSession):
+                await self.release(session)
+            else:
+                LOGGER.error(f"ChatGPT: Не удалось прогреть сессию пула: {session!r}")
+
+        if self._idle_timeout:
+            self._evict_task = asyncio.create_task(self._evict_loop())
+        return self
+
+    async def close(self):
+        self._closed = True
+        if self._evict_task:
+            self._evict_task.cancel()
+
+        async with self._cond:
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        # прерванный сброс закрывает свою сессию сам; отменённый до первого шага - нет
+        resets = list(self._resetting.values())
+        for task in resets:
+            task.cancel()
+        await asyncio.gather(*[self._close_session(s) for s in idle], *resets, return_exceptions=True)
+        unstarted, self._resetting = list(self._resetting), {}
+        await asyncio.gather(*[self._close_session(s) for s in unstarted])
+
+    async def acquire(self, config_name: Optional[str] = None,
+                      person_name: Optional[str] = None) -> PooledSession:
+        config_name = config_name or self._config_name
+
+        while True:
+            slot, victim, session = None, None, None
+            async with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Пул браузеров закрыт")
+
+                    session = next((s for s in self._idle if s.config_name == config_name), None)
+                    if session:
+                        self._idle.remove(session)
+                        break
+
+                    if self._free_slots:
+                        slot = self._free_slots.pop(0)
+                        break
+
+                    if self._idle:
+                        # лимит браузеров исчерпан - освобождаем самую старую сессию другой конфигурации
+                        victim = min(self._idle, key=lambda s: s.last_used)
+                        self._idle.remove(victim)
+                        break
+
+                    await self._cond.wait()
+
+                if session:
+                    self._busy.add(session)
+
+            if victim:
+                await self._close_session(victim)
+                continue
+
+            if session and not await session.chat_gpt.rpa.is_alive():
+                LOGGER.warning(f"ChatGPT: Сессия пула #{session.slot} не отвечает, пересоздаю...")
+                chatgpt_metrics.count("retries", config_name)
+                await self._discard(session)
+                continue
+
+            if session is None:
+                session = await self._spawn(slot, config_name)
+                self._busy.add(session)
+
+            session.chat_gpt.set_person(person_name or self._person_name)
+            return session
+
+    async def release(self, session: PooledSession, healthy: bool = True):
+        session.last_used = time.monotonic()
+        session.uses += 1
+
+        if not healthy or self._closed:
+            await self._discard(session)
+            return
+
+        if session.chat_gpt.conversation.turns:
+            # следующий запрос не должен видеть чужой диалог (и кэшироваться без его учёта); сброс
+            # (без кнопки нового чата - перезагрузка главной страницы) идёт в фоне, не задерживая ответ
+            async with self._cond:
+                self._busy.discard(session)
+                self._resetting[session] = asyncio.create_task(self._reset(session))
+            return
+
+        await self._park(session)
+
+    async def _reset(self, session: PooledSession):
+        healthy = False
+        try:
+            healthy = await session.chat_gpt.rpa.reset_conversation()
+        except Exception:
+            LOGGER.warning(f"ChatGPT: Не удалось начать новый диалог в сессии пула #{session.slot}", exc_info=True)
+        finally:
+            async with self._cond:
+                self._resetting.pop(session, None)
+            if healthy and not self._closed:
+                await self._park(session)
+            else:
+                await self._close_session(session)
+
+    async def _park(self, session: PooledSession):
+        async with self._cond:
+            self._busy.discard(session)
+            self._idle.append(session)
+            self._cond.notify()
+
+    @asynccontextmanager
+    async def session(self, config_name: Optional[str] = None, person_name: Optional[str] = None):
+        # ожидание свободного браузера и запуск нового - отдельный этап в метриках
+        with chatgpt_metrics.stage("acquire", config_name or self._config_name):
+            session = await self.acquire(config_name, person_name)
+        healthy = False
+        try:
+            yield session
+            healthy = True
+        finally:
+            await self.release(session, healthy)
+
+    async def _spawn(self, slot: int, config_name: str) -> PooledSession:
+        LOGGER.debug(f"ChatGPT: Запуск браузера пула #{slot} ({config_name})...")
+        driver = None
+        # копирование шаблона профиля блокирует - не держим на нём цикл событий
+        profile = await asyncio.get_running_loop().run_in_executor(None, self._profiles.acquire)
+        try:
+            driver = await start_driver(profile)
+            chat_gpt = ChatGPT(driver, self._enable_personalization,
+                               config_name=config_name,
+                               person_name=self._person_name,
+                               cache=self.cache)
+            if not await chat_gpt.rpa.open_main_page():
+                raise RuntimeError(f"Не удалось открыть главную страницу {config_name}")
+        except BaseException:
+            if driver:
+                await driver.quit(clean_dirs=False)
+            self._profiles.release(profile)
+            await self._free_slot(slot)
+            raise
+
+        return PooledSession(slot, driver, chat_gpt, profile)
+
+    async def _discard(self, session: PooledSession):
+        async with self._cond:
+            self._busy.discard(session)
+        await self._close_session(session)
+
+    async def _close_session(self, session: PooledSession):
+        try:
+            await session.driver.quit(clean_dirs=False)
+        except Exception:
+            LOGGER.warning(f"ChatGPT: Ошибка при закрытии браузера пула #{session.slot}", exc_info=True)
+        self._profiles.release(session.profile)
+        await self._free_slot(session.slot)
+
+    async def _free_slot(self, slot: int):
+        async with self._cond:
+            self._free_slots.append(slot)
+            self._free_slots.sort()
+            self._cond.notify()
+
+    async def _evict_loop(self):
+        period = max(1.0, min(self._idle_timeout / 2, 30.0))
+        while True:
+            await asyncio.sleep(period)
+            now = time.monotonic()
+            async with self._cond:
+                expired = sorted((s for s in self._idle if now - s.last_used > self._idle_timeout),
+                                 key=lambda s: s.last_used)
+                expired = expired[:max(0, self.total - self._size)]
+                for session in expired:
+                    self._idle.remove(session)
+
+            for session in expired:
+                LOGGER.debug(f"ChatGPT: Сессия пула #{session.slot} простаивает, закрываю...")
+                await self._close_session(session)
+
+
+async def run_pool_prompt(pool: ChatGPTPool, prompt: str,
+                          config_name: Optional[str] = None,
+                          person_name: Optional[str] = None,
+                          refresh=False,
+                          timings=False) -> dict:
+    config_name = config_name or pool.config_name
+    with chatgpt_metrics.trace(config_name) as trace:
+        result = await _run_pool_prompt(pool, prompt, config_name, person_name, refresh)
+    if timings:
+        result["timings"] = trace.timings()
+    return result
+
+
+async def _run_pool_prompt(pool: ChatGPTPool, prompt: str, config_name: str,
+                           person_name: Optional[str], refresh: bool) -> dict:
+    response = None if refresh else pool.cache_lookup(prompt, config_name, person_name)
+    if response is not None:
+        chatgpt_metrics.count("cache_hits", config_name)
+        return {
+            "config": config_name,
+            "person": person_name or pool.person_name,
+            "prompt": prompt,
+            "response": response,
+            "cached": True
+        }
+
+    async with pool.session(config_name, person_name) as session:
+        response = await session.chat_gpt.rpa.ask(prompt, refresh=True)
+        result = {
+            "config": session.config_name,
+            "person": session.chat_gpt.get_person().name,
+            "prompt": prompt,
+            "response": response,
+            "cached": session.chat_gpt.rpa.last_response_cached,
+            # текст ответа - сообщение сайта об ошибке, а не ответ модели
+            "provider_error": session.chat_gpt.rpa.last_response_error,
+            # ответ оборван по таймауту и может быть неполным
+            "timeout": session.chat_gpt.rpa.last_response_timeout
+        }
+    return result
+
+
+async def stream_pool_prompt(pool: ChatGPTPool, prompt: str,
+                             config_name: Optional[str] = None,
+                             person_name: Optional[str] = None) -> AsyncIterator[dict]:
+    """Yield {"delta": ...} chunks followed by the final result dict."""
+    with chatgpt_metrics.trace(config_name or pool.config_name):
+        async with pool.session(config_name, person_name) as session:
+            response = ""
+            async for delta in session.chat_gpt.rpa.ask_stream(prompt):
+                response += delta
+                yield {"delta": delta}
+            result = {
+                "config": session.config_name,
+                "person": session.chat_gpt.get_person().name,
+                "prompt": prompt,
+                "response": response or None,
+                "provider_error": session.chat_gpt.rpa.last_response_error,
+                "timeout": session.chat_gpt.rpa.last_response_timeout
+            }
+        yield result
+
+
+async def serve_pool(pool: ChatGPTPool, host: str, port: int):
+    """Serve the pool over a JSON-lines TCP protocol (one request per line)."""
+    from llm.chatgpt_scheduler import ChatGPTScheduler, ProviderUnavailable
+
+    scheduler = ChatGPTScheduler(pool)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    if request.get("cmd") == "stats":
+                        result = pool.stats()
+                        result["scheduler"] = scheduler.stats()
+                        if pool.cache:
+                            result["cache"] = pool.cache.stats()
+                    elif request.get("cmd") == "metrics":
+                        result = chatgpt_metrics.get_metrics().snapshot()
+                    elif request.get("stream"):
+                        async for result in scheduler.stream_request(request):
+                            if "delta" in result:
+                                writer.write(json.dumps(result, ensure_ascii=False).encode() + b"\n")
+                                await writer.drain()
+                    else:
+                        result = await scheduler.submit_request(request)
+                except ProviderUnavailable as e:
+                    LOGGER.error(f"ChatGPT: {e}")
+                    result = {"error": repr(e), "scheduler": e.result["scheduler"]}
+                except Exception as e:
+                    LOGGER.error("ChatGPT: Ошибка обработки запроса пула", exc_info=True)
+                    result = {"error": repr(e)}
+
+                writer.write(json.dumps(result, ensure_ascii=False).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    LOGGER.info(f"ChatGPT: Пул браузеров слушает {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+async def pool_request(request: dict, host: str, port: int) -> dict:
+    """Send one request to a running pool daemon and return its JSON reply."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(json.dumps(request, ensure_ascii=False).encode() + b"\n")
+        await writer.drain()
+        line = await reader.readline()
+    finally:
+        writer.close()
+
+    if not line:
+        raise ConnectionError("Пул браузеров закрыл соединение")
+
+    result = json.loads(line)
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result
+
+
+async def pool_stream(request: dict, host: str, port: int) -> AsyncIterator[dict]:
+    """Streaming counterpart of `pool_request`: yields delta chunks, then the result."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(json.dumps({**request, "stream": True}, ensure_ascii=False).encode() + b"\n")
+        await writer.drain()
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("Пул браузеров закрыл соединение")
+
+            chunk = json.loads(line)
+            if "error" in chunk:
+                raise RuntimeError(chunk["error"])
+            yield chunk
+            if "delta" not in chunk:
+                return
+    finally:
+        writer.close()
@@ -0,0 +1,138 @@
+import asyncio
+import math
+import time
+from typing import Optional, List, Dict, Set, Tuple
+
+from akp.logger import LOGGER
+from llm.chatgpt_pool import ChatGPTPool
+from llm.chatgpt_stats import ProviderStats, get_provider_stats
+
+# задержка запасного запроса, пока по провайдеру нет статистики
+DEFAULT_HEDGE_DELAY = 15.0
+
+# отменённые сессии закрываются в фоне, чтобы не задерживать ответ победителя
+_CLEANUP_TASKS: Set[asyncio.Task] = set()
+
+
+async def _attempt(pool: ChatGPTPool, config_name: str, prompt: str,
+                   person_name: Optional[str]) -> Tuple[Optional[str], bool, float]:
+    # задержка считается с получения сессии: в холодном пуле это запуск браузера и загрузка страницы,
+    # и запасной запрос должен ждать их тоже
+    started = time.monotonic()
+    session = await pool.acquire(config_name, person_name)
+    rpa = session.chat_gpt.rpa
+    healthy = False
+    try:
+        response = await rpa.ask(prompt)
+        healthy = True
+        return response, rpa.last_response_error, time.monotonic() - started
+    except asyncio.CancelledError:
+        # проигравшая сессия: останавливаем генерацию и начинаем чистый диалог
+        try:
+            healthy = await rpa.reset_conversation()
+        except Exception:
+            LOGGER.warning(f"ChatGPT: Не удалось сбросить сессию {config_name}", exc_info=True)
+        raise
+    finally:
+        await pool.release(session, healthy)
+
+
+async def race_prompt(pool: ChatGPTPool, prompt: str, config_names: List[str],
+                      person_name: Optional[str] = None,
+                      hedge: bool = False,
+                      hedge_delay: Optional[float] = None,
+                      stats: Optional[ProviderStats] = None) -> dict:
+    """Ask several configs and return the first non-error response.
+
+    Without `hedge` all configs start at once. With `hedge` they start one by one,
+    fastest by p50 first; the next one fires when the p95 latency of the previous
+    one (or `hedge_delay`) has passed since its launch, or immediately when it fails.
+    Latencies include acquiring the session, so a cold pool is accounted for.
+    """
+    stats = stats or get_provider_stats()
+    queue = list(config_names)
+    if hedge:
+        queue.sort(key=lambda name: stats.percentile(name, 0.5) or math.inf)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    pending: Dict[asyncio.Task, str] = {}
+    launched: List[str] = []
+    launched_at = started
+    latencies: Dict[str, float] = {}
+    failed: List[str] = []
+    winner, response = None, None
+
+    def launch():
+        nonlocal launched_at
+        launched_at = loop.time()
+        name = queue.pop(0)
+        launched.append(name)
+        pending[asyncio.create_task(_attempt(pool, name, prompt, person_name))] = name
+
+    launch()
+    while queue and not hedge:
+        launch()
+
+    try:
+        while pending:
+            timeout = None
+            if queue:
+                delay = hedge_delay or stats.percentile(launched[-1], 0.95) or DEFAULT_HEDGE_DELAY
+                timeout = max(0.0, launched_at + delay - loop.time())
+
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                LOGGER.debug(f"ChatGPT: {launched[-1]} не ответил за {delay:.1f} с, запускаю запасной запрос...")
+                launch()
+                continue
+
+            for task in done:
+                name = pending.pop(task)
+                try:
+                    text, error, latency = task.result()
+                except Exception:
+                    LOGGER.warning(f"ChatGPT: Провайдер {name} завершился с ошибкой", exc_info=True)
+                    stats.record(name, 0, error=True)
+                    failed.append(name)
+                    continue
+
+                latencies[name] = round(latency, 3)
+                if text and not error:
+                    stats.record(name, latency)
+                    if winner is None:
+                        winner, response = name, text
+                else:
+                    stats.record(name, latency, error=True)
+                    failed.append(name)
+
+            if winner:
+                break
+            if queue and not pending:
+                launch()
+    finally:
+        cancelled = list(pending.values())
+        for task in pending:
+            task.cancel()
+            _CLEANUP_TASKS.add(task)
+            task.add_done_callback(_CLEANUP_TASKS.discard)
+
+        stats.record_race(winner, launched, cancelled)
+        stats.save()
+
+    return {
+        "config": winner,
+        "prompt": prompt,
+        "response": response,
+        "race": {
+            "latency": round(loop.time() - started, 3),
+            "latencies": latencies,
+            "failed": failed,
+            "cancelled": cancelled,
+        }
+    }
+
+
+async def wait_race_cleanup():
+    """Wait until sessions of cancelled race participants are reset and released."""
+    await asyncio.gather(*_CLEANUP_TASKS, return_exceptions=True)
@@ -0,0 +1,372 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Tuple, Callable, AsyncIterator
+
+from akp.logger import LOGGER
+from config.config import settings
+from llm import chatgpt_metrics
+from llm.chatgpt_config import RateLimits, get_config
+from llm.chatgpt_pool import ChatGPTPool, run_pool_prompt, stream_pool_prompt
+
+
+class ProviderUnavailable(RuntimeError):
+    """All attempts failed; `result` holds the last result (if any) with the scheduler info."""
+
+    def __init__(self, message: str, result: dict):
+        super().__init__(message)
+        self.result = result
+
+
+class TokenBucket:
+
+    def __init__(self, per_minute: float, burst: int):
+        self._rate = per_minute / 60
+        self._burst = max(1, burst)
+        self._tokens = float(self._burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @property
+    def tokens(self) -> float:
+        return min(self._burst, self._tokens + (time.monotonic() - self._updated) * self._rate)
+
+    async def acquire(self):
+        # под замком ожидающие получают токены по очереди
+        async with self._lock:
+            while True:
+                self._tokens = self.tokens
+                self._updated = time.monotonic()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` failures in a row -> half_open after `cooldown` (one probe)."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failures: int, cooldown: float):
+        self._threshold = max(1, failures)
+        self._cooldown = cooldown
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at < self._cooldown:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def retry_in(self) -> float:
+        """Seconds until the provider can be tried again."""
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self._opened_at + self._cooldown - time.monotonic())
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self._threshold:
+            self._opened_at = time.monotonic()
+        self._probing = False
+
+    def cancel(self):
+        """The attempt was cancelled before it got an outcome."""
+        self._probing = False
+
+    def trip(self):
+        """Open the breaker on a failure seen elsewhere (another worker of the same provider)."""
+        if self.state != self.OPEN:
+            self._opened_at = time.monotonic()
+        self._probing = False
+
+
+class PriorityGate:
+    """Semaphore handing free slots to waiters by priority (lower first), FIFO within one priority."""
+
+    def __init__(self, limit: int):
+        self._limit = max(1, limit)
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for *_, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int):
+        if self.active < self._limit and not self.waiting:
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # слот уже передан - возвращаем его следующему
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            *_, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # слот переходит ожидающему, active не меняется
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+class Provider:
+
+    def __init__(self, name: str, limits: RateLimits):
+        self.name = name
+        self.bucket = TokenBucket(limits.per_minute, limits.burst)
+        self.gate = PriorityGate(limits.concurrency)
+        self.breaker = CircuitBreaker(limits.breaker_failures, limits.breaker_cooldown)
+
+    @asynccontextmanager
+    async def slot(self, priority: int):
+        await self.gate.acquire(priority)
+        try:
+            await self.bucket.acquire()
+            yield
+        finally:
+            self.gate.release()
+
+    def stats(self) -> dict:
+        return {
+            "breaker": self.breaker.state,
+            "failures": self.breaker.failures,
+            "active": self.gate.active,
+            "waiting": self.gate.waiting,
+            "tokens": round(self.bucket.tokens, 2),
+        }
+
+
+class ChatGPTScheduler:
+    """Runs pool prompts under per-provider rate limits, retries and circuit breakers.
+
+    A request names one or more configs in order of preference; every attempt goes to the
+    first of them whose breaker lets it through. Timeouts, empty replies, exceptions and
+    error messages of the site (`assistant_msg_error_sel`) are failures: they are retried
+    with jittered exponential backoff and counted by the provider's breaker.
+    """
+
+    def __init__(self, pool: ChatGPTPool,
+                 max_retries: Optional[int] = None,
+                 backoff: Optional[float] = None,
+                 max_backoff: Optional[float] = None,
+                 share: int = 1,
+                 on_trip: Optional[Callable[[str], None]] = None):
+        self._pool = pool
+        self._providers: Dict[str, Provider] = {}
+        # процессов, делящих лимиты провайдеров (воркеры ask_batch); о сработавшем предохранителе
+        # сообщается через on_trip, чтобы остальные процессы вывели провайдера из ротации тоже
+        self._share = max(1, share)
+        self._on_trip = on_trip
+        self._max_retries = max_retries if max_retries is not None else settings.get("chatgpt.scheduler.max_retries", 2)
+        self._backoff = backoff if backoff is not None else settings.get("chatgpt.scheduler.backoff", 2.0)
+        self._max_backoff = max_backoff if max_backoff is not None else settings.get("chatgpt.scheduler.max_backoff", 30.0)
+
+    @property
+    def pool(self) -> ChatGPTPool:
+        return self._pool
+
+    def provider(self, name: str) -> Provider:
+        if name not in self._providers:
+            cfg = get_config(name)
+            if cfg is None:
+                raise ValueError(f"Неизвестная конфигурация: {name}")
+            self._providers[name] = Provider(name, cfg.limits.share(self._share))
+        return self._providers[name]
+
+    def trip(self, name: str):
+        """Take the provider out of rotation after its breaker opened in another process."""
+        self.provider(name).breaker.trip()
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: provider.stats() for name, provider in self._providers.items()}
+
+    async def submit(self, prompt: str,
+                     config_names: Optional[List[str]] = None,
+                     person_name: Optional[str] = None,
+                     priority: int = 0,
+                     refresh=False,
+                     timings=False) -> dict:
+        """Result of `run_pool_prompt` plus a "scheduler" section with attempts and breaker states."""
+        config_names = list(config_names or [self._pool.config_name])
+        providers = [self.provider(name) for name in config_names]
+
+        if not refresh and self._pool.cache_lookup(prompt, config_names[0], person_name) is not None:
+            # ответ из кэша не расходует лимиты провайдера
+            return await run_pool_prompt(self._pool, prompt, config_names[0], person_name, timings=timings)
+
+        attempts: List[dict] = []
+        result: Optional[dict] = None
+        for attempt in range(self._max_retries + 1):
+            if attempt:
+                chatgpt_metrics.count("retries", attempts[-1]["config"])
+                await asyncio.sleep(self._delay(attempt))
+
+            provider = await self._choose(providers)
+            started = time.monotonic()
+            failure, outcome = None, False
+            try:
+                async with provider.slot(priority):
+                    result = await run_pool_prompt(self._pool, prompt, provider.name, person_name,
+                                                   refresh=refresh, timings=timings)
+                failure, outcome = self._failure(result), True
+            except Exception as e:
+                LOGGER.warning(f"ChatGPT: Попытка {attempt + 1} для {provider.name} завершилась ошибкой",
+                               exc_info=True)
+                failure, outcome = repr(e), True
+            finally:
+                if not outcome:
+                    provider.breaker.cancel()
+
+            attempts.append({"config": provider.name, "latency": round(time.monotonic() - started, 3),
+                             "error": failure})
+            if failure is None:
+                provider.breaker.success()
+                return self._annotate(result, attempts, providers)
+
+            self._failed(provider)
+
+        result = self._annotate(result or {"prompt": prompt, "response": None}, attempts, providers)
+        raise ProviderUnavailable(f"Нет ответа после {len(attempts)} попыток: {attempts[-1]['error']}", result)
+
+    async def stream(self, prompt: str,
+                     config_names: Optional[List[str]] = None,
+                     person_name: Optional[str] = None,
+                     priority: int = 0) -> AsyncIterator[dict]:
+        """`stream_pool_prompt` under the same limits, breakers and retries as `submit`; an attempt
+        is retried only while it has not streamed anything, a later failure raises ProviderUnavailable
+        with the partial response in its result."""
+        config_names = list(config_names or [self._pool.config_name])
+        providers = [self.provider(name) for name in config_names]
+
+        attempts: List[dict] = []
+        result: Optional[dict] = None
+        streamed = False
+        for attempt in range(self._max_retries + 1):
+            if attempt:
+                chatgpt_metrics.count("retries", attempts[-1]["config"])
+                await asyncio.sleep(self._delay(attempt))
+
+            provider = await self._choose(providers)
+            started = time.monotonic()
+            failure, outcome, result = None, False, None
+            try:
+                async with provider.slot(priority):
+                    async for chunk in stream_pool_prompt(self._pool, prompt, provider.name, person_name):
+                        if "delta" in chunk:
+                            streamed = True
+                            yield chunk
+                        else:
+                            result = chunk
+                failure, outcome = self._failure(result or {}), True
+            except Exception as e:
+                LOGGER.warning(f"ChatGPT: Попытка {attempt + 1} для {provider.name} завершилась ошибкой",
+                               exc_info=True)
+                failure, outcome = repr(e), True
+            finally:
+                # клиент закрыл поток - попытка не завершилась ни успехом, ни ошибкой
+                if not outcome:
+                    provider.breaker.cancel()
+
+            attempts.append({"config": provider.name, "latency": round(time.monotonic() - started, 3),
+                             "error": failure})
+            if failure is None:
+                provider.breaker.success()
+                yield self._annotate(result, attempts, providers)
+                return
+
+            self._failed(provider)
+            if streamed:
+                # часть ответа уже у клиента - повтор склеил бы два разных ответа
+                break
+
+        result = self._annotate(result or {"prompt": prompt, "response": None}, attempts, providers)
+        raise ProviderUnavailable(f"Нет ответа после {len(attempts)} попыток: {attempts[-1]['error']}", result)
+
+    async def submit_request(self, request: dict) -> dict:
+        """`submit` for a JSON request: {"prompt", "config" or "configs", "person", "priority", "refresh", "timings"}."""
+        return await self.submit(request["prompt"],
+                                 config_names=request.get("configs") or
+                                 ([request["config"]] if request.get("config") else None),
+                                 person_name=request.get("person"),
+                                 priority=request.get("priority", 0),
+                                 refresh=request.get("refresh", False),
+                                 timings=request.get("timings", False))
+
+    def stream_request(self, request: dict) -> AsyncIterator[dict]:
+        """`stream` for a JSON request: {"prompt", "config" or "configs", "person", "priority"}."""
+        return self.stream(request["prompt"],
+                           config_names=request.get("configs") or
+                           ([request["config"]] if request.get("config") else None),
+                           person_name=request.get("person"),
+                           priority=request.get("priority", 0))
+
+    @staticmethod
+    def _failure(result: dict) -> Optional[str]:
+        if result.get("provider_error"):
+            return "error_response"
+        if result.get("timeout"):
+            return "timeout"
+        if result.get("response") is None:
+            return "no_response"
+        return None
+
+    def _failed(self, provider: Provider):
+        provider.breaker.failure()
+        if provider.breaker.state != CircuitBreaker.CLOSED:
+            LOGGER.warning(f"ChatGPT: {provider.name} выведен из ротации на "
+                           f"{provider.breaker.retry_in():.0f} с после {provider.breaker.failures} ошибок подряд")
+            if self._on_trip:
+                self._on_trip(provider.name)
+
+    async def _choose(self, providers: List[Provider]) -> Provider:
+        while True:
+            for provider in providers:
+                if provider.breaker.allow():
+                    return provider
+            # все провайдеры выведены из ротации - ждём ближайшей пробы
+            await asyncio.sleep(max(0.1, min(p.breaker.retry_in() for p in providers)))
+
+    def _delay(self, attempt: int) -> float:
+        delay = min(self._max_backoff, self._backoff * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    @staticmethod
+    def _annotate(result: dict, attempts: List[dict], providers: List[Provider]) -> dict:
+        result["scheduler"] = {
+            "attempts": attempts,
+            "retries": len(attempts) - 1,
+            "breakers": {p.name: p.breaker.state for p in providers},
+        }
+        return result
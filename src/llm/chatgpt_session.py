@@ -0,0 +1,116 @@
+import json
+import time
+from pathlib import Path
+from typing import Optional
+
+from akp.logger import LOGGER
+from akp.selenium_driverless_ex.webdriver_ex import ChromeEx
+from config.config import settings
+from llm.chatgpt_config import ChatGPTConfig
+from utils import get_browser_path
+
+# поля Network.CookieParam, остальные поля Network.Cookie при восстановлении не принимаются
+_COOKIE_PARAMS = ("name", "value", "domain", "path", "secure", "httpOnly", "sameSite", "expires",
+                  "priority", "sourceScheme", "sourcePort", "partitionKey")
+
+_LOCAL_STORAGE_JS = "return {origin: location.origin, items: Object.assign({}, window.localStorage)};"
+
+# выполняется до скриптов страницы, не перетирая значения, которые сайт уже обновил
+_RESTORE_LOCAL_STORAGE_JS = """
+(() => {
+    const snapshot = %s;
+    if (location.origin !== snapshot.origin) return;
+    for (const [key, value] of Object.entries(snapshot.items)) {
+        if (localStorage.getItem(key) === null) localStorage.setItem(key, value);
+    }
+})();
+"""
+
+
+class SessionStore:
+    """Cookies and localStorage of a logged-in config, saved after `authorize` and restored into new drivers."""
+
+    def __init__(self, directory: Path, max_age: float = 7 * 24 * 3600):
+        self._directory = directory
+        self._max_age = max_age
+
+    def _path(self, config_name: str) -> Path:
+        return self._directory / f"{config_name}.json"
+
+    def load(self, config_name: str) -> Optional[dict]:
+        path = self._path(config_name)
+        try:
+            snapshot = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+        now = time.time()
+        if now - snapshot.get("saved_at", 0) > self._max_age:
+            LOGGER.debug(f"ChatGPT: Снимок сессии {config_name} устарел")
+            return None
+
+        cookies = [c for c in snapshot["cookies"] if c.get("expires", -1) <= 0 or c["expires"] > now]
+        if snapshot["cookies"] and not cookies:
+            LOGGER.debug(f"ChatGPT: Все cookies сессии {config_name} истекли")
+            return None
+        snapshot["cookies"] = cookies
+        return snapshot
+
+    async def save(self, driver: ChromeEx, cfg: ChatGPTConfig):
+        # только cookies страниц конфигурации, а не всех сайтов профиля
+        urls = [url for url in (cfg.main_page, cfg.login_page) if url]
+        cookies = (await driver.execute_cdp_cmd("Network.getCookies", {"urls": urls}))["cookies"]
+        local_storage = await driver.execute_script(_LOCAL_STORAGE_JS)
+
+        self._directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(cfg.name)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({
+            "saved_at": time.time(),
+            "cookies": [{k: v for k, v in c.items() if k in _COOKIE_PARAMS} for c in cookies],
+            "local_storage": local_storage,
+        }, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+        LOGGER.debug(f"ChatGPT: Сессия {cfg.name} сохранена ({len(cookies)} cookies)")
+
+    async def restore(self, driver: ChromeEx, cfg: ChatGPTConfig) -> Optional[dict]:
+        """Load the snapshot into the driver before the main page is opened; the returned
+        handle (None if there is no snapshot) is passed to `invalidate` if the session is rejected."""
+        snapshot = self.load(cfg.name)
+        if not snapshot:
+            return None
+
+        cookies = [{k: v for k, v in c.items() if not (k == "expires" and v <= 0)} for c in snapshot["cookies"]]
+        if cookies:
+            await driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies})
+
+        script = None
+        if snapshot.get("local_storage", {}).get("items"):
+            source = _RESTORE_LOCAL_STORAGE_JS % json.dumps(snapshot["local_storage"], ensure_ascii=False)
+            script = (await driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument",
+                                                   {"source": source}))["identifier"]
+
+        LOGGER.debug(f"ChatGPT: Сессия {cfg.name} восстановлена из снимка")
+        return {"script": script}
+
+    async def invalidate(self, config_name: str, driver: Optional[ChromeEx] = None, restored: Optional[dict] = None):
+        """Delete the snapshot and stop restoring its localStorage into the driver's new documents."""
+        self._path(config_name).unlink(missing_ok=True)
+        if driver and restored and restored.get("script"):
+            try:
+                await driver.execute_cdp_cmd("Page.removeScriptToEvaluateOnNewDocument",
+                                             {"identifier": restored["script"]})
+            except Exception:
+                LOGGER.debug("ChatGPT: Не удалось снять скрипт восстановления localStorage", exc_info=True)
+
+
+_SESSION_STORE: Optional[SessionStore] = None
+
+
+def get_session_store() -> SessionStore:
+    global _SESSION_STORE
+
+    if _SESSION_STORE is None:
+        _SESSION_STORE = SessionStore(get_browser_path() / settings.get("chatgpt.sessions.dir", "sessions"),
+                                      max_age=settings.get("chatgpt.sessions.max_age", 7 * 24 * 3600))
+    return _SESSION_STORE
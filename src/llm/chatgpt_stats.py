@@ -0,0 +1,288 @@
+import atexit
+import json
+import math
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import akp.root
+from akp.logger import LOGGER
+from config.config import settings
+
+# сколько последних замеров хранить на провайдера
+_WINDOW = 200
+# меньше замеров - ожидания по умолчанию
+_MIN_SAMPLES = 5
+# ожидания ответа подбираются по последним замерам, чтобы после редких зависаний таймаут вернулся вниз
+_RECENT = {"response": 50}
+# доля ответов, не дождавшихся окончания в окне, с которой таймаут растёт вслед за ними
+_STALL_SHARE = 0.05
+# не чаще, чем раз в столько секунд, модель задержек пишется на диск
+_SAVE_PERIOD = 30
+# блокировка файла статистики старше этого брошена упавшим процессом
+_LOCK_STALE = 10
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+
+@contextmanager
+def _file_lock(path: Path):
+    lock = path.with_name(path.name + ".lock")
+    while True:
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - lock.stat().st_mtime > _LOCK_STALE:
+                    lock.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        lock.unlink(missing_ok=True)
+
+
+class JsonStats:
+    """Samples kept in memory and persisted as one JSON file between runs; a broken or
+    unwritable file is logged, never raised.
+
+    Several processes share the file: `save` merges the samples and counters recorded
+    since the last save into the file's current contents under a lock file.
+    """
+
+    # что хранится в файле - для сообщений в логе
+    _title = "статистику"
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._data: Dict[str, dict] = self._load() or {}
+        # записанное после последнего сохранения: ключ -> поле -> новые замеры или прирост счётчика
+        self._pending: Dict[str, dict] = {}
+        self._saved = time.monotonic()
+
+    def _load(self) -> Optional[Dict[str, dict]]:
+        if not self._path.exists():
+            return {}
+        try:
+            return json.loads(self._path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            LOGGER.warning(f"ChatGPT: Не удалось прочитать {self._title} {self._path}")
+            return None
+
+    def _entry(self, data: Dict[str, dict], key: str) -> dict:
+        return data.setdefault(key, {})
+
+    def _window(self, field: str) -> int:
+        return _WINDOW
+
+    def _add_sample(self, key: str, field: str, value: float):
+        value = round(value, 3)
+        entry = self._entry(self._data, key)
+        entry[field] = (entry.get(field, []) + [value])[-self._window(field):]
+        pending = self._pending.setdefault(key, {})
+        pending[field] = (pending.get(field, []) + [value])[-self._window(field):]
+
+    def _add_count(self, key: str, field: str):
+        entry = self._entry(self._data, key)
+        entry[field] = entry.get(field, 0) + 1
+        pending = self._pending.setdefault(key, {})
+        pending[field] = pending.get(field, 0) + 1
+
+    def _merge(self, data: Dict[str, dict], pending: Dict[str, dict]) -> Dict[str, dict]:
+        for key, fields in pending.items():
+            entry = self._entry(data, key)
+            for field, value in fields.items():
+                if isinstance(value, list):
+                    entry[field] = (entry.get(field, []) + value)[-self._window(field):]
+                else:
+                    entry[field] = entry.get(field, 0) + value
+        return data
+
+    def _changed(self, save_period: Optional[float] = None):
+        if save_period is not None and time.monotonic() - self._saved > save_period:
+            self.save()
+
+    def save(self):
+        if not self._pending:
+            return
+        self._saved = time.monotonic()
+        pending, self._pending = self._pending, {}
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            # воркеры пакета и гонки пишут одновременно: свои замеры добавляются к записанным другими
+            with _file_lock(self._path):
+                on_disk = self._load()
+                data = self._merge(on_disk, pending) if on_disk is not None else self._data
+                tmp = self._path.with_suffix(f".{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+                tmp.replace(self._path)
+            self._data = data
+        except OSError:
+            LOGGER.warning(f"ChatGPT: Не удалось сохранить {self._title} {self._path}", exc_info=True)
+
+
+class ProviderStats(JsonStats):
+    """Per-provider latency samples and race outcomes."""
+
+    _title = "статистику провайдеров"
+
+    def _entry(self, data: Dict[str, dict], key: str) -> dict:
+        return data.setdefault(key, {"latencies": [], "wins": 0, "races": 0, "errors": 0, "cancelled": 0})
+
+    def _provider(self, name: str) -> dict:
+        return self._entry(self._data, name)
+
+    def record(self, name: str, latency: float, error: bool = False):
+        if error:
+            self._add_count(name, "errors")
+        else:
+            self._add_sample(name, "latencies", latency)
+        self._changed()
+
+    def record_race(self, winner: Optional[str], participants: List[str], cancelled: List[str]):
+        for name in participants:
+            self._add_count(name, "races")
+        for name in cancelled:
+            self._add_count(name, "cancelled")
+        if winner:
+            self._add_count(winner, "wins")
+        self._changed()
+
+    def percentile(self, name: str, q: float) -> Optional[float]:
+        return percentile(self._provider(name)["latencies"], q)
+
+    def summary(self) -> Dict[str, dict]:
+        return {
+            name: {
+                "wins": p["wins"],
+                "races": p["races"],
+                "errors": p["errors"],
+                "cancelled": p["cancelled"],
+                "p50": percentile(p["latencies"], 0.5),
+                "p95": percentile(p["latencies"], 0.95),
+            }
+            for name, p in self._data.items()
+        }
+
+
+_PROVIDER_STATS: Optional[ProviderStats] = None
+
+
+def get_provider_stats() -> ProviderStats:
+    global _PROVIDER_STATS
+
+    if _PROVIDER_STATS is None:
+        path = akp.root.get_external_project_root() / settings.get("chatgpt.stats.path", "cache/provider_stats.json")
+        _PROVIDER_STATS = ProviderStats(path)
+    return _PROVIDER_STATS
+
+
+def _clamp(value: float, low: float, high: float) -> float:
+    return max(low, min(high, value))
+
+
+@dataclass(frozen=True)
+class WaitTimings:
+    """Waits of ChatGPTRPA; the defaults are used until a provider has enough samples."""
+    # появление поля ввода после загрузки страницы
+    page_timeout: float = 10
+    # ожидание полного ответа
+    response_timeout: float = 30
+    # ответ считается готовым, если текст не менялся столько секунд (когда нет кнопки остановки)
+    quiet: float = 1.0
+    # опрос страницы после нового чата
+    poll: float = 0.25
+
+
+DEFAULT_WAIT_TIMINGS = WaitTimings()
+
+
+class LatencyModel(JsonStats):
+    """Per config (and persona, for reply metrics) latency samples that drive WaitTimings.
+
+    Metrics: `page_load` (navigation to the input field), `new_chat`, `first_token`,
+    `response` (send to complete reply) and `gap` (longest pause between streamed chunks).
+    A wait that ran out is censored: it is kept with a minus sign (the reply took longer
+    than that) and only raises the timeout while such stalls are frequent in the window.
+    """
+
+    _title = "модель задержек"
+
+    @staticmethod
+    def key(config_name: str, person_name: Optional[str] = None) -> str:
+        return f"{config_name}/{person_name}" if person_name else config_name
+
+    def _window(self, field: str) -> int:
+        return _RECENT.get(field, _WINDOW)
+
+    def record(self, key: str, metric: str, seconds: float, timed_out=False):
+        self._add_sample(key, metric, -seconds if timed_out else seconds)
+        self._changed(_SAVE_PERIOD)
+
+    def _samples(self, key: str, metric: str) -> List[float]:
+        return self._data.get(key, {}).get(metric, [])[-_RECENT.get(metric, _WINDOW):]
+
+    def percentile(self, key: str, metric: str, q: float) -> Optional[float]:
+        samples = [s for s in self._samples(key, metric) if s > 0]
+        return percentile(samples, q) if len(samples) >= _MIN_SAMPLES else None
+
+    def stalled(self, key: str, metric: str) -> Optional[float]:
+        """Longest wait that ran out, if waits run out often enough to trust them."""
+        samples = self._samples(key, metric)
+        stalls = [-s for s in samples if s < 0]
+        if not stalls or len(stalls) < _STALL_SHARE * len(samples):
+            return None
+        return max(stalls)
+
+    def timings(self, config_name: str, person_name: Optional[str] = None) -> WaitTimings:
+        page = self.percentile(config_name, "page_load", 0.99)
+        new_chat = self.percentile(config_name, "new_chat", 0.5)
+        reply_key = self.key(config_name, person_name)
+        response = self.percentile(reply_key, "response", 0.99)
+        stalled = self.stalled(reply_key, "response")
+        gap = self.percentile(reply_key, "gap", 0.95)
+
+        default = DEFAULT_WAIT_TIMINGS
+        response_timeout = response * 1.5 if response else default.response_timeout
+        if stalled:
+            # ответ дольше, чем его ждали: следующий ждём дольше, пока зависания не уйдут из окна
+            response_timeout = max(response_timeout, stalled * 1.5)
+        return WaitTimings(
+            page_timeout=_clamp(page * 2, 5, 60) if page else default.page_timeout,
+            response_timeout=_clamp(response_timeout, 15, 300),
+            quiet=_clamp(gap * 1.5, 0.3, 2.0) if gap else default.quiet,
+            poll=_clamp(new_chat / 4, 0.05, 0.5) if new_chat else default.poll,
+        )
+
+    def summary(self) -> Dict[str, dict]:
+        return {
+            key: {metric: {"p50": self.percentile(key, metric, 0.5), "p95": self.percentile(key, metric, 0.95),
+                           "n": len(samples), "timeouts": sum(1 for s in samples if s < 0)}
+                  for metric, samples in metrics.items()}
+            for key, metrics in self._data.items()
+        }
+
+
+_LATENCY_MODEL: Optional[LatencyModel] = None
+
+
+def get_latency_model() -> LatencyModel:
+    global _LATENCY_MODEL
+
+    if _LATENCY_MODEL is None:
+        path = akp.root.get_external_project_root() / settings.get("chatgpt.stats.latency_path", "cache/latency.json")
+        _LATENCY_MODEL = LatencyModel(path)
+        atexit.register(_LATENCY_MODEL.save)
+    return _LATENCY_MODEL
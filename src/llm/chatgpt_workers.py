@@ -0,0 +1,275 @@
+import asyncio
+import multiprocessing
+import signal
+import sys
+import threading
+from collections import deque
+from dataclasses import dataclass, replace
+from multiprocessing.connection import Connection, wait
+from typing import Optional, List, Dict, Callable, Any, Deque
+
+from akp.logger import LOGGER
+
+# код выхода воркера, который просит перезапустить его с новыми браузерами
+_RESTART_EXIT = 3
+# столько промтов подряд без ответа - и воркер перезапускается
+_MAX_CONSECUTIVE_FAILURES = 5
+
+
+@dataclass(frozen=True)
+class WorkerOptions:
+    """What a worker process needs to rebuild the parent's settings and its own pool."""
+    sessions: int = 2
+    config_name: Optional[str] = None
+    person_name: Optional[str] = None
+    log: Optional[int] = None
+    use_cache: bool = True
+    # вызывается в воркере после настроек (например, регистрация конфигураций заглушки); должна пиклиться
+    setup: Optional[Callable[[], None]] = None
+    # воркеров всего - лимиты провайдеров делятся между ними (задаёт координатор)
+    workers: int = 1
+
+
+async def answer_item(scheduler, item: dict) -> dict:
+    """Scheduler result for a batch item; failures are returned with an "error" key instead of raised."""
+    from llm.chatgpt_scheduler import ProviderUnavailable
+
+    try:
+        return await scheduler.submit_request(item)
+    except ProviderUnavailable as e:
+        LOGGER.error(f"ChatGPT: Промт {item.get('id')}: {e}")
+        return {**e.result, "error": repr(e)}
+    except Exception as e:
+        LOGGER.error(f"ChatGPT: Ошибка промта {item.get('id')}", exc_info=True)
+        return {"prompt": item["prompt"], "error": repr(e)}
+
+
+def _worker_main(index: int, conn: Connection, options: WorkerOptions):
+    # Ctrl-C и SIGTERM получает вся группа процессов - остановкой управляет координатор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    from config.config import apply_cli_settings, settings
+
+    apply_cli_settings(options.log, options.config_name, options.person_name)
+    LOGGER.enable(settings.chatgpt.logging.enabled == 1)
+    if options.setup:
+        options.setup()
+    sys.exit(asyncio.run(_run_worker(index, conn, options)))
+
+
+async def _run_worker(index: int, conn: Connection, options: WorkerOptions) -> int:
+    """Answer items sent by the coordinator until it sends None; the exit code asks for a restart."""
+    from config.config import settings
+    from llm.chatgpt_cache import get_response_cache
+    from llm.chatgpt_pool import ChatGPTPool
+    from llm.chatgpt_scheduler import ChatGPTScheduler
+
+    pool = ChatGPTPool(size=options.sessions, max_browsers=options.sessions, idle_timeout=0,
+                       config_name=settings.chatgpt.config.name,
+                       person_name=settings.chatgpt.person.name,
+                       cache=get_response_cache() if options.use_cache else None)
+    scheduler = ChatGPTScheduler(pool, share=options.workers,
+                                 on_trip=lambda name: conn.send(("trip", index, name)))
+    loop = asyncio.get_running_loop()
+    running = set()
+    failures = 0
+    restart = False
+
+    async def answer(item: dict):
+        nonlocal failures, restart
+        result = await answer_item(scheduler, item)
+        # промты подряд без ответа даже после повторов - браузеры воркера стоит пересоздать
+        failures = failures + 1 if "error" in result else 0
+        conn.send(("done", index, item["id"], result))
+        if failures == _MAX_CONSECUTIVE_FAILURES and not restart:
+            # координатор больше не отдаёт промты - воркер обязан выйти с кодом перезапуска,
+            # даже если дорабатываемые промты успеют ответить и обнулить счётчик
+            restart = True
+            conn.send(("restart", index))
+
+    await pool.start()
+    try:
+        # по числу браузеров - столько промтов координатор отдаст воркеру сразу
+        conn.send(("ready", index, options.sessions))
+        while (item := await loop.run_in_executor(None, conn.recv)) is not None:
+            if isinstance(item, tuple):
+                # ("trip", config): предохранитель провайдера сработал у другого воркера
+                scheduler.trip(item[1])
+                continue
+            task = asyncio.create_task(answer(item))
+            running.add(task)
+            task.add_done_callback(running.discard)
+
+        # остановка: начатые промты дорабатываются
+        await asyncio.gather(*running, return_exceptions=True)
+    finally:
+        await pool.close()
+
+    if restart:
+        LOGGER.warning(f"ChatGPT: Воркер #{index}: {_MAX_CONSECUTIVE_FAILURES} промтов подряд без ответа, "
+                       f"перезапуск...")
+        return _RESTART_EXIT
+    return 0
+
+
+class _Worker:
+
+    def __init__(self, process, conn: Connection):
+        self.process = process
+        self.conn = conn
+        self.free = 0
+        self.taken: Dict[Any, dict] = {}
+        self.stopping = False
+
+    def stop(self):
+        if not self.stopping:
+            self.stopping = True
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+
+
+class WorkerCoordinator:
+    """Spreads prompts over `workers` processes, each with its own event loop, browsers and profiles.
+
+    A worker gets a prompt only when it has a free browser, so fast workers take more of
+    the batch and slow ones do not hoard it. Provider rate limits are divided between the
+    workers, and a breaker that opens in one worker is opened in the others too. Each worker talks to the coordinator over its
+    own pipe: a worker that dies (or asks for a restart after repeated browser failures)
+    is started again and the prompts it had taken go back to the front of the queue.
+    SIGTERM and Ctrl-C drain: no new prompts are handed out, the running ones are finished.
+    """
+
+    def __init__(self, workers: int, options: WorkerOptions, max_restarts: Optional[int] = None):
+        self._count = max(1, workers)
+        self._options = replace(options, workers=self._count)
+        self._max_restarts = max_restarts if max_restarts is not None else 3 * self._count
+        # spawn - одинаково на всех платформах и без унаследованных от родителя потоков
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers: Dict[int, _Worker] = {}
+        self._queue: Deque[dict] = deque()
+        self._draining = False
+        self.restarts = 0
+
+    def run(self, items: List[dict], on_result: Callable[[dict, dict], None]) -> int:
+        """Answer `items` (dicts with "id" and "prompt"), calling `on_result(item, result)`
+        as results arrive; returns the number of items left unanswered."""
+        pending = {item["id"]: item for item in items}
+        self._queue.extend(items)
+        for index in range(self._count):
+            self._start(index)
+
+        # обработчик сигнала ставится только из главного потока (бенчмарк запускает координатор в потоке)
+        in_main = threading.current_thread() is threading.main_thread()
+        previous = signal.signal(signal.SIGTERM, lambda *_: self.drain()) if in_main else None
+        try:
+            while self._workers:
+                try:
+                    ready = wait([w.conn for w in self._workers.values()] +
+                                 [w.process.sentinel for w in self._workers.values()], timeout=1)
+                except KeyboardInterrupt:
+                    self.drain()
+                    continue
+
+                for index, worker in list(self._workers.items()):
+                    if worker.conn in ready or worker.process.sentinel in ready:
+                        # всё, что воркер отправил до выхода, уже лежит в канале
+                        self._receive(worker, pending, on_result)
+                    if worker.process.sentinel in ready:
+                        self._on_exit(index, worker)
+
+                if not pending or self._draining:
+                    for worker in self._workers.values():
+                        worker.stop()
+                else:
+                    self._dispatch()
+        finally:
+            if in_main:
+                signal.signal(signal.SIGTERM, previous)
+            for worker in self._workers.values():
+                worker.stop()
+                worker.process.join()
+
+        if pending:
+            LOGGER.warning(f"ChatGPT: Без ответа осталось {len(pending)} промтов")
+        return len(pending)
+
+    def drain(self):
+        if not self._draining:
+            LOGGER.info("ChatGPT: Остановка: дожидаюсь начатых промтов...")
+        self._draining = True
+
+    def _start(self, index: int):
+        conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, name=f"chatgpt-worker-{index}",
+                                    args=(index, child_conn, self._options))
+        process.start()
+        child_conn.close()
+        self._workers[index] = _Worker(process, conn)
+
+    def _dispatch(self):
+        for worker in self._workers.values():
+            while worker.free and self._queue and not worker.stopping:
+                item = self._queue.popleft()
+                try:
+                    worker.conn.send(item)
+                except OSError:
+                    # воркер уже завершился - промт вернётся в очередь вместе с остальными при его выходе
+                    self._queue.appendleft(item)
+                    worker.stopping = True
+                    break
+                worker.taken[item["id"]] = item
+                worker.free -= 1
+
+    def _receive(self, worker: _Worker, pending: Dict[Any, dict],
+                 on_result: Callable[[dict, dict], None]):
+        while worker.conn.poll():
+            try:
+                kind, _, *payload = worker.conn.recv()
+            except (EOFError, OSError):
+                return
+
+            if kind == "ready":
+                worker.free = payload[0]
+            elif kind == "done":
+                item_id, result = payload
+                worker.taken.pop(item_id, None)
+                worker.free += 1
+                item = pending.pop(item_id, None)
+                if item is not None:
+                    on_result(item, result)
+            elif kind == "restart":
+                worker.stop()
+            elif kind == "trip":
+                self._broadcast(worker, ("trip", payload[0]))
+
+    def _broadcast(self, source: _Worker, message: tuple):
+        for worker in self._workers.values():
+            if worker is not source and not worker.stopping:
+                try:
+                    worker.conn.send(message)
+                except OSError:
+                    pass
+
+    def _on_exit(self, index: int, worker: _Worker):
+        process = worker.process
+        process.join()
+        worker.conn.close()
+        del self._workers[index]
+
+        # промты, взятые воркером, но не отвеченные, отдаются другим в первую очередь
+        self._queue.extendleft(reversed(list(worker.taken.values())))
+        if process.exitcode == 0:
+            return
+
+        LOGGER.warning(f"ChatGPT: Воркер #{index} завершился с кодом {process.exitcode}, "
+                       f"в очередь возвращено {len(worker.taken)} промтов")
+        if self._draining:
+            return
+        if self.restarts >= self._max_restarts:
+            LOGGER.error(f"ChatGPT: Воркер #{index} не перезапущен: исчерпан лимит перезапусков")
+            return
+        self.restarts += 1
+        self._start(index)
@@ -1,17 +1,40 @@
+import importlib
+
 import click
 
-from commands.ask import ask
-from commands.chat import chat
+# команды импортируются только при вызове: модули браузера, dynaconf и кэша
+# грузятся долго, а `--help` и опечатки в имени команды их не требуют
+COMMANDS = {
+    "chat": ("commands.chat", "chat", "Интерактивный режим чата"),
+    "ask": ("commands.ask", "ask", "Получить ответ от GPT и вывести JSON"),
+    "ask-batch": ("commands.ask_batch", "ask_batch", "Получить ответы на промты из JSONL файла"),
+    "pool": ("commands.pool", "pool", "Запустить демон пула прогретых браузеров"),
+    "serve": ("commands.serve", "serve", "Запустить OpenAI-совместимый HTTP API"),
+    "browser": ("commands.browser", "browser", "Держать браузер запущенным для ask --attach"),
+}
+
+
+class LazyGroup(click.Group):
+    def list_commands(self, ctx):
+        return list(COMMANDS)
 
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in COMMANDS:
+            return None
+        module_name, attr, _ = COMMANDS[cmd_name]
+        return getattr(importlib.import_module(module_name), attr)
 
-@click.group()
+    def format_commands(self, ctx, formatter):
+        rows = [(name, short_help) for name, (_, _, short_help) in COMMANDS.items()]
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup)
 def cli():
     """ChatGPT CLI."""
     pass
 
 
-cli.add_command(chat)
-cli.add_command(ask)
-
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,179 @@
+import atexit
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from typing import Optional, Set
+
+from akp.logger import LOGGER
+from config.config import settings
+from utils import get_browser_path
+
+_LOCK_NAME = "rpa.lock"
+# файлы, которые Chrome оставляет при работе/падении и которые мешают запуску клона
+_CHROME_LOCKS = ("SingletonLock", "SingletonSocket", "SingletonCookie", "lockfile")
+# кэши не нужны клону и только замедляют копирование
+_SKIP_DIRS = ("Cache", "Code Cache", "GPUCache", "ShaderCache", "GrShaderCache", "Service Worker")
+
+
+def pid_alive(pid: int) -> bool:
+    """Whether a process with this pid is running (also used for lock files outside profiles)."""
+    if os.name == "nt":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _skipped_parents(root: Path) -> Set[Path]:
+    """Directories under `root` that contain a skipped cache directory somewhere below."""
+    parents: Set[Path] = set()
+    for path, dirs, _ in os.walk(root):
+        if any(d in _SKIP_DIRS for d in dirs):
+            parent = Path(path)
+            while parent != root and parent not in parents:
+                parents.add(parent)
+                parent = parent.parent
+        dirs[:] = [d for d in dirs if d not in _SKIP_DIRS]
+    return parents
+
+
+def _cp_tree(src: Path, dst: Path, reflink: str, parents: Set[Path]):
+    # у cp нет исключений: каталоги с кэшами внутри обходим сами, остальное копируем одним вызовом
+    batch = []
+    for entry in src.iterdir():
+        if entry.name in _SKIP_DIRS or entry.name == _LOCK_NAME:
+            continue
+        if entry in parents:
+            (dst / entry.name).mkdir(exist_ok=True)
+            _cp_tree(entry, dst / entry.name, reflink, parents)
+            shutil.copystat(entry, dst / entry.name)
+        else:
+            batch.append(str(entry))
+    if batch:
+        subprocess.run(["cp", "-a", reflink, *batch, f"{dst}/"], check=True)
+
+
+class ProfileManager:
+    """Hands out per-driver clones of a prepared template Chrome profile.
+
+    A clone is owned while its lock file exists. Released clones are kept for
+    reuse (up to `max_free`), clones of dead processes are deleted on start.
+    """
+
+    def __init__(self, template: Path, clones_dir: Path, max_free: int = 4):
+        self._template = template
+        self._clones_dir = clones_dir
+        self._max_free = max_free
+        self._owned: Set[Path] = set()
+
+        clones_dir.mkdir(parents=True, exist_ok=True)
+        self.gc()
+        atexit.register(self.release_all)
+
+    def acquire(self) -> Path:
+        for clone in sorted(self._clones_dir.iterdir()):
+            if clone.is_dir() and self._claim(clone):
+                LOGGER.debug(f"ChatGPT: Повторно использую профиль {clone.name}")
+                return clone
+
+        clone = self._clones_dir / f"clone-{os.getpid()}-{len(self._owned)}"
+        while clone.exists():
+            clone = clone.with_name(clone.name + "x")
+
+        # лок создаётся до копирования, чтобы другие процессы не заняли недокопированный клон
+        clone.mkdir(parents=True)
+        self._claim(clone)
+        try:
+            self._copy_template(clone)
+        except BaseException:
+            self._owned.discard(clone)
+            shutil.rmtree(clone, ignore_errors=True)
+            raise
+        return clone
+
+    def release(self, clone: Path):
+        self._owned.discard(clone)
+        for name in _CHROME_LOCKS:
+            (clone / name).unlink(missing_ok=True)
+
+        free = [c for c in self._clones_dir.iterdir() if c.is_dir() and not (c / _LOCK_NAME).exists()]
+        if len(free) >= self._max_free:
+            shutil.rmtree(clone, ignore_errors=True)
+            return
+        (clone / _LOCK_NAME).unlink(missing_ok=True)
+
+    def release_all(self):
+        for clone in list(self._owned):
+            self.release(clone)
+
+    def gc(self):
+        """Delete clones whose owning process has died (crashed drivers leave broken profiles)."""
+        for clone in self._clones_dir.iterdir():
+            lock = clone / _LOCK_NAME
+            try:
+                pid = int(lock.read_text())
+            except (OSError, ValueError):
+                continue
+            if not pid_alive(pid):
+                LOGGER.warning(f"ChatGPT: Удаляю профиль упавшего процесса {pid}: {clone.name}")
+                shutil.rmtree(clone, ignore_errors=True)
+
+    def _claim(self, clone: Path) -> bool:
+        try:
+            fd = os.open(clone / _LOCK_NAME, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except (FileExistsError, FileNotFoundError):
+            # занят другим процессом или удалён им между iterdir и open
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        self._owned.add(clone)
+        return True
+
+    def _copy_template(self, clone: Path):
+        if not self._template.exists():
+            LOGGER.warning(f"ChatGPT: Шаблон профиля {self._template} не найден, создаю пустой профиль")
+            return
+
+        LOGGER.debug(f"ChatGPT: Клонирую профиль {self._template.name} -> {clone.name}")
+        if sys.platform != "win32" and shutil.which("cp"):
+            # copy-on-write клон на btrfs/xfs/apfs, обычная копия на остальных ФС
+            reflink = "-c" if sys.platform == "darwin" else "--reflink=auto"
+            _cp_tree(self._template, clone, reflink, _skipped_parents(self._template))
+        else:
+            shutil.copytree(self._template, clone, symlinks=True, dirs_exist_ok=True,
+                            ignore=shutil.ignore_patterns(*_SKIP_DIRS, _LOCK_NAME))
+
+        for name in _CHROME_LOCKS:
+            (clone / name).unlink(missing_ok=True)
+
+
+_PROFILE_MANAGER: Optional[ProfileManager] = None
+
+
+def get_profile_manager() -> ProfileManager:
+    global _PROFILE_MANAGER
+
+    if _PROFILE_MANAGER is None:
+        browser_path = get_browser_path()
+        template = browser_path / settings.get("chatgpt.profiles.template", "user_data_template")
+        if not template.exists():
+            # подготовленный вручную профиль из прежних версий
+            template = browser_path / "user_data1"
+        _PROFILE_MANAGER = ProfileManager(template,
+                                          browser_path / settings.get("chatgpt.profiles.clones_dir", "profiles"),
+                                          max_free=settings.get("chatgpt.profiles.max_free", 4))
+    return _PROFILE_MANAGER
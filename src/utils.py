@@ -1,17 +1,55 @@
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional
+
 from selenium_driverless import webdriver
 
 import akp.root
 from akp.selenium_driverless_ex import webdriver_ex
 
 
-async def start_driver():
-    browser_path = akp.root.get_external_project_root() / "browser"
+def get_browser_path() -> Path:
+    return akp.root.get_external_project_root() / "browser"
+
+
+async def start_driver(user_data_dir: Optional[Path] = None):
+    from llm import chatgpt_metrics
+
+    browser_path = get_browser_path()
     extensions_dir = browser_path / "extensions"
     extensions = [extensions_dir / "adguard"]
 
     options = webdriver.ChromeOptions()
     [options.add_extension(i) for i in extensions]
-    options.user_data_dir = browser_path / "user_data1"
+    options.user_data_dir = user_data_dir or browser_path / "user_data1"
     options.headless = True
 
-    return await webdriver_ex.ChromeEx(options=options)
+    with chatgpt_metrics.stage("start_driver"):
+        return await webdriver_ex.ChromeEx(options=options)
+
+
+@asynccontextmanager
+async def driver_session(attach: Optional[str] = None):
+    """Driver on its own clone of the template profile, so several processes can run at once;
+    with `attach` - a tab of the browser already running at that DevTools address (see attach.py)."""
+    if attach:
+        from attach import attached_tab
+        from config.config import settings
+        from llm.chatgpt_config import get_config
+
+        async with attached_tab(attach, get_config(settings.chatgpt.config.name).main_page) as driver:
+            yield driver
+        return
+
+    from profiles import get_profile_manager
+
+    profiles = get_profile_manager()
+    profile = profiles.acquire()
+    driver = None
+    try:
+        driver = await start_driver(profile)
+        yield driver
+    finally:
+        if driver:
+            await driver.quit(clean_dirs=False)
+        profiles.release(profile)